@@ -0,0 +1,95 @@
+"""Micro-benchmark del extractor de JSON de ai_content_service.
+
+Compara el escáner lineal (ExtractorJSONIncremental) con la alternativa de
+intentar `raw_decode` en cada '{', sobre respuestas válidas, malformadas y
+muy grandes. Ejecutar desde la carpeta backend:
+
+    python benchmarks/json_extractor_benchmark.py
+"""
+import os
+import re
+import sys
+import json
+import timeit
+
+# Agregar el directorio backend al sys.path para permitir la importación de los servicios
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from services.ai_content_service.json_extractor import (  # noqa: E402
+    ExtractorJSONIncremental,
+    ErrorExtraccionJSON,
+    extraer_primer_objeto,
+)
+
+def raw_decode_en_cada_llave(texto: str):
+    """Alternativa ingenua: probar a decodificar desde cada '{' (cuadrática en el peor caso)."""
+    decoder = json.JSONDecoder()
+    pos = texto.find("{")
+    while pos != -1:
+        try:
+            return decoder.raw_decode(texto, pos)[0]
+        except json.JSONDecodeError:
+            pos = texto.find("{", pos + 1)
+    raise ValueError("sin JSON")
+
+def respuesta_valida(n_variaciones: int) -> str:
+    variaciones = [
+        {"titulo": f"Título {i} con {{llaves}} y \"comillas\"", "contenido": "Texto " * 20}
+        for i in range(n_variaciones)
+    ]
+    return "Claro, aquí tienes el JSON:\n" + json.dumps({"variaciones": variaciones}) + "\nEspero que te sirva."
+
+def respuesta_truncada(n_variaciones: int) -> str:
+    texto = respuesta_valida(n_variaciones)
+    return texto[: len(texto) * 2 // 3]
+
+def respuesta_llaves_sueltas(n: int) -> str:
+    # Muchas aperturas sin cierre: el peor caso para reintentar desde cada llave
+    return "{ " * n + '{"ok": true}'
+
+def medir(nombre: str, funcion, texto: str, repeticiones: int):
+    def ejecutar():
+        try:
+            funcion(texto)
+        except (ErrorExtraccionJSON, ValueError):
+            pass
+    segundos = min(timeit.repeat(ejecutar, number=repeticiones, repeat=3)) / repeticiones
+    print(f"  {nombre:<28} {segundos * 1000:>10.3f} ms")
+
+def medir_por_fragmentos(texto: str, tamano: int, repeticiones: int):
+    fragmentos = [texto[i:i + tamano] for i in range(0, len(texto), tamano)]
+
+    def ejecutar():
+        extractor = ExtractorJSONIncremental()
+        for fragmento in fragmentos:
+            if extractor.alimentar(fragmento) is not None:
+                break
+        try:
+            extractor.finalizar()
+        except ErrorExtraccionJSON:
+            pass
+    segundos = min(timeit.repeat(ejecutar, number=repeticiones, repeat=3)) / repeticiones
+    print(f"  {'lineal, fragmentos de ' + str(tamano):<28} {segundos * 1000:>10.3f} ms")
+
+def main():
+    try:
+        re.compile(r'\{(?:[^{}]|(?R))*\}')
+        print("El patrón recursivo (?R) compila en este intérprete.")
+    except re.error as e:
+        print(f"El patrón recursivo anterior no es válido en `re`: {e}")
+
+    casos = [
+        ("válida, 3 variaciones", respuesta_valida(3), 200),
+        ("válida, 2000 variaciones", respuesta_valida(2000), 5),
+        ("truncada, 2000 variaciones", respuesta_truncada(2000), 5),
+        ("2000 llaves sin cerrar", respuesta_llaves_sueltas(2000), 5),
+        ("20000 llaves sin cerrar", respuesta_llaves_sueltas(20000), 1),
+    ]
+    for nombre, texto, repeticiones in casos:
+        print(f"\n{nombre} ({len(texto) / 1024:.1f} KiB)")
+        medir("lineal (texto completo)", extraer_primer_objeto, texto, repeticiones)
+        medir_por_fragmentos(texto, 16, repeticiones)
+        medir("raw_decode en cada '{'", raw_decode_en_cada_llave, texto, repeticiones)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -51,3 +53,45 @@ def get_db():
         db.close()
 
 
+# Drivers asíncronos equivalentes a los síncronos de DATABASE_URL
+DRIVERS_ASINCRONOS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def url_asincrona(url: str) -> str:
+    """Traduce DATABASE_URL (psycopg2, pysqlite) a su driver asíncrono (asyncpg, aiosqlite)."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in DRIVERS_ASINCRONOS:
+        raise ValueError(f"No hay driver asíncrono configurado para '{backend}'.")
+    if url.drivername == backend or url.drivername in ("postgresql+psycopg2", "sqlite+pysqlite"):
+        url = url.set(drivername=DRIVERS_ASINCRONOS[backend])
+    return url.render_as_string(hide_password=False)
+
+# Motor asíncrono para las rutas: las consultas no bloquean el event loop.
+# El motor síncrono se mantiene para Alembic y los scripts de mantenimiento.
+ASYNC_DATABASE_URL = url_asincrona(DATABASE_URL)
+
+if 'sqlite' in DATABASE_URL:
+    async_engine = create_async_engine(ASYNC_DATABASE_URL)
+else:
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_size=20,
+        max_overflow=10,
+        pool_timeout=30,
+        pool_recycle=1800,
+        pool_pre_ping=True
+    )
+
+# expire_on_commit=False: los objetos devueltos siguen siendo legibles tras el commit
+# sin volver a consultar (un acceso perezoso fuera del contexto asíncrono fallaría)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# Dependencia para obtener la sesión asíncrona de la base de datos
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
@@ -2,10 +2,15 @@ import os
 from dotenv import load_dotenv
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
-from sqlalchemy.orm import Session
-from common.database.database import get_db
+from jose import JWTError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from common.database.database import get_async_db
 from services.auth_service.models import Usuario
+from services.auth_service.cache_usuarios import cache_usuarios
+from services.auth_service.security import tokens_verificados
+from services.auth_service.tokens import revocaciones_tokens
 
 # Cargar las variables de entorno desde el archivo .env en la carpeta config
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '../../.env'))
@@ -19,21 +24,26 @@ if not SECRET_KEY:
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 # Middleware para obtener el usuario actual
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=401, detail="No se pudo validar el token", headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        payload = tokens_verificados.verificar(token)
         email: str = payload.get("sub")
-        if email is None:
+        if email is None or revocaciones_tokens.esta_revocado(payload.get("jti")):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
 
-    # Buscar al usuario en la base de datos
-    usuario = db.query(Usuario).filter(Usuario.email == email).first()
+    # Buscar al usuario: primero en la caché de usuarios autenticados y, si no está, en la base de datos
+    usuario = await cache_usuarios.obtener(email)
     if usuario is None:
-        raise credentials_exception
+        marca = await cache_usuarios.marca(email)
+        resultado = await db.execute(select(Usuario).options(selectinload(Usuario.cuenta)).where(Usuario.email == email))
+        encontrado = resultado.scalars().first()
+        if encontrado is None:
+            raise credentials_exception
+        usuario = await cache_usuarios.guardar(encontrado, marca)
 
     return usuario
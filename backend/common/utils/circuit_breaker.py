@@ -0,0 +1,214 @@
+import os
+import math
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, Optional
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Valores por defecto de los circuit breakers; cada servicio puede ajustarlos al crear el suyo
+CB_VENTANA = float(os.getenv("CB_VENTANA", "30"))                      # Segundos de la ventana móvil
+CB_MUESTRAS_MINIMAS = int(os.getenv("CB_MUESTRAS_MINIMAS", "10"))      # Llamadas mínimas en la ventana para evaluar
+CB_UMBRAL_ERRORES = float(os.getenv("CB_UMBRAL_ERRORES", "0.5"))       # Proporción de fallos que abre el circuito
+CB_UMBRAL_LENTITUD = float(os.getenv("CB_UMBRAL_LENTITUD", "0.8"))     # Proporción de llamadas lentas que abre el circuito
+CB_ESPERA_APERTURA = float(os.getenv("CB_ESPERA_APERTURA", "30"))      # Segundos abierto antes de probar de nuevo
+CB_PRUEBAS_SEMIABIERTO = int(os.getenv("CB_PRUEBAS_SEMIABIERTO", "3")) # Llamadas de prueba correctas para cerrar
+
+CERRADO = "cerrado"
+ABIERTO = "abierto"
+SEMIABIERTO = "semiabierto"
+
+class CircuitoAbiertoError(Exception):
+    """El servicio externo está marcado como caído y la llamada se rechaza sin intentarla."""
+
+    def __init__(self, nombre: str, reintentar_en: float):
+        super().__init__(f"Circuito '{nombre}' abierto")
+        self.nombre = nombre
+        self.reintentar_en = reintentar_en
+
+    def como_http(self) -> HTTPException:
+        return HTTPException(
+            status_code=503,
+            detail=f"El servicio externo '{self.nombre}' no está disponible temporalmente. Intenta de nuevo más tarde.",
+            headers={"Retry-After": str(max(1, math.ceil(self.reintentar_en)))},
+        )
+
+class CircuitBreaker:
+    """Circuit breaker con estados cerrado, abierto y semiabierto.
+
+    En estado cerrado registra cada llamada en una ventana móvil de CB_VENTANA
+    segundos; si la proporción de fallos o de llamadas más lentas que
+    `latencia_lenta` supera su umbral, el circuito se abre y las llamadas se
+    rechazan al instante con CircuitoAbiertoError. Pasada la espera de
+    apertura, deja pasar unas pocas llamadas de prueba: si todas salen bien se
+    cierra y si alguna falla vuelve a abrirse. Es seguro entre hilos, por lo
+    que protege tanto código asíncrono como rutas síncronas del threadpool.
+    """
+
+    def __init__(
+        self,
+        nombre: str,
+        latencia_lenta: float,
+        es_fallo: Optional[Callable[[BaseException], bool]] = None,
+        ventana: float = CB_VENTANA,
+        muestras_minimas: int = CB_MUESTRAS_MINIMAS,
+        umbral_errores: float = CB_UMBRAL_ERRORES,
+        umbral_lentitud: float = CB_UMBRAL_LENTITUD,
+        espera_apertura: float = CB_ESPERA_APERTURA,
+        pruebas_semiabierto: int = CB_PRUEBAS_SEMIABIERTO,
+    ):
+        self.nombre = nombre
+        self.latencia_lenta = latencia_lenta
+        self.es_fallo = es_fallo or (lambda error: True)
+        self.ventana = ventana
+        self.muestras_minimas = muestras_minimas
+        self.umbral_errores = umbral_errores
+        self.umbral_lentitud = umbral_lentitud
+        self.espera_apertura = espera_apertura
+        self.pruebas_semiabierto = pruebas_semiabierto
+
+        self._lock = threading.Lock()
+        self._llamadas = deque()  # (instante, fallo, lenta)
+        self.estado = CERRADO
+        self._abierto_desde = 0.0
+        self._pruebas_en_curso = 0
+        self._pruebas_correctas = 0
+        self.estadisticas = {"rechazadas": 0, "aperturas": 0}
+
+    def _purgar(self, ahora: float):
+        while self._llamadas and self._llamadas[0][0] < ahora - self.ventana:
+            self._llamadas.popleft()
+
+    def _abrir(self, ahora: float, motivo: str):
+        self.estado = ABIERTO
+        self._abierto_desde = ahora
+        self._pruebas_en_curso = 0
+        self._pruebas_correctas = 0
+        self.estadisticas["aperturas"] += 1
+        logger.warning(f"Circuito '{self.nombre}' abierto: {motivo}")
+
+    def _reintentar_en(self, ahora: float) -> float:
+        return max(0.0, self._abierto_desde + self.espera_apertura - ahora)
+
+    def verificar(self):
+        """Falla rápido si el circuito está abierto, sin reservar una llamada de prueba."""
+        with self._lock:
+            ahora = time.monotonic()
+            if self.estado == ABIERTO and self._reintentar_en(ahora) > 0:
+                self.estadisticas["rechazadas"] += 1
+                raise CircuitoAbiertoError(self.nombre, self._reintentar_en(ahora))
+
+    def antes_de_llamar(self) -> bool:
+        """Autoriza una llamada; devuelve si es una llamada de prueba del estado semiabierto."""
+        with self._lock:
+            ahora = time.monotonic()
+            if self.estado == ABIERTO:
+                if self._reintentar_en(ahora) > 0:
+                    self.estadisticas["rechazadas"] += 1
+                    raise CircuitoAbiertoError(self.nombre, self._reintentar_en(ahora))
+                self.estado = SEMIABIERTO
+                logger.info(f"Circuito '{self.nombre}' semiabierto: probando el servicio")
+            if self.estado == SEMIABIERTO:
+                if self._pruebas_en_curso + self._pruebas_correctas >= self.pruebas_semiabierto:
+                    self.estadisticas["rechazadas"] += 1
+                    raise CircuitoAbiertoError(self.nombre, 1)
+                self._pruebas_en_curso += 1
+                return True
+            return False
+
+    def registrar(self, prueba: bool, fallo: bool, latencia: float):
+        with self._lock:
+            ahora = time.monotonic()
+            lenta = latencia >= self.latencia_lenta
+            if prueba:
+                self._pruebas_en_curso = max(0, self._pruebas_en_curso - 1)
+                if self.estado != SEMIABIERTO:
+                    return
+                if fallo or lenta:
+                    self._abrir(ahora, "falló una llamada de prueba")
+                    return
+                self._pruebas_correctas += 1
+                if self._pruebas_correctas >= self.pruebas_semiabierto:
+                    self.estado = CERRADO
+                    self._llamadas.clear()
+                    logger.info(f"Circuito '{self.nombre}' cerrado: el servicio se ha recuperado")
+                return
+
+            if self.estado != CERRADO:
+                return
+            self._llamadas.append((ahora, fallo, lenta))
+            self._purgar(ahora)
+            total = len(self._llamadas)
+            if total < self.muestras_minimas:
+                return
+            fallos = sum(1 for _, es_fallo, _ in self._llamadas if es_fallo)
+            lentas = sum(1 for _, _, es_lenta in self._llamadas if es_lenta)
+            if fallos / total >= self.umbral_errores:
+                self._abrir(ahora, f"{fallos}/{total} llamadas fallidas en {self.ventana:.0f}s")
+            elif lentas / total >= self.umbral_lentitud:
+                self._abrir(ahora, f"{lentas}/{total} llamadas de más de {self.latencia_lenta:.1f}s")
+
+    def _registrar_excepcion(self, prueba: bool, error: BaseException, latencia: float):
+        if not isinstance(error, Exception):
+            # Cancelación (p. ej. el intento perdedor de una cobertura): no cuenta ni a favor ni en contra
+            if prueba:
+                with self._lock:
+                    self._pruebas_en_curso = max(0, self._pruebas_en_curso - 1)
+            return
+        # Los errores del cliente (4xx) no dicen nada de la salud del servicio
+        self.registrar(prueba, self.es_fallo(error), latencia if self.es_fallo(error) else 0.0)
+
+    @contextmanager
+    def proteger(self):
+        """Protege una llamada síncrona al servicio externo."""
+        prueba = self.antes_de_llamar()
+        inicio = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self._registrar_excepcion(prueba, e, time.monotonic() - inicio)
+            raise
+        self.registrar(prueba, False, time.monotonic() - inicio)
+
+    @asynccontextmanager
+    async def proteger_async(self):
+        """Protege una llamada asíncrona al servicio externo."""
+        prueba = self.antes_de_llamar()
+        inicio = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self._registrar_excepcion(prueba, e, time.monotonic() - inicio)
+            raise
+        self.registrar(prueba, False, time.monotonic() - inicio)
+
+    def resumen(self) -> dict:
+        with self._lock:
+            ahora = time.monotonic()
+            self._purgar(ahora)
+            total = len(self._llamadas)
+            fallos = sum(1 for _, fallo, _ in self._llamadas if fallo)
+            lentas = sum(1 for _, _, lenta in self._llamadas if lenta)
+            return {
+                **self.estadisticas,
+                "estado": self.estado,
+                "llamadas_ventana": total,
+                "tasa_error": round(fallos / total, 4) if total else 0.0,
+                "tasa_lentas": round(lentas / total, 4) if total else 0.0,
+                "reintentar_en_s": round(self._reintentar_en(ahora), 1) if self.estado == ABIERTO else 0.0,
+            }
+
+# Registro de todos los circuitos del proceso, para exponer su estado
+_circuitos: Dict[str, CircuitBreaker] = {}
+
+def crear_circuit_breaker(nombre: str, latencia_lenta: float, **opciones) -> CircuitBreaker:
+    circuito = CircuitBreaker(nombre, latencia_lenta, **opciones)
+    _circuitos[nombre] = circuito
+    return circuito
+
+def estado_circuitos() -> dict:
+    return {nombre: circuito.resumen() for nombre, circuito in _circuitos.items()}
@@ -1,6 +1,12 @@
 import redis.asyncio as aioredis
+from collections import OrderedDict
 from datetime import timedelta
+from typing import List, Optional, Tuple
 import os
+import time
+import uuid
+import hashlib
+import secrets
 import asyncio
 import logging
 
@@ -8,7 +14,174 @@ import logging
 logger = logging.getLogger("uvicorn.error")
 logger.setLevel(logging.INFO)
 
-SESSION_TIMEOUT = timedelta(minutes=30)
+SESSION_TIMEOUT = timedelta(minutes=30)  # Expiración deslizante: se renueva con cada uso de la sesión
+
+# Claves de Redis: una hash por sesión y un set con las sesiones activas de cada usuario
+SESION_PREFIJO = "sesion:"
+SESIONES_USUARIO_PREFIJO = "sesiones_usuario:"
+
+# Sesiones del índice que se comprueban (y podan si caducaron) al crear otra
+SESIONES_PODA_MUESTRA = int(os.getenv("SESIONES_PODA_MUESTRA", "10"))
+
+# Cierra todas las sesiones del índice (salvo la indicada) en una sola ida y vuelta,
+# avisando a las cachés L1 de cada instancia. Devuelve [session_id, jwt, ...] de las cerradas.
+# Las claves `sesion:<id>` se construyen dentro del script a partir del índice y no se
+# declaran en KEYS: requiere Redis standalone (no funciona en Redis Cluster ni en
+# servicios gestionados con sharding).
+_SCRIPT_CERRAR_SESIONES = """
+local cerradas = {}
+for _, id in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    if id ~= ARGV[3] then
+        local jwt = redis.call('HGET', ARGV[1] .. id, 'jwt')
+        redis.call('DEL', ARGV[1] .. id)
+        redis.call('SREM', KEYS[1], id)
+        redis.call('PUBLISH', ARGV[2], ARGV[4] .. '|' .. id)
+        if jwt then
+            table.insert(cerradas, id)
+            table.insert(cerradas, jwt)
+        end
+    end
+end
+return cerradas
+"""
+
+def _clave_sesion(session_id: str) -> str:
+    return SESION_PREFIJO + session_id
+
+def _clave_indice(id_usuario) -> str:
+    return f"{SESIONES_USUARIO_PREFIJO}{id_usuario}"
+
+def referencia_sesion(session_id: str) -> str:
+    """Identificador público de una sesión: el session_id es una credencial y no se expone ni se registra."""
+    return hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:16]
+
+# Caché L1 de sesiones en memoria delante de Redis
+SESIONES_L1_HABILITADA = os.getenv("SESIONES_L1_HABILITADA", "true").lower() == "true"
+SESIONES_L1_MAX_ENTRADAS = int(os.getenv("SESIONES_L1_MAX_ENTRADAS", "10000"))
+SESIONES_L1_TTL = int(os.getenv("SESIONES_L1_TTL", "60"))  # Nunca supera lo que le queda de vida a la sesión
+CANAL_INVALIDACION_SESIONES = "sesiones:invalidacion"
+
+class CacheSesiones:
+    """Near-cache de session_id -> JWT, coherente entre workers e instancias.
+
+    delete_jwt y el cierre de todas las sesiones publican el session_id en CANAL_INVALIDACION_SESIONES y
+    cada proceso lo descarta de su caché al recibirlo. Mientras el suscriptor no
+    está conectado la caché no se usa (y se vacía al reconectar), para no servir
+    sesiones que otra instancia pudo cerrar en ese intervalo.
+    """
+
+    def __init__(self, max_entradas: int = SESIONES_L1_MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self.instancia = uuid.uuid4().hex  # Para ignorar los mensajes publicados por este mismo proceso
+        self._entradas = OrderedDict()  # session_id -> (jwt, expira_en)
+        self._tarea: Optional[asyncio.Task] = None
+        self._suscrito = False
+        self._invalidaciones = 0  # Contador para no guardar lecturas que se cruzaron con una invalidación
+        self.estadisticas = {"hits": 0, "misses": 0, "idas_redis": 0, "invalidaciones_recibidas": 0, "reconexiones": 0}
+
+    @property
+    def activa(self) -> bool:
+        return SESIONES_L1_HABILITADA and self._suscrito
+
+    def obtener(self, session_id: str) -> Optional[str]:
+        if not self.activa:
+            return None
+        entrada = self._entradas.get(session_id)
+        if entrada is None:
+            return None
+        jwt, expira_en = entrada
+        if expira_en <= time.monotonic():
+            del self._entradas[session_id]
+            return None
+        self._entradas.move_to_end(session_id)
+        self.estadisticas["hits"] += 1
+        return jwt
+
+    def marca(self) -> int:
+        return self._invalidaciones
+
+    def guardar(self, session_id: str, jwt: str, ttl_restante: float, marca: Optional[int] = None):
+        if not self.activa or ttl_restante <= 0:
+            return
+        if marca is not None and marca != self._invalidaciones:
+            return  # Llegó una invalidación mientras se leía de Redis: el valor puede estar obsoleto
+        self._entradas[session_id] = (jwt, time.monotonic() + min(SESIONES_L1_TTL, ttl_restante))
+        self._entradas.move_to_end(session_id)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    def descartar(self, session_id: str):
+        self._invalidaciones += 1
+        self._entradas.pop(session_id, None)
+
+    async def publicar_invalidacion(self, redis, session_id: str):
+        try:
+            await redis.publish(CANAL_INVALIDACION_SESIONES, f"{self.instancia}|{session_id}")
+        except Exception as e:
+            logger.warning(f"No se pudo publicar la invalidación de la sesión {session_id}: {e}")
+
+    def iniciar(self, redis):
+        """Arranca el suscriptor de invalidaciones en el event loop actual."""
+        if self._tarea is None and SESIONES_L1_HABILITADA:
+            self._tarea = asyncio.create_task(self._escuchar(redis))
+
+    async def detener(self):
+        if self._tarea is None:
+            return
+        self._tarea.cancel()
+        try:
+            await self._tarea
+        except asyncio.CancelledError:
+            pass
+        self._tarea = None
+        self._suscrito = False
+        self._entradas.clear()
+
+    async def _escuchar(self, redis):
+        espera = 0.5
+        while True:
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.subscribe(CANAL_INVALIDACION_SESIONES)
+                # Lo guardado antes de (re)conectar pudo invalidarse sin que nos enterásemos
+                self._entradas.clear()
+                self._suscrito = True
+                espera = 0.5
+                while True:
+                    mensaje = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if mensaje is None:
+                        continue
+                    instancia, _, session_id = mensaje["data"].partition("|")
+                    if instancia != self.instancia:
+                        self.descartar(session_id)
+                        self.estadisticas["invalidaciones_recibidas"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._suscrito = False
+                self.estadisticas["reconexiones"] += 1
+                logger.warning(f"Suscripción de invalidación de sesiones interrumpida: {e}")
+                await asyncio.sleep(espera)
+                espera = min(espera * 2, 10)
+            finally:
+                self._suscrito = False
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    def resumen(self) -> dict:
+        total = self.estadisticas["hits"] + self.estadisticas["misses"]
+        return {
+            **self.estadisticas,
+            "activa": self.activa,
+            "entradas": len(self._entradas),
+            "idas_redis_ahorradas": self.estadisticas["hits"],
+            "tasa_aciertos": round(self.estadisticas["hits"] / total, 4) if total else 0.0,
+        }
+
+# Instancia compartida por todas las instancias de SessionManager del proceso
+cache_sesiones = CacheSesiones()
 
 class SessionManager:
     redis_client = None
@@ -30,6 +203,7 @@ class SessionManager:
                 pong = await cls.redis_client.ping()
                 if pong:
                     logger.info("Conexión a Redis exitosa.")
+                cache_sesiones.iniciar(cls.redis_client)
             except Exception as e:
                 logger.error(f"Error conectando a Redis: {e}")
                 raise
@@ -38,6 +212,7 @@ class SessionManager:
     async def close_redis(cls):
         """Cierra la conexión a Redis si está establecida."""
         if cls.redis_client:
+            await cache_sesiones.detener()
             await cls.redis_client.close()
             cls.redis_client = None
             logger.info("Conexión a Redis cerrada.")
@@ -48,34 +223,139 @@ class SessionManager:
             raise Exception("Redis no está inicializado. Llama a 'SessionManager.initialize_redis()' primero.")
         self.redis = SessionManager.redis_client
 
-    async def store_jwt(self, session_id: str, jwt_token: str):
-        """Almacena un JWT asociado a una sesión."""
+    async def crear_sesion(self, id_usuario: int, jwt_token: str, agente: str = "", ip: str = "") -> str:
+        """Crea una sesión con un identificador aleatorio y opaco, propia de cada dispositivo."""
+        session_id = secrets.token_urlsafe(32)
+        ttl = int(SESSION_TIMEOUT.total_seconds())
         try:
-            await self.redis.set(session_id, jwt_token, ex=int(SESSION_TIMEOUT.total_seconds()))
-            logger.info(f"JWT almacenado para sesión: {session_id}")
+            await self._podar_muestra(id_usuario)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.hset(_clave_sesion(session_id), mapping={
+                    "jwt": jwt_token,
+                    "id_usuario": id_usuario,
+                    "creada": time.time(),
+                    "agente": agente[:256],
+                    "ip": ip,
+                })
+                pipe.expire(_clave_sesion(session_id), ttl)
+                pipe.sadd(_clave_indice(id_usuario), session_id)
+                await pipe.execute()
+            cache_sesiones.guardar(session_id, jwt_token, ttl)
+            logger.info(f"Sesión {referencia_sesion(session_id)} creada para el usuario {id_usuario}")
+            return session_id
         except Exception as e:
-            logger.error(f"Error almacenando JWT: {e}")
+            logger.error(f"Error creando la sesión: {e}")
             raise
 
+    async def _podar_muestra(self, id_usuario: int):
+        """Retira del índice las caducadas de una muestra acotada de sus sesiones.
+
+        Cada inicio de sesión cuesta como mucho SESIONES_PODA_MUESTRA comprobaciones
+        y el índice no crece sin límite aunque el usuario nunca liste sus sesiones;
+        la poda completa la hacen listar_sesiones y cerrar_todas.
+        """
+        ids = await self.redis.srandmember(_clave_indice(id_usuario), SESIONES_PODA_MUESTRA)
+        if not ids:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for session_id in ids:
+                pipe.exists(_clave_sesion(session_id))
+            existen = await pipe.execute()
+        caducadas = [session_id for session_id, existe in zip(ids, existen) if not existe]
+        if caducadas:
+            await self.redis.srem(_clave_indice(id_usuario), *caducadas)
+
     async def get_jwt(self, session_id: str):
-        """Recupera un JWT asociado a una sesión."""
+        """Recupera el JWT de una sesión (primero de la caché L1 del proceso) y renueva su expiración."""
+        jwt = cache_sesiones.obtener(session_id)
+        if jwt is not None:
+            return jwt
+        marca = cache_sesiones.marca()
+        ttl = int(SESSION_TIMEOUT.total_seconds())
         try:
-            jwt = await self.redis.get(session_id)
-            logger.info(f"JWT recuperado para sesión: {session_id}")
+            # Lectura y renovación en una sola ida y vuelta; con la caché L1 la renovación
+            # ocurre, como mucho, cada SESIONES_L1_TTL segundos por sesión
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hget(_clave_sesion(session_id), "jwt")
+                pipe.expire(_clave_sesion(session_id), ttl)
+                jwt, _ = await pipe.execute()
+            cache_sesiones.estadisticas["misses"] += 1
+            cache_sesiones.estadisticas["idas_redis"] += 1
+            if jwt is not None:
+                cache_sesiones.guardar(session_id, jwt, ttl, marca)
             return jwt
         except Exception as e:
             logger.error(f"Error obteniendo JWT: {e}")
             raise
 
     async def delete_jwt(self, session_id: str):
-        """Elimina un JWT asociado a una sesión."""
+        """Cierra una sesión y la retira del índice de su usuario."""
         try:
-            await self.redis.delete(session_id)
-            logger.info(f"JWT eliminado para sesión: {session_id}")
+            id_usuario = await self.redis.hget(_clave_sesion(session_id), "id_usuario")
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(_clave_sesion(session_id))
+                if id_usuario is not None:
+                    pipe.srem(_clave_indice(id_usuario), session_id)
+                await pipe.execute()
+            cache_sesiones.descartar(session_id)
+            await cache_sesiones.publicar_invalidacion(self.redis, session_id)
+            logger.info(f"Sesión {referencia_sesion(session_id)} cerrada")
         except Exception as e:
             logger.error(f"Error eliminando JWT: {e}")
             raise
 
+    async def listar_sesiones(self, id_usuario: int, sesion_actual: Optional[str] = None) -> List[dict]:
+        """Sesiones activas del usuario leídas del índice con un único pipeline (sin SCAN de claves)."""
+        ids = sorted(await self.redis.smembers(_clave_indice(id_usuario)))
+        if not ids:
+            return []
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for session_id in ids:
+                pipe.hmget(_clave_sesion(session_id), "creada", "agente", "ip")
+                pipe.ttl(_clave_sesion(session_id))
+            resultados = await pipe.execute()
+
+        ahora = time.time()
+        ttl_maximo = SESSION_TIMEOUT.total_seconds()
+        sesiones, caducadas = [], []
+        for session_id, (creada, agente, ip), ttl in zip(ids, resultados[0::2], resultados[1::2]):
+            if creada is None or ttl < 0:
+                caducadas.append(session_id)
+                continue
+            sesiones.append({
+                "id": referencia_sesion(session_id),
+                "actual": session_id == sesion_actual,
+                "creada": float(creada),
+                # La expiración se renueva con cada uso: lo consumido del TTL da la última actividad
+                "ultima_actividad": round(ahora - (ttl_maximo - ttl), 3),
+                "expira": round(ahora + ttl, 3),
+                "agente": agente,
+                "ip": ip,
+            })
+        if caducadas:
+            await self.redis.srem(_clave_indice(id_usuario), *caducadas)
+        return sorted(sesiones, key=lambda sesion: sesion["ultima_actividad"], reverse=True)
+
+    async def cerrar_todas(self, id_usuario: int, excepto: Optional[str] = None) -> List[Tuple[str, str]]:
+        """Cierra todas las sesiones del usuario (salvo `excepto`) en una sola ida y vuelta.
+
+        Devuelve los pares (session_id, jwt) cerrados, p. ej. para revocar sus tokens.
+        Usa _SCRIPT_CERRAR_SESIONES, que requiere Redis standalone.
+        """
+        try:
+            resultado = await self.redis.eval(
+                _SCRIPT_CERRAR_SESIONES, 1, _clave_indice(id_usuario),
+                SESION_PREFIJO, CANAL_INVALIDACION_SESIONES, excepto or "", cache_sesiones.instancia,
+            )
+        except Exception as e:
+            logger.error(f"Error cerrando las sesiones del usuario {id_usuario}: {e}")
+            raise
+        cerradas = list(zip(resultado[0::2], resultado[1::2]))
+        for session_id, _ in cerradas:
+            cache_sesiones.descartar(session_id)
+        logger.info(f"Cerradas {len(cerradas)} sesiones del usuario {id_usuario}")
+        return cerradas
+
     @staticmethod
     async def test_redis_connection():
         """Prueba la conexión a Redis."""
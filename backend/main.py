@@ -1,7 +1,7 @@
 # from ddtrace import patch_all, tracer
 # patch_all()  # Habilita el trazado automático para todas las dependencias compatibles
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from services.ai_content_service.routes import router as ai_content_router
 from services.auth_service.routes import router as auth_router
@@ -9,6 +9,11 @@ from services.user_service.routes import router as user_router
 from services.document_service.routes import router as document_router
 from services.product_service.routes import router as product_router
 from services.meta_ads_service.routes import router as meta_ads_router
+from common.utils.circuit_breaker import estado_circuitos
+from common.utils.session_manager import cache_sesiones
+from services.auth_service.cache_usuarios import cache_usuarios
+from services.auth_service.security import get_current_user, tokens_verificados
+from services.auth_service.tokens import revocaciones_tokens
 from dotenv import load_dotenv
 import os
 from mangum import Mangum  # Importar Mangum para Lambda
@@ -56,17 +61,33 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     from common.utils.session_manager import SessionManager
+    from services.ai_content_service.persistencia import persistencia_documentos
+    # Volcador en segundo plano de los documentos generados
+    persistencia_documentos.iniciar()
     try:
         await SessionManager.initialize_redis()
     except Exception as e:
         logger.error(f"Fallo en la inicialización de Redis: {e}")
         # Dependiendo de la lógica, podrías querer terminar la aplicación o manejar el error de otra manera
+    # Invalidaciones de la caché de usuarios publicadas por otras instancias
+    cache_usuarios.iniciar(SessionManager.redis_client)
+    # Copia local de los tokens revocados (modo sin estado)
+    revocaciones_tokens.iniciar()
 
 # Cierre de servicios al cerrar la aplicación
 @app.on_event("shutdown")
 async def shutdown_event():
     from common.utils.session_manager import SessionManager
+    from services.ai_content_service.proveedores import cerrar_proveedor
+    from services.ai_content_service.persistencia import persistencia_documentos
+    from common.database.database import async_engine
+    # Primero se vacía la cola de documentos pendientes para no perder lo ya generado
+    await persistencia_documentos.detener()
+    await async_engine.dispose()
+    await revocaciones_tokens.detener()
+    await cache_usuarios.detener()
     await SessionManager.close_redis()
+    await cerrar_proveedor()
 
 # Incluir routers
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
@@ -81,6 +102,21 @@ app.include_router(meta_ads_router, prefix="/meta_ads", tags=["meta_ads"])
 async def root():
     return {"message": "Bienvenido a la API publicitaria"}
 
+# Estado de los circuit breakers de los servicios externos (OpenAI, Graph API)
+@app.get("/estado/circuitos", response_class=JSONResponse, dependencies=[Depends(get_current_user)])
+async def estado_circuitos_endpoint():
+    return estado_circuitos()
+
+# Cachés de la autenticación (sesiones, usuarios autenticados, tokens verificados y revocados)
+@app.get("/estado/autenticacion", response_class=JSONResponse, dependencies=[Depends(get_current_user)])
+async def estado_autenticacion_endpoint():
+    return {
+        "sesiones": cache_sesiones.resumen(),
+        "usuarios": cache_usuarios.resumen(),
+        "tokens": tokens_verificados.resumen(),
+        "revocaciones": revocaciones_tokens.resumen(),
+    }
+
 # Adaptador Mangum para ejecutar en AWS Lambda
 handler = Mangum(app)
 
@@ -0,0 +1,100 @@
+"""Deduplicar documentos por hash de contenido
+
+Revision ID: 9c4e1f7a2b3d
+Revises: 72332e4bcd55
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+import hashlib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4e1f7a2b3d'
+down_revision: Union[str, None] = '72332e4bcd55'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+LOTE = 1000
+
+
+def upgrade() -> None:
+    op.add_column('documentos', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.add_column('documentos', sa.Column('veces_generado', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('documentos', sa.Column('fecha_ultima_generacion', sa.DateTime(), nullable=True))
+
+    # Calcular el hash de los documentos existentes y fundir los duplicados de cada usuario
+    # y tipo de documento en el más antiguo, conservando cuántas veces se generó y la fecha de la última vez
+    conexion = op.get_bind()
+    documentos = sa.table(
+        'documentos',
+        sa.column('id_documento', sa.Integer),
+        sa.column('id_usuario', sa.Integer),
+        sa.column('tipo_documento', sa.String),
+        sa.column('contenido', sa.Text),
+        sa.column('fecha_creacion', sa.DateTime),
+        sa.column('content_hash', sa.String),
+        sa.column('veces_generado', sa.Integer),
+        sa.column('fecha_ultima_generacion', sa.DateTime),
+    )
+    # Se recorre por páginas de id_documento (sin cargar todos los contenidos a la vez): en memoria
+    # solo queda clave -> conservado, y los duplicados de cada página se borran al terminarla
+    conservados = {}
+    ultimo_id = None
+    while True:
+        consulta = sa.select(
+            documentos.c.id_documento, documentos.c.id_usuario, documentos.c.tipo_documento, documentos.c.contenido,
+            documentos.c.fecha_creacion
+        ).order_by(documentos.c.id_documento).limit(LOTE)
+        if ultimo_id is not None:
+            consulta = consulta.where(documentos.c.id_documento > ultimo_id)
+        filas = conexion.execute(consulta).fetchall()
+        if not filas:
+            break
+        ultimo_id = filas[-1].id_documento
+        duplicados = []
+        for id_documento, id_usuario, tipo_documento, contenido, fecha_creacion in filas:
+            content_hash = hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+            clave = (id_usuario, tipo_documento, content_hash)
+            if clave in conservados:
+                conservado = conservados[clave]
+                conservado['veces_generado'] += 1
+                conservado['fecha_ultima_generacion'] = max(conservado['fecha_ultima_generacion'], fecha_creacion)
+                duplicados.append(id_documento)
+            else:
+                conservados[clave] = {
+                    'id': id_documento,
+                    'content_hash': content_hash,
+                    'veces_generado': 1,
+                    'fecha_ultima_generacion': fecha_creacion,
+                }
+        if duplicados:
+            conexion.execute(documentos.delete().where(documentos.c.id_documento.in_(duplicados)))
+
+    actualizacion = documentos.update().where(documentos.c.id_documento == sa.bindparam('id')).values(
+        content_hash=sa.bindparam('content_hash'),
+        veces_generado=sa.bindparam('veces_generado'),
+        fecha_ultima_generacion=sa.bindparam('fecha_ultima_generacion'),
+    )
+    valores = list(conservados.values())
+    for inicio in range(0, len(valores), LOTE):
+        conexion.execute(actualizacion, valores[inicio:inicio + LOTE])
+
+    with op.batch_alter_table('documentos') as batch_op:
+        batch_op.alter_column('content_hash', existing_type=sa.String(length=64), nullable=False)
+        batch_op.alter_column('fecha_ultima_generacion', existing_type=sa.DateTime(), nullable=False)
+    op.create_index(
+        'ix_documentos_usuario_tipo_hash', 'documentos', ['id_usuario', 'tipo_documento', 'content_hash'], unique=True
+    )
+
+
+def downgrade() -> None:
+    # Los duplicados fundidos no se recrean: solo se conserva su recuento en veces_generado
+    op.drop_index('ix_documentos_usuario_tipo_hash', table_name='documentos')
+    with op.batch_alter_table('documentos') as batch_op:
+        batch_op.drop_column('fecha_ultima_generacion')
+        batch_op.drop_column('veces_generado')
+        batch_op.drop_column('content_hash')
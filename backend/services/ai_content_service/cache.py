@@ -0,0 +1,130 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional
+from pydantic import BaseModel
+from common.utils.session_manager import SessionManager
+
+logger = logging.getLogger(__name__)
+
+# Configuración de la caché de respuestas del LLM
+CACHE_HABILITADA = os.getenv("LLM_CACHE_HABILITADA", "true").lower() == "true"
+CACHE_MAX_ENTRADAS = int(os.getenv("LLM_CACHE_MAX_ENTRADAS", "1000"))    # Tamaño máximo del nivel en memoria
+CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))                      # TTL por defecto (segundos)
+CACHE_PREFIJO = "llm_cache:"
+
+# Endpoints que no deben usar la caché (opt-out), separados por comas
+ENDPOINTS_EXCLUIDOS = {
+    e.strip() for e in os.getenv("LLM_CACHE_EXCLUIR", "").split(",") if e.strip()
+}
+
+# TTL específicos por endpoint; los no listados usan CACHE_TTL
+TTL_POR_ENDPOINT = {
+    "definir_campana": CACHE_TTL,
+    "definir_publico_ubicaciones": CACHE_TTL,
+    "elegir_formato_cta": CACHE_TTL * 6,  # Selección sobre opciones fijas: cambia poco
+    "crear_contenido_creativo": CACHE_TTL,
+    "create_heading": CACHE_TTL,
+}
+
+def _normalizar(valor):
+    """Normaliza las entradas para que variaciones triviales compartan la misma clave."""
+    if isinstance(valor, BaseModel):
+        valor = valor.model_dump()
+    if isinstance(valor, str):
+        return re.sub(r"\s+", " ", valor).strip().casefold()
+    if isinstance(valor, dict):
+        return {k: _normalizar(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_normalizar(v) for v in valor]
+    return valor
+
+def construir_clave_solicitud(endpoint: str, datos, version_prompt: str) -> str:
+    """Devuelve la clave que identifica una solicitud: endpoint, versión del prompt y entradas normalizadas."""
+    contenido = json.dumps(
+        {"endpoint": endpoint, "version": version_prompt, "datos": _normalizar(datos)},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    digest = hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+    return f"{endpoint}:{digest}"
+
+class CacheRespuestas:
+    """Caché de dos niveles: LRU en memoria delante de Redis."""
+
+    def __init__(self, max_entradas: int = CACHE_MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self._memoria = OrderedDict()  # clave -> (valor, expira_en)
+        self.estadisticas = {"hits_memoria": 0, "hits_redis": 0, "misses": 0, "errores_redis": 0}
+
+    @staticmethod
+    def habilitada_para(clave: str) -> bool:
+        """Indica si el endpoint de la clave participa en la caché (opt-out por endpoint)."""
+        return CACHE_HABILITADA and clave.split(":", 1)[0] not in ENDPOINTS_EXCLUIDOS
+
+    @staticmethod
+    def _ttl(clave: str) -> int:
+        endpoint = clave.split(":", 1)[0]
+        return TTL_POR_ENDPOINT.get(endpoint, CACHE_TTL)
+
+    def _guardar_en_memoria(self, clave: str, valor: str, ttl: int):
+        self._memoria[clave] = (valor, time.monotonic() + ttl)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_entradas:
+            self._memoria.popitem(last=False)
+
+    async def obtener(self, clave: str) -> Optional[str]:
+        """Busca primero en memoria y luego en Redis; promueve a memoria los hits de Redis."""
+        entrada = self._memoria.get(clave)
+        if entrada is not None:
+            valor, expira_en = entrada
+            if expira_en > time.monotonic():
+                self._memoria.move_to_end(clave)
+                self.estadisticas["hits_memoria"] += 1
+                return valor
+            del self._memoria[clave]
+
+        redis = SessionManager.redis_client
+        if redis is not None:
+            try:
+                valor = await redis.get(CACHE_PREFIJO + clave)
+                if valor is not None:
+                    ttl_restante = await redis.ttl(CACHE_PREFIJO + clave)
+                    self._guardar_en_memoria(clave, valor, ttl_restante if ttl_restante > 0 else self._ttl(clave))
+                    self.estadisticas["hits_redis"] += 1
+                    return valor
+            except Exception as e:
+                self.estadisticas["errores_redis"] += 1
+                logger.warning(f"Error leyendo la caché de Redis: {e}")
+
+        self.estadisticas["misses"] += 1
+        return None
+
+    async def guardar(self, clave: str, valor: str):
+        """Guarda la respuesta en ambos niveles con el TTL del endpoint."""
+        ttl = self._ttl(clave)
+        self._guardar_en_memoria(clave, valor, ttl)
+        redis = SessionManager.redis_client
+        if redis is not None:
+            try:
+                await redis.set(CACHE_PREFIJO + clave, valor, ex=ttl)
+            except Exception as e:
+                self.estadisticas["errores_redis"] += 1
+                logger.warning(f"Error escribiendo en la caché de Redis: {e}")
+
+    def resumen(self) -> dict:
+        """Devuelve los contadores de hits/misses y la tasa de aciertos."""
+        hits = self.estadisticas["hits_memoria"] + self.estadisticas["hits_redis"]
+        total = hits + self.estadisticas["misses"]
+        return {
+            **self.estadisticas,
+            "entradas_memoria": len(self._memoria),
+            "tasa_aciertos": round(hits / total, 4) if total else 0.0,
+        }
+
+# Instancia compartida por todos los handlers del servicio
+cache_respuestas = CacheRespuestas()
@@ -0,0 +1,86 @@
+import os
+from collections import defaultdict
+from typing import Dict, List
+
+# Modelos de la cascada: primero el más barato y rápido, luego el más capaz
+MODELO_BASICO = os.getenv("LLM_MODELO_BASICO", "gpt-4o-mini")
+MODELO_AVANZADO = os.getenv("LLM_MODELO_AVANZADO", "gpt-4o")
+
+# Cascada por endpoint (se puede sobrescribir con LLM_CASCADA_<ENDPOINT>="modelo1,modelo2"):
+# - elegir_formato_cta es una clasificación sobre opciones cerradas: basta el modelo básico, que
+#   como último de su cascada tiene el intento de reparación.
+# - Los encabezados y las definiciones de campaña y público son textos cortos o estructurados:
+#   empiezan por el modelo básico y solo escalan si su respuesta no supera la validación.
+# - crear_contenido_creativo depende sobre todo de la calidad de la redacción, que la validación
+#   no mide: va directamente al modelo avanzado.
+CASCADAS_POR_DEFECTO: Dict[str, List[str]] = {
+    "elegir_formato_cta": [MODELO_BASICO],
+    "create_heading": [MODELO_BASICO, MODELO_AVANZADO],
+    "crear_contenido_creativo": [MODELO_AVANZADO],
+    "definir_campana": [MODELO_BASICO, MODELO_AVANZADO],
+    "definir_publico_ubicaciones": [MODELO_BASICO, MODELO_AVANZADO],
+}
+
+def _cascada_configurada(endpoint: str) -> List[str]:
+    valor = os.getenv(f"LLM_CASCADA_{endpoint.upper()}")
+    if valor:
+        return [modelo.strip() for modelo in valor.split(",") if modelo.strip()]
+    return CASCADAS_POR_DEFECTO.get(endpoint, [MODELO_BASICO])
+
+class EnrutadorModelos:
+    """Elige la cascada de modelos de cada endpoint y registra qué modelo resolvió cada respuesta."""
+
+    def __init__(self):
+        self._cascadas = {endpoint: _cascada_configurada(endpoint) for endpoint in CASCADAS_POR_DEFECTO}
+        # Por endpoint y modelo: llamadas, respuestas válidas, latencia y tokens acumulados
+        self._por_modelo = defaultdict(
+            lambda: defaultdict(lambda: {"llamadas": 0, "validas": 0, "latencia_total": 0.0, "tokens_salida": 0})
+        )
+        self._por_endpoint = defaultdict(lambda: {"respuestas": 0, "escaladas": 0})
+
+    def cascada(self, endpoint: str) -> List[str]:
+        if endpoint not in self._cascadas:
+            self._cascadas[endpoint] = _cascada_configurada(endpoint)
+        return self._cascadas[endpoint]
+
+    def modelo_mas_capaz(self, endpoint: str) -> str:
+        return self.cascada(endpoint)[-1]
+
+    def registrar_intento(self, endpoint: str, modelo: str, valida: bool, latencia: float, tokens_salida=None):
+        estadisticas = self._por_modelo[endpoint][modelo]
+        estadisticas["llamadas"] += 1
+        estadisticas["validas"] += int(valida)
+        estadisticas["latencia_total"] += latencia
+        estadisticas["tokens_salida"] += tokens_salida or 0
+
+    def registrar_respuesta(self, endpoint: str, escalada: bool):
+        estadisticas = self._por_endpoint[endpoint]
+        estadisticas["respuestas"] += 1
+        estadisticas["escaladas"] += int(escalada)
+
+    def resumen(self) -> dict:
+        resumen = {}
+        for endpoint, cascada in self._cascadas.items():
+            por_endpoint = self._por_endpoint[endpoint]
+            modelos = {}
+            for modelo, estadisticas in self._por_modelo[endpoint].items():
+                llamadas = estadisticas["llamadas"] or 1
+                modelos[modelo] = {
+                    "llamadas": estadisticas["llamadas"],
+                    "tasa_validas": round(estadisticas["validas"] / llamadas, 4),
+                    "latencia_media_ms": round(estadisticas["latencia_total"] / llamadas * 1000, 1),
+                    # Coste aproximado por respuesta válida, en tokens de salida
+                    "tokens_por_valida": round(estadisticas["tokens_salida"] / estadisticas["validas"], 1)
+                    if estadisticas["validas"] else None,
+                }
+            resumen[endpoint] = {
+                "cascada": cascada,
+                "respuestas": por_endpoint["respuestas"],
+                "tasa_escalado": round(por_endpoint["escaladas"] / por_endpoint["respuestas"], 4)
+                if por_endpoint["respuestas"] else 0.0,
+                "modelos": modelos,
+            }
+        return resumen
+
+# Instancia compartida por todos los handlers del servicio
+enrutador_modelos = EnrutadorModelos()
@@ -0,0 +1,105 @@
+import os
+import uuid
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict
+from common.utils.session_manager import SessionManager
+
+logger = logging.getLogger(__name__)
+
+# Configuración del single-flight entre workers
+LOCK_TTL_MS = int(os.getenv("SINGLEFLIGHT_LOCK_TTL_MS", "60000"))          # Vida máxima del lock en Redis
+RESULTADO_TTL = int(os.getenv("SINGLEFLIGHT_RESULTADO_TTL", "30"))         # Segundos que se conserva el resultado compartido
+INTERVALO_SONDEO = float(os.getenv("SINGLEFLIGHT_INTERVALO_SONDEO", "0.1"))
+LOCK_PREFIJO = "singleflight:lock:"
+RESULTADO_PREFIJO = "singleflight:resultado:"
+
+# Libera el lock solo si sigue perteneciendo a quien lo adquirió
+_SCRIPT_LIBERAR = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+class CoalescedorSolicitudes:
+    """Agrupa solicitudes idénticas concurrentes para que compartan una sola generación."""
+
+    def __init__(self):
+        self._en_vuelo: Dict[str, asyncio.Task] = {}
+        self.estadisticas = {"lideres": 0, "agrupadas_local": 0, "agrupadas_redis": 0}
+
+    async def ejecutar(self, clave: str, generar: Callable[[], Awaitable[str]]) -> str:
+        """Ejecuta `generar` una sola vez por clave; el resto de llamadores espera el mismo resultado."""
+        tarea = self._en_vuelo.get(clave)
+        if tarea is not None:
+            self.estadisticas["agrupadas_local"] += 1
+            # shield: si un llamador se cancela, la generación compartida continúa para el resto
+            return await asyncio.shield(tarea)
+
+        self.estadisticas["lideres"] += 1
+        tarea = asyncio.create_task(self._ejecutar_distribuido(clave, generar))
+        self._en_vuelo[clave] = tarea
+        tarea.add_done_callback(lambda _: self._en_vuelo.pop(clave, None))
+        return await asyncio.shield(tarea)
+
+    async def _ejecutar_distribuido(self, clave: str, generar: Callable[[], Awaitable[str]]) -> str:
+        """Coordina con otros workers mediante un lock y una clave de resultado de vida corta en Redis."""
+        redis = SessionManager.redis_client
+        if redis is None:
+            return await generar()
+
+        clave_lock = LOCK_PREFIJO + clave
+        clave_resultado = RESULTADO_PREFIJO + clave
+        token = uuid.uuid4().hex
+        try:
+            adquirido = await redis.set(clave_lock, token, nx=True, px=LOCK_TTL_MS)
+        except Exception as e:
+            logger.warning(f"Single-flight sin Redis, se genera localmente: {e}")
+            return await generar()
+
+        if not adquirido:
+            resultado = await self._esperar_resultado(redis, clave_lock, clave_resultado)
+            if resultado is not None:
+                self.estadisticas["agrupadas_redis"] += 1
+                return resultado
+            # El líder falló o el lock expiró sin resultado: se genera aquí
+            return await generar()
+
+        try:
+            resultado = await generar()
+            # Las respuestas truncadas no se comparten: los demás workers generan la suya
+            if not getattr(resultado, "truncado", False):
+                try:
+                    await redis.set(clave_resultado, resultado, ex=RESULTADO_TTL)
+                except Exception as e:
+                    logger.warning(f"No se pudo publicar el resultado compartido: {e}")
+            return resultado
+        finally:
+            try:
+                await redis.eval(_SCRIPT_LIBERAR, 1, clave_lock, token)
+            except Exception as e:
+                logger.warning(f"No se pudo liberar el lock de single-flight: {e}")
+
+    @staticmethod
+    async def _esperar_resultado(redis, clave_lock: str, clave_resultado: str):
+        """Sondea el resultado publicado por el líder mientras su lock siga activo."""
+        try:
+            while True:
+                resultado = await redis.get(clave_resultado)
+                if resultado is not None:
+                    return resultado
+                if not await redis.exists(clave_lock):
+                    # El lock pudo liberarse justo después de publicar el resultado
+                    return await redis.get(clave_resultado)
+                await asyncio.sleep(INTERVALO_SONDEO)
+        except Exception as e:
+            logger.warning(f"Error esperando el resultado compartido: {e}")
+            return None
+
+    def resumen(self) -> dict:
+        """Devuelve los contadores de solicitudes lideradas y agrupadas."""
+        return {**self.estadisticas, "en_vuelo": len(self._en_vuelo)}
+
+# Instancia compartida por todos los handlers del servicio
+coalescedor = CoalescedorSolicitudes()
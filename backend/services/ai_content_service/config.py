@@ -1,6 +1,5 @@
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
 import logging
 
 # Configurar logging
@@ -9,11 +8,28 @@ logger = logging.getLogger(__name__)
 # Cargar las variables de entorno desde el archivo .env en la raíz del proyecto
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '../../.env'))
 
-# Verificar que la clave de API esté configurada
+# Proveedor de LLM: "openai" o "local" (respuestas sintéticas para pruebas de carga sin llamar a OpenAI)
+LLM_PROVEEDOR = os.getenv("LLM_PROVEEDOR", "openai").lower()
+
+# La clave de API solo es obligatoria cuando se usa OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
+if LLM_PROVEEDOR == "openai" and not OPENAI_API_KEY:
     logger.error("OPENAI_API_KEY no está configurada en las variables de entorno.")
     raise ValueError("OPENAI_API_KEY no está configurada en las variables de entorno.")
 
-# Crear una instancia del cliente de OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Parámetros del pool HTTP y de concurrencia hacia OpenAI
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))                       # Timeout por defecto de cada llamada (segundos)
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))        # Timeout para establecer la conexión
+OPENAI_MAX_CONEXIONES = int(os.getenv("OPENAI_MAX_CONEXIONES", "20"))           # Conexiones totales del pool
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "10"))             # Conexiones keep-alive reutilizables
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))     # Segundos que se conserva una conexión ociosa
+OPENAI_MAX_CONCURRENCIA = int(os.getenv("OPENAI_MAX_CONCURRENCIA", "10"))       # Llamadas simultáneas por worker (techo del gobernador)
+OPENAI_MAX_REINTENTOS = int(os.getenv("OPENAI_MAX_REINTENTOS", "1"))            # Reintentos internos del SDK ante 429/5xx
+
+# Parámetros del proveedor local
+LLM_LOCAL_LATENCIA_P50 = float(os.getenv("LLM_LOCAL_LATENCIA_P50", "0.8"))      # Mediana de la latencia simulada (segundos)
+LLM_LOCAL_LATENCIA_P99 = float(os.getenv("LLM_LOCAL_LATENCIA_P99", "3"))        # Percentil 99 de la latencia simulada
+LLM_LOCAL_ERRORES = os.getenv("LLM_LOCAL_ERRORES", "")                          # Tasas de error, p. ej. "429:0.02,500:0.01,timeout:0.005"
+LLM_LOCAL_RESPUESTAS = os.getenv("LLM_LOCAL_RESPUESTAS")                        # JSON con respuestas fijas por modelo de respuesta
+LLM_LOCAL_ELEMENTOS = int(os.getenv("LLM_LOCAL_ELEMENTOS", "5"))                # Elementos de cada lista en las respuestas generadas
+LLM_LOCAL_SEMILLA = int(os.getenv("LLM_LOCAL_SEMILLA", "0"))                    # Semilla de las latencias y errores simulados
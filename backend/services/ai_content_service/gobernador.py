@@ -0,0 +1,267 @@
+import os
+import time
+import math
+import asyncio
+import logging
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from fastapi import HTTPException
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+from common.utils.session_manager import SessionManager
+from .config import OPENAI_MAX_CONCURRENCIA
+from .planificador import PlanificadorJusto, PrioridadSolicitud, solicitud_llm
+
+logger = logging.getLogger(__name__)
+
+# Configuración del gobernador de llamadas a OpenAI
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "500"))                                # Solicitudes por minuto entre todos los procesos
+OPENAI_RAFAGA = float(os.getenv("OPENAI_RAFAGA", "20"))                           # Capacidad del token bucket
+GOBERNADOR_PROCESOS = int(os.getenv("GOBERNADOR_PROCESOS", "1"))                   # Procesos que reparten OPENAI_RPM si Redis no está disponible
+GOBERNADOR_MAX_POR_USUARIO = int(os.getenv("GOBERNADOR_MAX_POR_USUARIO", "3"))     # Llamadas simultáneas por usuario
+GOBERNADOR_MAX_COLA = int(os.getenv("GOBERNADOR_MAX_COLA", "100"))                 # Solicitudes esperando turno
+GOBERNADOR_ESPERA_MAXIMA = float(os.getenv("GOBERNADOR_ESPERA_MAXIMA", "10"))      # Segundos máximos en cola antes del 503
+FACTOR_REDUCCION = 0.5          # Reducción multiplicativa del límite ante 429/5xx
+INTERVALO_REDUCCION = 2.0       # Una ráfaga de errores simultáneos cuenta como una sola señal
+PAUSA_POR_DEFECTO = 1.0         # Pausa global si OpenAI no envía Retry-After
+CLAVE_BUCKET = "gobernador:openai:bucket"
+
+# Token bucket compartido por todos los procesos (workers de uvicorn, worker de trabajos, Lambdas).
+# Recarga el bucket con el reloj de Redis, suma la pausa global por 429 (y la local, ARGV[4],
+# que este proceso pudo ver antes de compartirla) y reserva un token salvo que la espera
+# supere el máximo. Devuelve {reservado, espera, tokens}; los decimales
+# viajan como texto porque Redis trunca los números de Lua a enteros.
+_SCRIPT_RESERVAR = """
+local t = redis.call('TIME')
+local ahora = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local tasa = tonumber(ARGV[1])
+local rafaga = tonumber(ARGV[2])
+local estado = redis.call('HMGET', KEYS[1], 'tokens', 'recarga', 'pausa_hasta')
+local tokens = tonumber(estado[1]) or rafaga
+local recarga = tonumber(estado[2]) or ahora
+local pausa_hasta = tonumber(estado[3]) or 0
+tokens = math.min(rafaga, tokens + math.max(0, ahora - recarga) * tasa)
+local espera = math.max(0, (1 - tokens) / tasa, pausa_hasta - ahora, tonumber(ARGV[4]))
+local reservado = 0
+if espera <= tonumber(ARGV[3]) then
+    tokens = tokens - 1
+    reservado = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'recarga', tostring(ahora))
+redis.call('EXPIRE', KEYS[1], 3600)
+return {reservado, tostring(espera), tostring(tokens)}
+"""
+
+# Pausa global tras un 429: ningún proceso reserva tokens hasta que pase el Retry-After
+_SCRIPT_PAUSAR = """
+local t = redis.call('TIME')
+local hasta = tonumber(t[1]) + tonumber(t[2]) / 1000000 + tonumber(ARGV[1])
+local actual = tonumber(redis.call('HGET', KEYS[1], 'pausa_hasta')) or 0
+if hasta > actual then
+    redis.call('HSET', KEYS[1], 'pausa_hasta', tostring(hasta))
+end
+return 1
+"""
+
+def _retry_after(error: APIStatusError) -> float:
+    try:
+        return float(error.response.headers.get("retry-after", PAUSA_POR_DEFECTO))
+    except (TypeError, ValueError):
+        return PAUSA_POR_DEFECTO
+
+def es_sobrecarga(error: Exception) -> bool:
+    """Indica si el error de OpenAI señala saturación (429, 5xx o timeout)."""
+    if isinstance(error, (RateLimitError, APITimeoutError, APIConnectionError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+class GobernadorOpenAI:
+    """Admisión de llamadas a OpenAI: token bucket global, límite por usuario y concurrencia AIMD.
+
+    El token bucket (OPENAI_RPM) y la pausa por 429 viven en Redis y los
+    comparten todos los procesos; sin Redis cada proceso usa un bucket local
+    con OPENAI_RPM / GOBERNADOR_PROCESOS. La concurrencia AIMD es por proceso,
+    con OPENAI_MAX_CONCURRENCIA como techo: crece de forma aditiva con cada
+    llamada correcta y se reduce a la mitad ante 429/5xx. Las solicitudes que no caben esperan en
+    una cola acotada y el planificador decide, con reparto justo por usuario y
+    tipo de cuenta, a cuál se le da el siguiente hueco; si la cola está llena o
+    la espera superaría GOBERNADOR_ESPERA_MAXIMA se responde 503 con Retry-After.
+    """
+
+    def __init__(self):
+        self.limite = float(OPENAI_MAX_CONCURRENCIA)
+        self._planificador = PlanificadorJusto()
+        self._en_vuelo = 0
+        self._por_usuario: Dict[int, int] = defaultdict(int)
+        self._tokens = OPENAI_RAFAGA
+        self._ultima_recarga = time.monotonic()
+        self._pausa_hasta = 0.0
+        self._ultima_reduccion = 0.0
+        self._esperas: Dict[str, deque] = defaultdict(lambda: deque(maxlen=500))  # Por tipo de cuenta
+        self.estadisticas = {"admitidas": 0, "rechazadas": 0, "sobrecargas": 0, "bucket_local": 0}
+
+    def _rechazar(self, motivo: str, reintentar_en: float):
+        self.estadisticas["rechazadas"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail=f"Servicio de generación saturado: {motivo}. Intenta de nuevo en unos segundos.",
+            headers={"Retry-After": str(max(1, math.ceil(reintentar_en)))},
+        )
+
+    def _cabe_usuario(self, id_usuario: Optional[int]) -> bool:
+        return id_usuario is None or self._por_usuario[id_usuario] < GOBERNADOR_MAX_POR_USUARIO
+
+    def _ocupar(self, id_usuario: Optional[int]):
+        self._en_vuelo += 1
+        if id_usuario is not None:
+            self._por_usuario[id_usuario] += 1
+
+    def _despachar(self):
+        """Asigna los huecos libres a los turnos en cola en el orden del planificador."""
+        while self._en_vuelo < int(self.limite):
+            turno = self._planificador.siguiente(self._cabe_usuario)
+            if turno is None:
+                return
+            self._ocupar(turno.prioridad.id_usuario)
+            turno.futuro.set_result(None)
+
+    async def _reservar_token(self) -> float:
+        """Reserva un token del bucket global y devuelve los segundos que hay que esperar por él."""
+        redis = SessionManager.redis_client
+        if redis is not None:
+            try:
+                reservado, espera, tokens = await redis.eval(
+                    _SCRIPT_RESERVAR, 1, CLAVE_BUCKET, OPENAI_RPM / 60, OPENAI_RAFAGA, GOBERNADOR_ESPERA_MAXIMA,
+                    max(0.0, self._pausa_hasta - time.monotonic()),
+                )
+            except Exception as e:
+                logger.warning(f"Token bucket de OpenAI sin Redis, se usa el local: {e}")
+            else:
+                self._tokens = float(tokens)
+                espera = float(espera)
+                if not int(reservado):
+                    self._rechazar("límite de solicitudes por minuto alcanzado", espera)
+                return espera
+        self.estadisticas["bucket_local"] += 1
+        return self._reservar_token_local()
+
+    def _reservar_token_local(self) -> float:
+        ahora = time.monotonic()
+        tasa = OPENAI_RPM / 60 / max(1, GOBERNADOR_PROCESOS)
+        self._tokens = min(OPENAI_RAFAGA, self._tokens + (ahora - self._ultima_recarga) * tasa)
+        self._ultima_recarga = ahora
+        espera = max(0.0, (1 - self._tokens) / tasa, self._pausa_hasta - ahora)
+        if espera > GOBERNADOR_ESPERA_MAXIMA:
+            self._rechazar("límite de solicitudes por minuto alcanzado", espera)
+        self._tokens -= 1
+        return espera
+
+    async def _pausar_global(self, segundos: float):
+        redis = SessionManager.redis_client
+        if redis is None:
+            return
+        try:
+            await redis.eval(_SCRIPT_PAUSAR, 1, CLAVE_BUCKET, segundos)
+        except Exception as e:
+            logger.warning(f"No se pudo compartir la pausa de OpenAI: {e}")
+
+    async def _adquirir(self, prioridad: PrioridadSolicitud):
+        inicio = time.monotonic()
+        id_usuario = prioridad.id_usuario
+        if self._planificador.en_cola >= GOBERNADOR_MAX_COLA:
+            self._rechazar("cola de generación llena", GOBERNADOR_ESPERA_MAXIMA)
+        turno = self._planificador.encolar(prioridad)
+        self._despachar()
+        try:
+            await asyncio.wait_for(asyncio.shield(turno.futuro), GOBERNADOR_ESPERA_MAXIMA)
+        except asyncio.TimeoutError:
+            if not turno.futuro.done():
+                self._planificador.cancelar(turno)
+                self._rechazar("tiempo de espera en cola agotado", GOBERNADOR_ESPERA_MAXIMA)
+        except asyncio.CancelledError:
+            # Si el hueco ya se había asignado se devuelve; si no, se retira el turno de la cola
+            if turno.futuro.done():
+                self._liberar(id_usuario)
+            else:
+                self._planificador.cancelar(turno)
+            raise
+
+        try:
+            espera = await self._reservar_token()
+        except (HTTPException, asyncio.CancelledError):
+            self._liberar(id_usuario)
+            raise
+        if espera:
+            await asyncio.sleep(espera)
+        self._esperas[prioridad.tipo_cuenta].append(time.monotonic() - inicio)
+        self.estadisticas["admitidas"] += 1
+
+    def _liberar(self, id_usuario: Optional[int]):
+        self._en_vuelo -= 1
+        if id_usuario is not None:
+            self._por_usuario[id_usuario] -= 1
+            if not self._por_usuario[id_usuario]:
+                del self._por_usuario[id_usuario]
+        self._despachar()
+
+    def registrar_exito(self):
+        # Incremento aditivo: +1 en el límite por cada `limite` llamadas correctas
+        self.limite = min(float(OPENAI_MAX_CONCURRENCIA), self.limite + 1 / self.limite)
+        self._despachar()
+
+    def registrar_sobrecarga(self, error: Exception):
+        self.estadisticas["sobrecargas"] += 1
+        ahora = time.monotonic()
+        if isinstance(error, RateLimitError):
+            self._pausa_hasta = max(self._pausa_hasta, ahora + _retry_after(error))
+        if ahora - self._ultima_reduccion >= INTERVALO_REDUCCION:
+            self._ultima_reduccion = ahora
+            self.limite = max(1.0, self.limite * FACTOR_REDUCCION)
+            logger.warning(f"OpenAI saturado ({type(error).__name__}); límite de concurrencia reducido a {int(self.limite)}")
+
+    @asynccontextmanager
+    async def turno(self):
+        """Espera turno para una llamada a OpenAI y ajusta el límite según su resultado."""
+        prioridad = solicitud_llm.get()
+        await self._adquirir(prioridad)
+        try:
+            yield
+        except Exception as e:
+            if es_sobrecarga(e):
+                self.registrar_sobrecarga(e)
+                if isinstance(e, RateLimitError):
+                    await self._pausar_global(_retry_after(e))
+            raise
+        else:
+            self.registrar_exito()
+        finally:
+            self._liberar(prioridad.id_usuario)
+
+    def tiene_holgura(self) -> bool:
+        """Indica si hay huecos libres y nadie esperando (p. ej. para permitir una cobertura)."""
+        return not self._planificador.en_cola and self._en_vuelo < int(self.limite)
+
+    def retry_after_sugerido(self) -> int:
+        """Segundos que un cliente debería esperar tras una sobrecarga de OpenAI."""
+        return max(1, math.ceil(self._pausa_hasta - time.monotonic()), math.ceil(PAUSA_POR_DEFECTO))
+
+    def resumen(self) -> dict:
+        esperas = {}
+        for tipo_cuenta, valores in self._esperas.items():
+            ordenadas = sorted(valores)
+            esperas[tipo_cuenta] = {
+                "p50_ms": round(ordenadas[int(0.5 * (len(ordenadas) - 1))] * 1000, 1),
+                "p99_ms": round(ordenadas[int(0.99 * (len(ordenadas) - 1))] * 1000, 1),
+            }
+        return {
+            **self.estadisticas,
+            "limite_concurrencia": round(self.limite, 2),
+            "en_vuelo": self._en_vuelo,
+            "usuarios_activos": len(self._por_usuario),
+            "tokens_disponibles": round(max(self._tokens, 0.0), 2),
+            "planificador": self._planificador.resumen(),
+            "espera_por_tipo_cuenta": esperas,
+        }
+
+# Instancia compartida por todas las llamadas del worker
+gobernador_openai = GobernadorOpenAI()
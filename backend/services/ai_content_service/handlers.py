@@ -1,13 +1,57 @@
-from sqlalchemy.orm import Session
-from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Optional, Type
 from ..auth_service.models import Usuario
-from ..ai_content_service.models import Documento
-from .utils import generar_respuesta_openai, extraer_json_de_respuesta
+from .utils import (
+    generar_respuesta_openai,
+    generar_respuesta_openai_stream,
+    extraer_json_de_respuesta,
+    respuesta_truncada,
+    validar_o_reparar,
+    RespuestaGenerada
+)
+from .cache import construir_clave_solicitud, cache_respuestas
+from .streaming import ExtractorElementosArray, evento_sse
+from .json_extractor import ExtractorJSONIncremental, reparar_json_truncado
+from .planificador import PrioridadSolicitud, identificar_solicitud, prioridad_para, solicitud_llm
+from .trabajos import cola_trabajos, presentar_trabajo
+from .persistencia import fila_documento, persistencia_documentos
+from .cascada import enrutador_modelos
+from .validacion import Restricciones
+from .presupuesto_tokens import estimar_tokens_salida, presupuesto_tokens
+from .schemas import (
+    CampanaDetallesInput,
+    PublicoObjetivoUbicacionesInput,
+    FormatoCTAInput,
+    ContenidoCreativoInput,
+    EncabezadoAnuncio,
+    DetallesCampanaRespuesta,
+    PublicoUbicacionesRespuesta,
+    FormatoCTARespuesta,
+    ContenidoCreativoRespuesta,
+    EncabezadosRespuesta,
+    FORMATOS_ANUNCIO,
+    LLAMADAS_A_LA_ACCION
+)
 from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+import os
 import json
+import asyncio
+import logging
 
-async def manejar_definir_campana(data, current_user: Usuario, db: Session):
-    prompt = f"""
+logger = logging.getLogger(__name__)
+
+# Versión de las plantillas de prompt; incrementarla invalida las respuestas cacheadas
+VERSION_PROMPTS = "2"
+
+# Listas de opciones del prompt de elegir_formato_cta, las mismas que valida FormatoCTARespuesta
+OPCIONES_FORMATO = "\n    ".join(FORMATOS_ANUNCIO)
+OPCIONES_CTA = "\n    ".join(LLAMADAS_A_LA_ACCION)
+
+# Pasos del asistente que se ejecutan en paralelo dentro de /campaign_bundle
+BUNDLE_MAX_CONCURRENCIA = int(os.getenv("BUNDLE_MAX_CONCURRENCIA", "3"))
+
+def construir_prompt_definir_campana(data) -> str:
+    return f"""
     Como experto en marketing digital y campañas de Meta Ads, proporciona tus recomendaciones en formato JSON **válido** siguiendo exactamente el siguiente esquema **sin agregar texto adicional**:
 
     {{"detalles_campana": {{
@@ -36,24 +80,28 @@ async def manejar_definir_campana(data, current_user: Usuario, db: Session):
     **Importante**: Proporciona **solo** la respuesta en formato JSON válido. No incluyas ninguna explicación o texto adicional antes o después del JSON.
     """
 
-    resultado = await generar_respuesta_openai(prompt)
-    detalles_campana = extraer_json_de_respuesta(resultado)
-
-    # Manejo de la base de datos con un bloque de transacción explícito
-    nuevo_documento = Documento(
-        id_usuario=current_user.id_usuario,
-        tipo_documento="definir_campana",
-        contenido=json.dumps(detalles_campana),
-        fecha_creacion=datetime.now(timezone.utc)
+async def generar_definir_campana(data):
+    """Genera los detalles de la campaña; devuelve (respuesta, contenido a persistir)."""
+    prompt = construir_prompt_definir_campana(data)
+    clave = construir_clave_solicitud("definir_campana", data, VERSION_PROMPTS)
+    resultado = await generar_respuesta_openai(
+        prompt,
+        clave_solicitud=clave,
+        modelo_respuesta=DetallesCampanaRespuesta,
+        estimacion_tokens=estimar_tokens_salida("definir_campana", data),
     )
-    db.add(nuevo_documento)
-    db.commit()
-    db.refresh(nuevo_documento)
+    detalles_campana = extraer_json_de_respuesta(resultado)
+    return {**detalles_campana, "truncado": respuesta_truncada(resultado)}, detalles_campana
 
+async def manejar_definir_campana(data, current_user: Usuario):
+    identificar_solicitud(current_user, "definir_campana")
+    detalles_campana, contenido = await generar_definir_campana(data)
+    # El documento se persiste en segundo plano; la respuesta no espera a la base de datos
+    await persistencia_documentos.encolar(current_user.id_usuario, "definir_campana", contenido)
     return detalles_campana
 
-async def manejar_definir_publico_ubicaciones(data, current_user: Usuario, db: Session):
-    prompt = f"""
+def construir_prompt_definir_publico_ubicaciones(data) -> str:
+    return f"""
     Como estratega de marketing enfocado en segmentación y ubicaciones de anuncios en Meta Ads, proporciona tus recomendaciones en formato JSON **válido** siguiendo exactamente el siguiente esquema **sin agregar texto adicional**:
 
     {{
@@ -98,24 +146,27 @@ async def manejar_definir_publico_ubicaciones(data, current_user: Usuario, db: S
     **Nota**: Asegúrate de que todas las cadenas en el JSON estén entre comillas dobles y que el JSON sea estructuralmente válido.
     """
 
-    resultado = await generar_respuesta_openai(prompt)
-    publico_ubicaciones = extraer_json_de_respuesta(resultado)
-
-    # Manejo de la base de datos con un bloque de transacción explícito
-    nuevo_documento = Documento(
-        id_usuario=current_user.id_usuario,
-        tipo_documento="definir_publico_ubicaciones",
-        contenido=json.dumps(publico_ubicaciones),
-        fecha_creacion=datetime.now(timezone.utc)
+async def generar_definir_publico_ubicaciones(data):
+    """Genera el público objetivo y las ubicaciones; devuelve (respuesta, contenido a persistir)."""
+    prompt = construir_prompt_definir_publico_ubicaciones(data)
+    clave = construir_clave_solicitud("definir_publico_ubicaciones", data, VERSION_PROMPTS)
+    resultado = await generar_respuesta_openai(
+        prompt,
+        clave_solicitud=clave,
+        modelo_respuesta=PublicoUbicacionesRespuesta,
+        estimacion_tokens=estimar_tokens_salida("definir_publico_ubicaciones", data),
     )
-    db.add(nuevo_documento)
-    db.commit()
-    db.refresh(nuevo_documento)
+    publico_ubicaciones = extraer_json_de_respuesta(resultado)
+    return {**publico_ubicaciones, "truncado": respuesta_truncada(resultado)}, publico_ubicaciones
 
+async def manejar_definir_publico_ubicaciones(data, current_user: Usuario):
+    identificar_solicitud(current_user, "definir_publico_ubicaciones")
+    publico_ubicaciones, contenido = await generar_definir_publico_ubicaciones(data)
+    await persistencia_documentos.encolar(current_user.id_usuario, "definir_publico_ubicaciones", contenido)
     return publico_ubicaciones
 
-async def manejar_elegir_formato_cta(data, current_user: Usuario, db: Session):
-    prompt = f"""
+def construir_prompt_elegir_formato_cta(data) -> str:
+    return f"""
     Como experto en creatividad publicitaria y plataformas de Meta Ads, proporciona tus recomendaciones en formato JSON **válido** siguiendo exactamente el siguiente esquema **sin agregar texto adicional**:
 
     {{
@@ -132,24 +183,10 @@ async def manejar_elegir_formato_cta(data, current_user: Usuario, db: Session):
     Utiliza las opciones predefinidas a continuación para hacer tus selecciones.
 
     **Opciones de Formato de Anuncio:**
-    Anuncios en carrusel
-    Anuncios en secuencia
-    Colecciones
-    Experiencias dinámicas
-    Anuncios de Messenger
-    Anuncios de Canvas 
+    {OPCIONES_FORMATO}
 
     **Opciones de Llamada a la Acción (CTA):**
-    Enviar solicitud
-    Reservar
-    Comprar
-    Realizar pedido
-    Cotizar
-    Obtener oferta
-    Más información
-    Contactarnos
-    Descargar
-    Registrarte
+    {OPCIONES_CTA}
 
     **Detalles del Producto:**
     - Nombre: {data.nombreProducto}
@@ -160,24 +197,27 @@ async def manejar_elegir_formato_cta(data, current_user: Usuario, db: Session):
     **Nota**: Asegúrate de que todas las cadenas en el JSON estén entre comillas dobles y que el JSON sea estructuralmente válido.
     """
 
-    resultado = await generar_respuesta_openai(prompt)
-    formato_y_cta = extraer_json_de_respuesta(resultado)
-
-    # Manejo de la base de datos con un bloque de transacción explícito
-    nuevo_documento = Documento(
-        id_usuario=current_user.id_usuario,
-        tipo_documento="elegir_formato_cta",
-        contenido=json.dumps(formato_y_cta),
-        fecha_creacion=datetime.now(timezone.utc)
+async def generar_elegir_formato_cta(data):
+    """Elige el formato de anuncio y la CTA; devuelve (respuesta, contenido a persistir)."""
+    prompt = construir_prompt_elegir_formato_cta(data)
+    clave = construir_clave_solicitud("elegir_formato_cta", data, VERSION_PROMPTS)
+    resultado = await generar_respuesta_openai(
+        prompt,
+        clave_solicitud=clave,
+        modelo_respuesta=FormatoCTARespuesta,
+        estimacion_tokens=estimar_tokens_salida("elegir_formato_cta", data),
     )
-    db.add(nuevo_documento)
-    db.commit()
-    db.refresh(nuevo_documento)
+    formato_y_cta = extraer_json_de_respuesta(resultado)
+    return {**formato_y_cta, "truncado": respuesta_truncada(resultado)}, formato_y_cta
 
+async def manejar_elegir_formato_cta(data, current_user: Usuario):
+    identificar_solicitud(current_user, "elegir_formato_cta")
+    formato_y_cta, contenido = await generar_elegir_formato_cta(data)
+    await persistencia_documentos.encolar(current_user.id_usuario, "elegir_formato_cta", contenido)
     return formato_y_cta
 
-async def manejar_crear_contenido_creativo(data, current_user: Usuario, db: Session):
-    prompt = f"""
+def construir_prompt_crear_contenido_creativo(data) -> str:
+    return f"""
     Como redactor creativo especializado en anuncios de Meta Ads, genera **contenido publicitario persuasivo y atractivo** para "{data.nombreProducto}" en formato JSON **válido**, siguiendo exactamente el siguiente esquema **sin agregar texto adicional**:
 
     {{
@@ -213,24 +253,27 @@ async def manejar_crear_contenido_creativo(data, current_user: Usuario, db: Sess
     **Nota**: Asegúrate de que todas las cadenas en el JSON estén entre comillas dobles y que el JSON sea estructuralmente válido.
     """
 
-    resultado = await generar_respuesta_openai(prompt)
-    contenido_creativo = extraer_json_de_respuesta(resultado)
-
-    # Manejo de la base de datos con un bloque de transacción explícito
-    nuevo_documento = Documento(
-        id_usuario=current_user.id_usuario,
-        tipo_documento="crear_contenido_creativo",
-        contenido=json.dumps(contenido_creativo),
-        fecha_creacion=datetime.now(timezone.utc)
+async def generar_crear_contenido_creativo(data):
+    """Genera las variaciones de contenido creativo; devuelve (respuesta, contenido a persistir)."""
+    prompt = construir_prompt_crear_contenido_creativo(data)
+    clave = construir_clave_solicitud("crear_contenido_creativo", data, VERSION_PROMPTS)
+    resultado = await generar_respuesta_openai(
+        prompt,
+        clave_solicitud=clave,
+        modelo_respuesta=ContenidoCreativoRespuesta,
+        estimacion_tokens=estimar_tokens_salida("crear_contenido_creativo", data),
     )
-    db.add(nuevo_documento)
-    db.commit()
-    db.refresh(nuevo_documento)
+    contenido_creativo = extraer_json_de_respuesta(resultado)
+    return {**contenido_creativo, "truncado": respuesta_truncada(resultado)}, contenido_creativo
 
+async def manejar_crear_contenido_creativo(data, current_user: Usuario):
+    identificar_solicitud(current_user, "crear_contenido_creativo")
+    contenido_creativo, contenido = await generar_crear_contenido_creativo(data)
+    await persistencia_documentos.encolar(current_user.id_usuario, "crear_contenido_creativo", contenido)
     return contenido_creativo
 
-async def manejar_create_heading(encabezado, current_user: Usuario, db: Session):
-    prompt = f"""
+def construir_prompt_create_heading(encabezado) -> str:
+    return f"""
     Eres un redactor publicitario experto en crear **encabezados cautivadores** para anuncios en plataformas de redes sociales.
 
     Tu tarea es generar **encabezados concisos y atractivos** que cumplan con los siguientes requisitos y proporcionarlos en formato JSON **válido** siguiendo exactamente el siguiente esquema **sin agregar texto adicional**:
@@ -275,19 +318,245 @@ async def manejar_create_heading(encabezado, current_user: Usuario, db: Session)
     **Nota**: Asegúrate de que todas las cadenas en el JSON estén entre comillas dobles y que el JSON sea estructuralmente válido.
     """
 
-    resultado = await generar_respuesta_openai(prompt)
+def restricciones_encabezados(encabezado) -> Restricciones:
+    """Comprueba que lleguen las variantes pedidas y que respeten la longitud máxima.
+
+    Una respuesta cortada por max_tokens trae menos variantes de las pedidas: se
+    acepta con un aviso (la respuesta ya lleva truncado=True) en lugar de escalar
+    de modelo o repararla, que costaría otra llamada para el mismo resultado.
+    """
+    def comprobar(datos: dict, truncado: bool) -> Optional[str]:
+        encabezados = datos["encabezados"]
+        if len(encabezados) < encabezado.variantes:
+            if not truncado:
+                return f"Se pidieron {encabezado.variantes} encabezados y se recibieron {len(encabezados)}"
+            logger.warning(
+                f"create_heading truncado: se pidieron {encabezado.variantes} encabezados y se recibieron {len(encabezados)}"
+            )
+        largos = [texto for texto in encabezados[:encabezado.variantes] if len(texto) > encabezado.longitudMaxima]
+        if largos:
+            return f"Estos encabezados superan los {encabezado.longitudMaxima} caracteres: {largos}"
+        return None
+    return comprobar
+
+async def generar_create_heading(encabezado):
+    """Genera los encabezados; devuelve (respuesta, contenido a persistir)."""
+    prompt = construir_prompt_create_heading(encabezado)
+    clave = construir_clave_solicitud("create_heading", encabezado, VERSION_PROMPTS)
+    resultado = await generar_respuesta_openai(
+        prompt,
+        clave_solicitud=clave,
+        modelo_respuesta=EncabezadosRespuesta,
+        estimacion_tokens=estimar_tokens_salida("create_heading", encabezado),
+        restricciones=restricciones_encabezados(encabezado),
+    )
     encabezados_data = extraer_json_de_respuesta(resultado)
     encabezados = encabezados_data.get("encabezados", [])[:encabezado.variantes]
+    return {"encabezados": encabezados, "truncado": respuesta_truncada(resultado)}, encabezados
+
+async def manejar_create_heading(encabezado, current_user: Usuario):
+    identificar_solicitud(current_user, "create_heading")
+    respuesta, encabezados = await generar_create_heading(encabezado)
+    await persistencia_documentos.encolar(current_user.id_usuario, "create_heading", encabezados)
+    return respuesta
+
+# Cada paso del asistente: esquema de entrada y función de generación
+PASOS_CAMPANA = {
+    "definir_campana": (CampanaDetallesInput, generar_definir_campana),
+    "definir_publico_ubicaciones": (PublicoObjetivoUbicacionesInput, generar_definir_publico_ubicaciones),
+    "elegir_formato_cta": (FormatoCTAInput, generar_elegir_formato_cta),
+    "crear_contenido_creativo": (ContenidoCreativoInput, generar_crear_contenido_creativo),
+    "create_heading": (EncabezadoAnuncio, generar_create_heading),
+}
+
+async def manejar_campaign_bundle(data, current_user: Usuario):
+    """Ejecuta en paralelo los pasos del asistente y devuelve resultados parciales con errores por paso."""
+    identificar_solicitud(current_user, "campaign_bundle")
+    pasos = data.pasos or list(PASOS_CAMPANA)
+    desconocidos = [paso for paso in pasos if paso not in PASOS_CAMPANA]
+    if desconocidos:
+        raise HTTPException(status_code=400, detail=f"Pasos no válidos: {desconocidos}")
+
+    semaforo = asyncio.Semaphore(BUNDLE_MAX_CONCURRENCIA)
+    entradas = data.model_dump(exclude_none=True, exclude={"pasos"})
+
+    async def ejecutar_paso(paso: str):
+        esquema, generar = PASOS_CAMPANA[paso]
+        try:
+            entrada = esquema(**entradas)
+        except ValidationError as e:
+            faltantes = sorted({str(error["loc"][0]) for error in e.errors()})
+            return paso, None, None, f"Faltan datos para este paso: {faltantes}"
+        async with semaforo:
+            try:
+                respuesta, contenido = await generar(entrada)
+                return paso, respuesta, contenido, None
+            except HTTPException as e:
+                return paso, None, None, e.detail
+            except Exception as e:
+                logger.exception(f"Error en el paso {paso} de campaign_bundle")
+                return paso, None, None, str(e)
+
+    ejecutados = await asyncio.gather(*(ejecutar_paso(paso) for paso in pasos))
+
+    resultados, errores, documentos = {}, {}, []
+    for paso, respuesta, contenido, error in ejecutados:
+        if error is not None:
+            errores[paso] = error
+            continue
+        resultados[paso] = respuesta
+        documentos.append(fila_documento(current_user.id_usuario, paso, contenido))
+
+    # Los documentos del bundle se encolan juntos para el volcado por lotes
+    if documentos:
+        await persistencia_documentos.encolar_filas(documentos)
+
+    return {"resultados": resultados, "errores": errores}
+
+async def manejar_encolar_trabajo(tipo: str, data, current_user: Usuario):
+    """Encola la generación para los workers y devuelve el id del trabajo sin esperar a OpenAI."""
+    prioridad = prioridad_para(current_user, tipo)
+    id_trabajo = await cola_trabajos.encolar(tipo, data.model_dump(), prioridad)
+    return {"id_trabajo": id_trabajo, "estado": "pendiente", "url": f"/content/jobs/{id_trabajo}"}
+
+async def manejar_consultar_trabajo(id_trabajo: str, esperar: float, current_user: Usuario):
+    if esperar > 0:
+        trabajo = await cola_trabajos.esperar(id_trabajo, esperar)
+    else:
+        trabajo = await cola_trabajos.obtener(id_trabajo)
+    if trabajo is None or trabajo.get("id_usuario") != str(current_user.id_usuario):
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return presentar_trabajo(trabajo)
+
+async def ejecutar_trabajo(trabajo: dict):
+    """Ejecuta un trabajo encolado: genera, persiste el Documento y publica el resultado."""
+    id_trabajo = trabajo["id"]
+    id_usuario = int(trabajo["id_usuario"])
+    # Los trabajos encolados no son interactivos: compiten con el plazo por defecto
+    solicitud_llm.set(PrioridadSolicitud(id_usuario, trabajo["tipo_cuenta"], float(trabajo["peso"])))
+    esquema, generar = PASOS_CAMPANA[trabajo["tipo"]]
+    try:
+        respuesta, contenido = await generar(esquema(**json.loads(trabajo["datos"])))
+        await persistencia_documentos.encolar(id_usuario, trabajo["tipo"], contenido)
+    except HTTPException as e:
+        await cola_trabajos.finalizar(id_trabajo, error=str(e.detail))
+        return
+    except Exception as e:
+        logger.exception(f"Error ejecutando el trabajo {id_trabajo}")
+        await cola_trabajos.finalizar(id_trabajo, error=str(e))
+        return
+    await cola_trabajos.finalizar(id_trabajo, resultado=respuesta)
+
+async def _transmitir_generacion(
+    prompt: str,
+    clave: str,
+    tipo_documento: str,
+    evento_elemento: str,
+    prioridad: PrioridadSolicitud,
+    modelo_respuesta: Type[BaseModel],
+    finalizar: Callable[[dict], tuple],
+    limite: Optional[int] = None,
+    max_tokens: int = 300,
+    restricciones: Optional[Restricciones] = None,
+) -> AsyncIterator[str]:
+    """Emite por SSE los tokens y cada elemento completo; al cerrar el stream persiste el Documento.
+
+    `finalizar` recibe el JSON completo y devuelve (respuesta final, contenido a persistir).
+    """
+    solicitud_llm.set(prioridad)
+    extractor = ExtractorElementosArray()
+    extractor_json = ExtractorJSONIncremental()
+    partes = []
+    emitidos = 0
+    truncado = False
+    try:
+        en_cache = await cache_respuestas.obtener(clave) if cache_respuestas.habilitada_para(clave) else None
+        if en_cache is not None:
+            fragmentos = _fragmento_unico(en_cache)
+        else:
+            fragmentos = generar_respuesta_openai_stream(
+                prompt, max_tokens, modelo_respuesta=modelo_respuesta, modelo=enrutador_modelos.cascada(tipo_documento)[0]
+            )
+
+        async for fragmento in fragmentos:
+            partes.append(fragmento)
+            extractor_json.alimentar(fragmento)
+            yield evento_sse("token", {"delta": fragmento})
+            for elemento in extractor.alimentar(fragmento):
+                if limite is None or emitidos < limite:
+                    emitidos += 1
+                    yield evento_sse(evento_elemento, elemento)
+
+        resultado = "".join(partes).strip()
+        if en_cache is not None:
+            datos = extraer_json_de_respuesta(resultado)
+        else:
+            # El extractor incremental ya aisló el objeto JSON del texto que pudiera rodearlo
+            if extractor_json.resultado is not None:
+                resultado = json.dumps(extractor_json.resultado, ensure_ascii=False)
+            else:
+                # El stream terminó con el objeto abierto (corte por max_tokens): se conserva lo utilizable
+                texto, truncado = reparar_json_truncado(resultado)
+                resultado = RespuestaGenerada(texto, truncado)
+            datos, _ = await validar_o_reparar(
+                prompt, resultado, modelo_respuesta, tipo_documento, max_tokens, restricciones=restricciones
+            )
+            resultado = json.dumps(datos, ensure_ascii=False)
+        respuesta, contenido = finalizar(datos)
+    except HTTPException as e:
+        yield evento_sse("error", {"detail": e.detail})
+        return
+
+    if en_cache is None and not truncado and cache_respuestas.habilitada_para(clave):
+        await cache_respuestas.guardar(clave, resultado)
+
+    # Persistido en segundo plano: la sesión de la petición ya se cerró al empezar la respuesta
+    try:
+        await persistencia_documentos.encolar(prioridad.id_usuario, tipo_documento, contenido)
+    except HTTPException as e:
+        yield evento_sse("error", {"detail": e.detail})
+        return
+
+    yield evento_sse("fin", {**respuesta, "truncado": truncado})
+
+async def _fragmento_unico(texto: str) -> AsyncIterator[str]:
+    yield texto
+
+def manejar_crear_contenido_creativo_stream(data, current_user: Usuario) -> AsyncIterator[str]:
+    prompt = construir_prompt_crear_contenido_creativo(data)
+    clave = construir_clave_solicitud("crear_contenido_creativo", data, VERSION_PROMPTS)
+    return _transmitir_generacion(
+        prompt,
+        clave,
+        tipo_documento="crear_contenido_creativo",
+        evento_elemento="variacion",
+        prioridad=prioridad_para(current_user, "crear_contenido_creativo"),
+        modelo_respuesta=ContenidoCreativoRespuesta,
+        finalizar=lambda contenido_creativo: (contenido_creativo, contenido_creativo),
+        max_tokens=presupuesto_tokens.presupuesto(
+            "crear_contenido_creativo", estimar_tokens_salida("crear_contenido_creativo", data)
+        ),
+    )
 
-    # Manejo de la base de datos con un bloque de transacción explícito
-    nuevo_documento = Documento(
-        id_usuario=current_user.id_usuario,
+def manejar_create_heading_stream(encabezado, current_user: Usuario) -> AsyncIterator[str]:
+    prompt = construir_prompt_create_heading(encabezado)
+    clave = construir_clave_solicitud("create_heading", encabezado, VERSION_PROMPTS)
+
+    def finalizar(encabezados_data: dict) -> tuple:
+        encabezados = encabezados_data.get("encabezados", [])[:encabezado.variantes]
+        return {"encabezados": encabezados}, encabezados
+
+    return _transmitir_generacion(
+        prompt,
+        clave,
         tipo_documento="create_heading",
-        contenido=json.dumps(encabezados),
-        fecha_creacion=datetime.now(timezone.utc)
+        evento_elemento="encabezado",
+        prioridad=prioridad_para(current_user, "create_heading"),
+        modelo_respuesta=EncabezadosRespuesta,
+        finalizar=finalizar,
+        limite=encabezado.variantes,
+        max_tokens=presupuesto_tokens.presupuesto(
+            "create_heading", estimar_tokens_salida("create_heading", encabezado)
+        ),
+        restricciones=restricciones_encabezados(encabezado),
     )
-    db.add(nuevo_documento)
-    db.commit()
-    db.refresh(nuevo_documento)
-
-    return {"encabezados": encabezados}
@@ -0,0 +1,117 @@
+import os
+import time
+import math
+import asyncio
+import logging
+from collections import defaultdict, deque
+from typing import Awaitable, Callable, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# Configuración de las solicitudes de cobertura (hedging) hacia OpenAI
+HEDGE_HABILITADO = os.getenv("HEDGE_HABILITADO", "true").lower() == "true"
+HEDGE_PERCENTIL = float(os.getenv("HEDGE_PERCENTIL", "0.95"))            # Percentil de latencia reciente tras el que se lanza el segundo intento
+HEDGE_RETRASO_INICIAL = float(os.getenv("HEDGE_RETRASO_INICIAL", "8"))   # Retraso mientras no hay suficientes observaciones (segundos)
+HEDGE_RETRASO_MINIMO = float(os.getenv("HEDGE_RETRASO_MINIMO", "1"))
+HEDGE_PRESUPUESTO = float(os.getenv("HEDGE_PRESUPUESTO", "0.05"))        # Fracción máxima de llamadas que pueden duplicarse
+HEDGE_PRESUPUESTO_MAXIMO = 10.0   # Coberturas acumulables en calma para gastarlas en una ráfaga de lentitud
+VENTANA_LATENCIAS = 200
+MUESTRAS_MINIMAS = 20
+
+T = TypeVar("T")
+
+# Cada (endpoint, modelo) tiene su propia ventana: un paso corto con el modelo básico y uno largo
+# con el avanzado no comparten percentil
+ClaveLatencias = Tuple[str, str]
+
+class PoliticaHedging:
+    """Lanza un segundo intento idéntico si el primero tarda más que el percentil configurado.
+
+    El percentil se calcula sobre las latencias recientes del mismo endpoint y
+    modelo, que cada llamada indica con su `clave`. Gana la primera respuesta correcta y el intento perdedor se cancela. Cada
+    llamada suma HEDGE_PRESUPUESTO al presupuesto y cada cobertura gasta 1, de
+    modo que a largo plazo no se duplica más de esa fracción de las llamadas.
+    """
+
+    def __init__(self):
+        self._latencias = defaultdict(lambda: deque(maxlen=VENTANA_LATENCIAS))  # clave -> latencias recientes
+        self._presupuesto = 1.0
+        self.estadisticas = {"llamadas": 0, "coberturas": 0, "ganadas_por_cobertura": 0, "sin_presupuesto": 0}
+
+    def registrar_latencia(self, clave: ClaveLatencias, segundos: float):
+        self._latencias[clave].append(segundos)
+
+    def retraso(self, clave: ClaveLatencias) -> float:
+        latencias = self._latencias.get(clave, ())
+        if len(latencias) < MUESTRAS_MINIMAS:
+            return HEDGE_RETRASO_INICIAL
+        ordenadas = sorted(latencias)
+        indice = min(len(ordenadas) - 1, max(0, math.ceil(HEDGE_PERCENTIL * len(ordenadas)) - 1))
+        return max(HEDGE_RETRASO_MINIMO, ordenadas[indice])
+
+    def _consumir_presupuesto(self) -> bool:
+        if self._presupuesto < 1:
+            self.estadisticas["sin_presupuesto"] += 1
+            return False
+        self._presupuesto -= 1
+        return True
+
+    async def ejecutar(
+        self,
+        intento: Callable[[], Awaitable[T]],
+        clave: ClaveLatencias,
+        permitir: Optional[Callable[[], bool]] = None,
+    ) -> T:
+        """Ejecuta `intento` y, si tarda demasiado, una copia en paralelo; devuelve la primera respuesta correcta.
+
+        `permitir` se consulta antes de lanzar la copia (p. ej. para no duplicar llamadas con el sistema saturado).
+        """
+        self.estadisticas["llamadas"] += 1
+        self._presupuesto = min(HEDGE_PRESUPUESTO_MAXIMO, self._presupuesto + HEDGE_PRESUPUESTO)
+        primero = asyncio.create_task(intento())
+        if not HEDGE_HABILITADO:
+            return await primero
+
+        tareas = {primero}
+        retraso = self.retraso(clave)
+        try:
+            hechas, _ = await asyncio.wait(tareas, timeout=retraso)
+            if hechas or (permitir is not None and not permitir()) or not self._consumir_presupuesto():
+                return await primero
+
+            self.estadisticas["coberturas"] += 1
+            logger.info(f"OpenAI lleva más de {retraso:.1f}s sin responder ({clave[0]}, {clave[1]}); lanzando un segundo intento")
+            segundo = asyncio.create_task(intento())
+            tareas.add(segundo)
+            while tareas:
+                hechas, tareas = await asyncio.wait(tareas, return_when=asyncio.FIRST_COMPLETED)
+                correctas = [tarea for tarea in hechas if not tarea.exception()]
+                if correctas:
+                    ganadora = correctas[0]
+                    if ganadora is segundo:
+                        self.estadisticas["ganadas_por_cobertura"] += 1
+                    return ganadora.result()
+                if not tareas:
+                    # Ambos intentos fallaron: se propaga el error del primero
+                    return primero.result()
+        finally:
+            # El intento perdedor (o ambos, si se cancela al llamador) se cancela
+            for tarea in tareas:
+                tarea.cancel()
+
+    def resumen(self) -> dict:
+        llamadas = self.estadisticas["llamadas"] or 1
+        coberturas = self.estadisticas["coberturas"]
+        return {
+            **self.estadisticas,
+            "habilitado": HEDGE_HABILITADO,
+            "retraso_actual_s": {
+                f"{endpoint}/{modelo}": round(self.retraso((endpoint, modelo)), 3)
+                for endpoint, modelo in list(self._latencias)
+            },
+            "tasa_cobertura": round(coberturas / llamadas, 4),
+            "tasa_victoria": round(self.estadisticas["ganadas_por_cobertura"] / coberturas, 4) if coberturas else 0.0,
+        }
+
+# Instancia compartida por todas las llamadas del worker
+politica_hedging = PoliticaHedging()
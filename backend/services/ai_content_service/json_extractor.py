@@ -0,0 +1,208 @@
+import re
+import json
+from typing import List, Optional, Tuple
+
+# Caracteres relevantes fuera y dentro de un string JSON; el resto se salta con búsquedas en C
+_ESPECIALES = re.compile(r'[{}"]')
+_ESPECIALES_STRING = re.compile(r'["\\]')
+# Escape \uD800-\uDBFF (mitad alta de un par suplente) al final de un string, precedido por un número par de barras
+_SUSTITUTO_ALTO_FINAL = re.compile(r'(?:^|[^\\])(?:\\\\)*(\\u[dD][89abAB][0-9a-fA-F]{2})$')
+
+class ErrorExtraccionJSON(ValueError):
+    """Error de extracción con el offset (en caracteres) de la respuesta donde se produjo."""
+
+    def __init__(self, mensaje: str, offset: int):
+        super().__init__(f"{mensaje} (offset {offset})")
+        self.mensaje = mensaje
+        self.offset = offset
+
+class ExtractorJSONIncremental:
+    """Escáner de una sola pasada que encuentra el primer objeto JSON de nivel superior.
+
+    Lleva el balance de llaves ignorando las que aparecen dentro de strings
+    (respetando los escapes), por lo que su coste es lineal en el tamaño de la
+    respuesta. Se puede alimentar por fragmentos a medida que llega un stream:
+    `alimentar` devuelve el objeto en cuanto se cierra y `finalizar` lo devuelve
+    o lanza ErrorExtraccionJSON si la respuesta terminó sin un objeto válido.
+    """
+
+    def __init__(self):
+        self._partes: List[str] = []   # Fragmentos anteriores del candidato en curso
+        self._offset = 0               # Offset absoluto del inicio del fragmento actual
+        self._inicio: Optional[int] = None  # Offset absoluto del '{' del candidato en curso
+        self._profundidad = 0
+        self._en_string = False
+        self._escape = False
+        self.resultado: Optional[dict] = None
+        self.errores: List[ErrorExtraccionJSON] = []  # Candidatos descartados por JSON inválido
+
+    def alimentar(self, fragmento: str) -> Optional[dict]:
+        """Procesa un fragmento; devuelve el objeto si ya está completo, o None."""
+        if self.resultado is not None:
+            return self.resultado
+
+        pos = 0
+        inicio_local = 0
+        n = len(fragmento)
+        while pos < n:
+            if self._inicio is None:
+                # Fuera de un candidato solo interesa la siguiente llave de apertura
+                i = fragmento.find("{", pos)
+                if i == -1:
+                    break
+                self._inicio = self._offset + i
+                inicio_local = i
+                self._profundidad = 1
+                pos = i + 1
+                continue
+
+            if self._escape:
+                self._escape = False
+                pos += 1
+                continue
+
+            if self._en_string:
+                m = _ESPECIALES_STRING.search(fragmento, pos)
+                if m is None:
+                    break
+                pos = m.end()
+                if m.group() == "\\":
+                    self._escape = True
+                else:
+                    self._en_string = False
+                continue
+
+            m = _ESPECIALES.search(fragmento, pos)
+            if m is None:
+                break
+            caracter = m.group()
+            pos = m.end()
+            if caracter == '"':
+                self._en_string = True
+            elif caracter == "{":
+                self._profundidad += 1
+            else:
+                self._profundidad -= 1
+                if self._profundidad == 0:
+                    candidato = "".join(self._partes) + fragmento[inicio_local:pos]
+                    inicio = self._inicio
+                    self._reiniciar_candidato()
+                    try:
+                        datos = json.loads(candidato)
+                    except json.JSONDecodeError as e:
+                        # Llaves balanceadas pero JSON inválido: se sigue buscando después del candidato
+                        self.errores.append(ErrorExtraccionJSON(f"JSON inválido: {e.msg}", inicio + e.pos))
+                        continue
+                    self.resultado = datos
+                    self._offset += n
+                    return datos
+
+        if self._inicio is not None:
+            self._partes.append(fragmento[inicio_local:])
+        self._offset += n
+        return None
+
+    def finalizar(self) -> dict:
+        """Devuelve el objeto extraído o lanza ErrorExtraccionJSON con el offset del problema."""
+        if self.resultado is not None:
+            return self.resultado
+        if self._inicio is not None:
+            raise ErrorExtraccionJSON(
+                f"Objeto JSON incompleto iniciado en el offset {self._inicio}: "
+                f"faltan {self._profundidad} llave(s) de cierre",
+                self._offset,
+            )
+        if self.errores:
+            raise self.errores[0]
+        raise ErrorExtraccionJSON("No se encontró ningún objeto JSON en la respuesta", 0)
+
+    def _reiniciar_candidato(self):
+        self._partes = []
+        self._inicio = None
+        self._profundidad = 0
+        self._en_string = False
+        self._escape = False
+
+def extraer_primer_objeto(texto: str) -> dict:
+    """Extrae el primer objeto JSON de nivel superior de un texto completo."""
+    extractor = ExtractorJSONIncremental()
+    extractor.alimentar(texto)
+    return extractor.finalizar()
+
+def reparar_json_truncado(texto: str) -> Tuple[str, bool]:
+    """Repara un objeto JSON cortado por max_tokens.
+
+    Descarta el elemento final incompleto del array abierto más interno y
+    cierra los arrays y objetos pendientes. Si no hay arrays abiertos y el corte
+    cae dentro del valor string de un objeto, se cierra el string y se conserva
+    el texto parcial; cualquier otro par clave/valor incompleto se descarta.
+    Devuelve (texto, truncado); si el objeto estaba completo se devuelve tal
+    cual, y si no hay ningún objeto se devuelve el texto sin cambios.
+    """
+    inicio = texto.find("{")
+    if inicio == -1:
+        return texto, False
+
+    pila = []        # Contenedores abiertos: "{" o "["
+    cortes = []      # Por contenedor: posición hasta la que el contenido está completo
+    en_valor = []    # Por contenedor: en objetos, si ya se leyó ':' y se espera/lee el valor
+    en_string = False
+    escape = False
+    hex_pendientes = 0  # Dígitos que faltan del escape \uXXXX en curso
+    inicio_escape = 0   # Posición de la barra del último escape
+    i = inicio
+    n = len(texto)
+    while i < n:
+        caracter = texto[i]
+        if en_string:
+            if hex_pendientes:
+                hex_pendientes -= 1
+            elif escape:
+                escape = False
+                if caracter == "u":
+                    hex_pendientes = 4
+            elif caracter == "\\":
+                escape = True
+                inicio_escape = i
+            elif caracter == '"':
+                en_string = False
+                # Un string cerrado completa un elemento de array o el valor de un par
+                if pila[-1] == "[" or en_valor[-1]:
+                    cortes[-1] = i + 1
+        elif caracter == '"':
+            en_string = True
+        elif caracter in "{[":
+            pila.append(caracter)
+            cortes.append(i + 1)
+            en_valor.append(False)
+        elif caracter in "}]":
+            pila.pop()
+            cortes.pop()
+            en_valor.pop()
+            if not pila:
+                return texto[inicio:i + 1], False
+            cortes[-1] = i + 1
+        elif caracter == ",":
+            cortes[-1] = i
+            en_valor[-1] = False
+        elif caracter == ":":
+            en_valor[-1] = True
+        i += 1
+
+    # Nivel en el que se corta: el array abierto más interno, o el objeto más interno si no hay arrays
+    nivel = len(pila) - 1
+    for indice in range(len(pila) - 1, -1, -1):
+        if pila[indice] == "[":
+            nivel = indice
+            break
+
+    cierres = "".join("}" if contenedor == "{" else "]" for contenedor in reversed(pila[:nivel + 1]))
+    if en_string and nivel == len(pila) - 1 and pila[nivel] == "{" and en_valor[nivel]:
+        # Valor string de un objeto cortado a la mitad: se cierra conservando el texto parcial,
+        # sin el escape incompleto ni una mitad de par suplente que se quedaría sola
+        parcial = texto[inicio:inicio_escape] if escape or hex_pendientes else texto[inicio:]
+        sustituto = _SUSTITUTO_ALTO_FINAL.search(parcial)
+        if sustituto:
+            parcial = parcial[:sustituto.start(1)]
+        return parcial + '"' + cierres, True
+    return texto[inicio:cortes[nivel]] + cierres, True
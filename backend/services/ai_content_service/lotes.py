@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from dataclasses import replace
+from typing import List
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from common.database.database import AsyncSessionLocal
+from common.utils.session_manager import SessionManager
+from services.product_service.models import Producto
+from ..auth_service.models import Usuario
+from .handlers import generar_create_heading
+from .persistencia import fila_documento, persistencia_documentos
+from .planificador import PrioridadSolicitud, prioridad_para, solicitud_llm
+from .pregeneracion import datos_producto, entradas_por_defecto
+from .schemas import EncabezadoAnuncio
+from .trabajos import TRABAJOS_TTL, cola_trabajos
+
+logger = logging.getLogger(__name__)
+
+# Generación por lotes de encabezados para el catálogo de un usuario
+LOTES_CONCURRENCIA = int(os.getenv("LOTES_CONCURRENCIA", "4"))          # Productos en generación simultánea por lote
+LOTES_CHECKPOINT = int(os.getenv("LOTES_CHECKPOINT", "20"))             # Productos por punto de control (y por INSERT)
+LOTES_MAX_PRODUCTOS = int(os.getenv("LOTES_MAX_PRODUCTOS", "2000"))
+LOTES_FACTOR_PESO = float(os.getenv("LOTES_FACTOR_PESO", "0.5"))        # Peso del lote frente a las solicitudes interactivas
+TIPO_LOTE = "lote_create_heading"
+PREFIJO = "lote:"
+
+def _clave(id_lote: str) -> str:
+    return PREFIJO + id_lote
+
+def _clave_hechos(id_lote: str) -> str:
+    return f"{PREFIJO}{id_lote}:hechos"
+
+def _clave_errores(id_lote: str) -> str:
+    return f"{PREFIJO}{id_lote}:errores"
+
+def _redis():
+    redis = SessionManager.redis_client
+    if redis is None:
+        raise HTTPException(status_code=503, detail="Los lotes no están disponibles (Redis no inicializado).")
+    return redis
+
+async def manejar_crear_lote(data, current_user: Usuario, db: AsyncSession):
+    """Registra el lote y lo encola para los workers; devuelve el id para consultar su progreso."""
+    consulta = select(Producto.id_producto).where(Producto.id_usuario == current_user.id_usuario)
+    if data.ids_productos is not None:
+        consulta = consulta.where(Producto.id_producto.in_(data.ids_productos))
+    ids_productos = list((await db.execute(consulta.order_by(Producto.id_producto))).scalars())
+    if not ids_productos:
+        raise HTTPException(status_code=404, detail="No se encontraron productos para el lote")
+    if len(ids_productos) > LOTES_MAX_PRODUCTOS:
+        raise HTTPException(status_code=400, detail=f"El lote no puede superar los {LOTES_MAX_PRODUCTOS} productos")
+
+    prioridad = prioridad_para(current_user, TIPO_LOTE)
+    parametros = data.model_dump(exclude={"ids_productos"})
+    # El progreso se registra antes de encolar: un worker que tome el lote enseguida ya lo encuentra
+    id_lote = uuid.uuid4().hex
+    redis = _redis()
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(_clave(id_lote), mapping={
+            "id_usuario": current_user.id_usuario,
+            "estado": "pendiente",
+            "total": len(ids_productos),
+            "completados": 0,
+            "fallidos": 0,
+            "creado": time.time(),
+        })
+        pipe.expire(_clave(id_lote), TRABAJOS_TTL)
+        await pipe.execute()
+    try:
+        await cola_trabajos.encolar(
+            TIPO_LOTE,
+            {"ids_productos": ids_productos, "parametros": parametros},
+            replace(prioridad, peso=prioridad.peso * LOTES_FACTOR_PESO),
+            id_trabajo=id_lote,
+        )
+    except HTTPException:
+        await redis.delete(_clave(id_lote))
+        raise
+    return {"id_lote": id_lote, "estado": "pendiente", "total": len(ids_productos), "url": f"/content/lotes/{id_lote}"}
+
+async def manejar_consultar_lote(id_lote: str, current_user: Usuario):
+    lote = await _redis().hgetall(_clave(id_lote))
+    if not lote or lote.get("id_usuario") != str(current_user.id_usuario):
+        raise HTTPException(status_code=404, detail="Lote no encontrado")
+    return presentar_lote(id_lote, lote, await _redis().hgetall(_clave_errores(id_lote)))
+
+def presentar_lote(id_lote: str, lote: dict, errores: dict) -> dict:
+    """Progreso, ritmo y tiempo restante estimado del lote."""
+    total = int(lote["total"])
+    procesados = int(lote["completados"]) + int(lote["fallidos"])
+    vista = {
+        "id_lote": id_lote,
+        "estado": lote["estado"],
+        "total": total,
+        "completados": int(lote["completados"]),
+        "fallidos": int(lote["fallidos"]),
+        "progreso": round(procesados / total, 4) if total else 1.0,
+        "productos_por_minuto": None,
+        "eta_s": None,
+        "errores": {int(id_producto): error for id_producto, error in errores.items()},
+    }
+    if lote["estado"] == "en_proceso" and lote.get("inicio_ejecucion"):
+        # El ritmo se mide desde el último arranque (o reanudación) del lote
+        transcurrido = time.time() - float(lote["inicio_ejecucion"])
+        procesados_ahora = procesados - int(lote.get("procesados_al_inicio", 0))
+        if transcurrido > 0 and procesados_ahora > 0:
+            ritmo = procesados_ahora / transcurrido
+            vista["productos_por_minuto"] = round(ritmo * 60, 2)
+            vista["eta_s"] = round((total - procesados) / ritmo, 1)
+    return vista
+
+async def _cargar_productos(ids_productos: List[int], id_usuario: int) -> List[dict]:
+    async with AsyncSessionLocal() as db:
+        resultado = await db.execute(
+            select(Producto).where(
+                Producto.id_producto.in_(ids_productos), Producto.id_usuario == id_usuario
+            ).order_by(Producto.id_producto)
+        )
+        return [datos_producto(producto) for producto in resultado.scalars()]
+
+async def ejecutar_lote(trabajo: dict):
+    """Genera los encabezados de cada producto del lote con un pool acotado.
+
+    Cada LOTES_CHECKPOINT productos se insertan sus Documentos en bloque y se
+    marcan como hechos en Redis; si el worker cae, el trabajo se reencola y la
+    siguiente ejecución salta los productos ya hechos en lugar de empezar de cero.
+    """
+    redis = _redis()
+    id_lote = trabajo["id"]
+    id_usuario = int(trabajo["id_usuario"])
+    datos = json.loads(trabajo["datos"])
+    parametros = datos["parametros"]
+    # Las llamadas del lote pasan por el gobernador con su propio peso en el reparto justo
+    solicitud_llm.set(PrioridadSolicitud(id_usuario, trabajo["tipo_cuenta"], float(trabajo["peso"])))
+
+    hechos = {int(id_producto) for id_producto in await redis.smembers(_clave_hechos(id_lote))}
+    pendientes = [id_producto for id_producto in datos["ids_productos"] if id_producto not in hechos]
+    if hechos:
+        logger.info(f"Reanudando el lote {id_lote}: {len(hechos)} productos ya procesados, {len(pendientes)} pendientes")
+    productos = await _cargar_productos(pendientes, id_usuario)
+    # Los productos borrados después de crear el lote se cuentan como fallidos
+    encontrados = {producto["id_producto"] for producto in productos}
+    for id_producto in pendientes:
+        if id_producto not in encontrados:
+            await _registrar_fallo(redis, id_lote, id_producto, "Producto no encontrado")
+
+    await redis.hset(_clave(id_lote), mapping={
+        "estado": "en_proceso",
+        "inicio_ejecucion": time.time(),
+        "procesados_al_inicio": len(hechos) + len(pendientes) - len(productos),
+    })
+
+    semaforo = asyncio.Semaphore(LOTES_CONCURRENCIA)
+    cerrojo = asyncio.Lock()
+    filas, ids_en_buffer = [], []
+
+    async def punto_de_control():
+        async with cerrojo:
+            if not filas:
+                return
+            lote_filas, lote_ids = filas[:], ids_en_buffer[:]
+            filas.clear()
+            ids_en_buffer.clear()
+            # Solo tras guardar los documentos se marcan los productos como hechos
+            await persistencia_documentos.insertar(lote_filas)
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.sadd(_clave_hechos(id_lote), *lote_ids)
+                pipe.expire(_clave_hechos(id_lote), TRABAJOS_TTL)
+                pipe.hincrby(_clave(id_lote), "completados", len(lote_ids))
+                await pipe.execute()
+            await cola_trabajos.latido(id_lote)
+
+    async def procesar(producto: dict):
+        entradas = entradas_por_defecto(producto)
+        entradas.update({clave: valor for clave, valor in parametros.items() if valor is not None})
+        async with semaforo:
+            try:
+                _, encabezados = await generar_create_heading(EncabezadoAnuncio(**entradas))
+            except HTTPException as e:
+                await _registrar_fallo(redis, id_lote, producto["id_producto"], str(e.detail))
+                return
+            except Exception as e:
+                logger.exception(f"Error generando encabezados del producto {producto['id_producto']} en el lote {id_lote}")
+                await _registrar_fallo(redis, id_lote, producto["id_producto"], str(e))
+                return
+        filas.append(fila_documento(id_usuario, "create_heading", encabezados))
+        ids_en_buffer.append(producto["id_producto"])
+        if len(filas) >= LOTES_CHECKPOINT:
+            await punto_de_control()
+
+    tareas = [asyncio.create_task(procesar(producto)) for producto in productos]
+    try:
+        await asyncio.gather(*tareas)
+        await punto_de_control()
+    except Exception as e:
+        # Sin poder guardar, el trabajo falla: se cancelan los productos aún en generación (gather no lo
+        # hace al fallar una tarea) y lo ya marcado como hecho se conserva para reanudar
+        logger.exception(f"Error guardando el progreso del lote {id_lote}")
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        await redis.hset(_clave(id_lote), "estado", "fallido")
+        await cola_trabajos.finalizar(id_lote, error=str(getattr(e, "detail", e)))
+        return
+
+    lote = await redis.hgetall(_clave(id_lote))
+    await redis.hset(_clave(id_lote), mapping={"estado": "completado", "finalizado": time.time()})
+    await cola_trabajos.finalizar(
+        id_lote, resultado={"completados": int(lote["completados"]), "fallidos": int(lote["fallidos"])}
+    )
+
+async def _registrar_fallo(redis, id_lote: str, id_producto: int, error: str):
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(_clave_errores(id_lote), id_producto, error)
+        pipe.expire(_clave_errores(id_lote), TRABAJOS_TTL)
+        pipe.sadd(_clave_hechos(id_lote), id_producto)
+        pipe.expire(_clave_hechos(id_lote), TRABAJOS_TTL)
+        pipe.hincrby(_clave(id_lote), "fallidos", 1)
+        await pipe.execute()
+    await cola_trabajos.latido(id_lote)
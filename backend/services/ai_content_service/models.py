@@ -1,16 +1,28 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime
+import hashlib
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime, Index
 from sqlalchemy.orm import relationship
 from common.database.database import Base
 from datetime import datetime, timezone
 
+def calcular_hash_contenido(contenido: str) -> str:
+    """Huella SHA-256 del contenido; junto al usuario y al tipo identifica los documentos idénticos."""
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
 class Documento(Base):
     __tablename__ = "documentos"
+    # Un contenido idéntico se guarda una sola vez por usuario y tipo; las repeticiones suman a veces_generado
+    __table_args__ = (
+        Index("ix_documentos_usuario_tipo_hash", "id_usuario", "tipo_documento", "content_hash", unique=True),
+    )
 
     id_documento = Column(Integer, primary_key=True, index=True)
     id_usuario = Column(Integer, ForeignKey("usuarios.id_usuario"), nullable=False)
     tipo_documento = Column(String, nullable=False)
     contenido = Column(Text, nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    veces_generado = Column(Integer, nullable=False, default=1, server_default="1")
     fecha_creacion = Column(DateTime, default=datetime.now(timezone.utc), nullable=False)
+    fecha_ultima_generacion = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
 
     # Relación de vuelta con Usuario
-    usuario = relationship("Usuario", back_populates="documentos")
\ No newline at end of file
+    usuario = relationship("Usuario", back_populates="documentos")
@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import List, Optional
+from fastapi import HTTPException
+from sqlalchemy.dialects.postgresql import insert as insert_postgresql
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+from common.database.database import AsyncSessionLocal
+from common.utils.session_manager import SessionManager
+from .models import Documento, calcular_hash_contenido
+
+logger = logging.getLogger(__name__)
+
+# Persistencia diferida (write-behind) de los documentos generados
+DOCUMENTOS_LOTE = int(os.getenv("DOCUMENTOS_LOTE", "50"))                       # Filas que disparan un volcado inmediato
+DOCUMENTOS_INTERVALO = float(os.getenv("DOCUMENTOS_INTERVALO", "0.5"))          # Segundos máximos que una fila espera en memoria
+DOCUMENTOS_REINTENTOS = int(os.getenv("DOCUMENTOS_REINTENTOS", "3"))            # Intentos por lote antes de devolverlo a la cola
+DOCUMENTOS_MAX_PENDIENTES = int(os.getenv("DOCUMENTOS_MAX_PENDIENTES", "5000")) # Por encima, quien encola inserta él mismo
+DOCUMENTOS_PLAZO_CIERRE = float(os.getenv("DOCUMENTOS_PLAZO_CIERRE", "10"))    # Segundos que el cierre sigue reintentando
+DOCUMENTOS_DERRAMADOS = "documentos:pendientes"  # Lista de Redis con las filas que no se pudieron insertar al cierre
+# En AWS Lambda (Mangum) el proceso se congela entre invocaciones y el shutdown no está garantizado:
+# las filas en memoria podrían perderse, así que allí cada petición inserta sus documentos antes de responder
+DOCUMENTOS_WRITE_BEHIND = os.getenv(
+    "DOCUMENTOS_WRITE_BEHIND", "false" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "true"
+).lower() == "true"
+
+def fila_documento(id_usuario: int, tipo_documento: str, contenido) -> dict:
+    contenido = json.dumps(contenido)
+    ahora = datetime.now(timezone.utc)
+    return {
+        "id_usuario": id_usuario,
+        "tipo_documento": tipo_documento,
+        "contenido": contenido,
+        "content_hash": calcular_hash_contenido(contenido),
+        "veces_generado": 1,
+        "fecha_creacion": ahora,
+        "fecha_ultima_generacion": ahora,
+    }
+
+def agrupar_duplicados(filas: List[dict]) -> List[dict]:
+    """Funde las filas del lote con el mismo (id_usuario, tipo_documento, content_hash) sumando sus repeticiones.
+
+    Un mismo INSERT ... ON CONFLICT no puede actualizar dos veces la misma fila.
+    """
+    agrupadas = {}
+    for fila in filas:
+        clave = (fila["id_usuario"], fila["tipo_documento"], fila["content_hash"])
+        existente = agrupadas.get(clave)
+        if existente is None:
+            agrupadas[clave] = dict(fila)
+            continue
+        existente["veces_generado"] += fila["veces_generado"]
+        existente["fecha_ultima_generacion"] = max(existente["fecha_ultima_generacion"], fila["fecha_ultima_generacion"])
+    return list(agrupadas.values())
+
+def sentencia_upsert_documentos(dialecto: str):
+    """INSERT de documentos que, si el usuario ya tiene ese contenido con ese tipo, solo incrementa su contador.
+
+    El conflicto lo resuelve la base de datos sobre ix_documentos_usuario_tipo_hash,
+    así que dos inserciones concurrentes del mismo contenido no fallan.
+    """
+    insertar = insert_sqlite if dialecto == "sqlite" else insert_postgresql
+    sentencia = insertar(Documento)
+    return sentencia.on_conflict_do_update(
+        index_elements=["id_usuario", "tipo_documento", "content_hash"],
+        set_={
+            "veces_generado": Documento.veces_generado + sentencia.excluded.veces_generado,
+            "fecha_ultima_generacion": sentencia.excluded.fecha_ultima_generacion,
+        },
+    )
+
+_CAMPOS_FECHA = ("fecha_creacion", "fecha_ultima_generacion")
+
+def _fila_a_json(fila: dict) -> str:
+    return json.dumps({**fila, **{campo: fila[campo].isoformat() for campo in _CAMPOS_FECHA}})
+
+def _fila_desde_json(valor: str) -> dict:
+    fila = json.loads(valor)
+    return {**fila, **{campo: datetime.fromisoformat(fila[campo]) for campo in _CAMPOS_FECHA}}
+
+async def _insertar_lote(filas: List[dict]):
+    async with AsyncSessionLocal() as db:
+        # Un solo execute del upsert con la lista de filas (executemany en el driver async), en una
+        # transacción por lote; los contenidos ya guardados solo incrementan su contador
+        sentencia = sentencia_upsert_documentos(db.get_bind().dialect.name)
+        await db.execute(sentencia, agrupar_duplicados(filas))
+        await db.commit()
+
+class PersistenciaDocumentos:
+    """Cola en memoria de documentos generados que un volcador en segundo plano inserta por lotes.
+
+    Los handlers encolan la fila y responden sin esperar a la base de datos. El
+    volcador (una tarea del event loop, la única que vacía la cola) inserta
+    cuando se acumulan DOCUMENTOS_LOTE filas o pasan DOCUMENTOS_INTERVALO
+    segundos; si el upsert falla reintenta con espera exponencial y, agotados
+    los intentos, devuelve el lote a la cabeza de la cola para el siguiente ciclo.
+
+    La cola está acotada: con DOCUMENTOS_MAX_PENDIENTES filas esperando (la base
+    de datos no da abasto o está caída) quien encola inserta sus filas
+    directamente y recibe el error si falla. Al detenerse sigue reintentando
+    hasta DOCUMENTOS_PLAZO_CIERRE segundos; lo que quede se guarda en la lista
+    de Redis DOCUMENTOS_DERRAMADOS y el siguiente volcador en arrancar lo
+    recupera. Sin volcador en marcha (scripts, tests, Lambda con
+    DOCUMENTOS_WRITE_BEHIND desactivado) las filas se insertan al encolar.
+    """
+
+    def __init__(self):
+        self._pendientes = deque()
+        self._tarea: Optional[asyncio.Task] = None
+        self._despertar: Optional[asyncio.Event] = None
+        self._detener = False
+        self.estadisticas = {
+            "encoladas": 0, "insertadas": 0, "lotes": 0, "reintentos": 0, "lotes_fallidos": 0,
+            "insertadas_directamente": 0, "derramadas": 0, "recuperadas": 0,
+        }
+
+    def iniciar(self):
+        """Arranca el volcador en el event loop actual (startup de la aplicación o del worker)."""
+        if self._tarea is not None or not DOCUMENTOS_WRITE_BEHIND:
+            return
+        # El Event se crea aquí para quedar ligado al loop en marcha y no al de la importación
+        self._despertar = asyncio.Event()
+        self._detener = False
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self):
+        """Vacía la cola (o la guarda en Redis si la base de datos no responde) y detiene el volcador."""
+        if self._tarea is None:
+            return
+        self._detener = True
+        self._despertar.set()
+        await self._tarea
+        self._tarea = None
+
+    async def encolar(self, id_usuario: int, tipo_documento: str, contenido):
+        await self.encolar_filas([fila_documento(id_usuario, tipo_documento, contenido)])
+
+    async def encolar_filas(self, filas: List[dict]):
+        if self._tarea is None:
+            await self.insertar(filas)
+            return
+        if len(self._pendientes) + len(filas) > DOCUMENTOS_MAX_PENDIENTES:
+            # La base de datos no da abasto: en lugar de crecer sin límite, quien produce inserta
+            # sus filas y, si la base de datos está caída, el error le llega a él
+            self.estadisticas["insertadas_directamente"] += len(filas)
+            await self.insertar(filas)
+            return
+        self.estadisticas["encoladas"] += len(filas)
+        self._pendientes.extend(filas)
+        if len(self._pendientes) >= DOCUMENTOS_LOTE:
+            self._despertar.set()
+
+    async def insertar(self, filas: List[dict]):
+        """Inserta las filas sin pasar por la cola, para quien necesita saber que ya están guardadas."""
+        self.estadisticas["encoladas"] += len(filas)
+        if not await self._volcar_lote(filas):
+            raise HTTPException(status_code=500, detail="Error al guardar los documentos generados.")
+
+    async def _bucle(self):
+        await self._recuperar_derramadas()
+        while not self._detener:
+            try:
+                await asyncio.wait_for(self._despertar.wait(), DOCUMENTOS_INTERVALO)
+            except asyncio.TimeoutError:
+                pass
+            self._despertar.clear()
+            await self._volcar_pendientes()
+
+        # Cierre: se reintenta hasta el plazo y lo que no se pudo insertar se guarda en Redis
+        plazo = time.monotonic() + DOCUMENTOS_PLAZO_CIERRE
+        while not await self._volcar_pendientes():
+            if time.monotonic() >= plazo:
+                await self._derramar()
+                return
+            await asyncio.sleep(min(1.0, max(plazo - time.monotonic(), 0)))
+
+    async def _volcar_pendientes(self) -> bool:
+        """Inserta la cola por lotes; devuelve False si un lote falló y volvió a la cola."""
+        while self._pendientes:
+            cantidad = min(DOCUMENTOS_LOTE, len(self._pendientes))
+            lote = [self._pendientes.popleft() for _ in range(cantidad)]
+            if not await self._volcar_lote(lote):
+                # El lote vuelve a la cabeza de la cola, en su orden, para el siguiente ciclo
+                self._pendientes.extendleft(reversed(lote))
+                return False
+        return True
+
+    async def _derramar(self):
+        """Guarda en Redis las filas que el cierre no pudo insertar."""
+        cantidad = len(self._pendientes)
+        redis = SessionManager.redis_client
+        if redis is not None:
+            try:
+                await redis.rpush(DOCUMENTOS_DERRAMADOS, *(_fila_a_json(fila) for fila in self._pendientes))
+            except Exception as e:
+                logger.error(f"No se pudieron guardar en Redis los documentos pendientes: {e}")
+            else:
+                self._pendientes.clear()
+                self.estadisticas["derramadas"] += cantidad
+                logger.warning(f"{cantidad} documentos sin persistir se guardaron en Redis ({DOCUMENTOS_DERRAMADOS})")
+                return
+        logger.error(f"Se perdieron {cantidad} documentos sin persistir al detener el servicio")
+
+    async def _recuperar_derramadas(self):
+        """Devuelve a la cola las filas que otro proceso guardó en Redis al detenerse."""
+        redis = SessionManager.redis_client
+        if redis is None:
+            return
+        try:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.lrange(DOCUMENTOS_DERRAMADOS, 0, -1)
+                pipe.delete(DOCUMENTOS_DERRAMADOS)
+                valores, _ = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"No se pudieron recuperar de Redis los documentos pendientes: {e}")
+            return
+        if valores:
+            self._pendientes.extendleft(reversed([_fila_desde_json(valor) for valor in valores]))
+            self.estadisticas["recuperadas"] += len(valores)
+            logger.info(f"Recuperados {len(valores)} documentos pendientes de un cierre anterior")
+
+    async def _volcar_lote(self, lote: List[dict]) -> bool:
+        for intento in range(DOCUMENTOS_REINTENTOS):
+            try:
+                await _insertar_lote(lote)
+            except Exception as e:
+                self.estadisticas["reintentos"] += 1
+                logger.warning(f"Error insertando un lote de {len(lote)} documentos (intento {intento + 1}): {e}")
+                await asyncio.sleep(min(0.2 * 2 ** intento, 5))
+                continue
+            self.estadisticas["insertadas"] += len(lote)
+            self.estadisticas["lotes"] += 1
+            return True
+        self.estadisticas["lotes_fallidos"] += 1
+        logger.error(f"No se pudo insertar un lote de {len(lote)} documentos tras {DOCUMENTOS_REINTENTOS} intentos")
+        return False
+
+    def resumen(self) -> dict:
+        lotes = self.estadisticas["lotes"]
+        return {
+            **self.estadisticas,
+            "pendientes": len(self._pendientes),
+            "write_behind": DOCUMENTOS_WRITE_BEHIND,
+            "filas_por_lote": round(self.estadisticas["insertadas"] / lotes, 2) if lotes else 0.0,
+        }
+
+# Instancia compartida por todos los handlers del proceso
+persistencia_documentos = PersistenciaDocumentos()
@@ -0,0 +1,132 @@
+import os
+import time
+import asyncio
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+def _leer_pesos(valor: str) -> Dict[str, float]:
+    pesos = {}
+    for par in valor.split(","):
+        if ":" in par:
+            tipo, peso = par.split(":", 1)
+            pesos[tipo.strip().casefold()] = float(peso)
+    return pesos
+
+# Peso de cada tipo de cuenta en el reparto de la capacidad de OpenAI
+PESOS_TIPO_CUENTA = _leer_pesos(os.getenv("PLANIFICADOR_PESOS", "Standard:1,Premium:4,Enterprise:8"))
+PESO_POR_DEFECTO = 1.0
+
+# Plazo orientativo (segundos) en el que cada endpoint debería obtener turno
+PLAZOS_ENDPOINT = {
+    "create_heading": 2.0,
+    "crear_contenido_creativo": 3.0,
+    "elegir_formato_cta": 3.0,
+    "definir_campana": 5.0,
+    "definir_publico_ubicaciones": 5.0,
+    "campaign_bundle": 8.0,
+}
+PLAZO_POR_DEFECTO = float(os.getenv("PLANIFICADOR_PLAZO_POR_DEFECTO", "30"))
+MARGEN_URGENCIA = float(os.getenv("PLANIFICADOR_MARGEN_URGENCIA", "0.5"))  # Segundos antes del plazo en que se adelanta
+
+@dataclass(frozen=True)
+class PrioridadSolicitud:
+    """Quién pide la generación y con qué urgencia."""
+    id_usuario: Optional[int] = None
+    tipo_cuenta: str = "Standard"
+    peso: float = PESO_POR_DEFECTO
+    plazo: float = PLAZO_POR_DEFECTO
+
+# Prioridad de la solicitud en curso; la fijan los handlers y la heredan las tareas que crean
+solicitud_llm: ContextVar[PrioridadSolicitud] = ContextVar("solicitud_llm", default=PrioridadSolicitud())
+
+def prioridad_para(usuario, endpoint: str) -> PrioridadSolicitud:
+    """Construye la prioridad a partir del tipo de cuenta del usuario y del endpoint."""
+    tipo_cuenta = usuario.cuenta.tipo_cuenta if usuario.cuenta else "Standard"
+    return PrioridadSolicitud(
+        id_usuario=usuario.id_usuario,
+        tipo_cuenta=tipo_cuenta,
+        peso=PESOS_TIPO_CUENTA.get(tipo_cuenta.casefold(), PESO_POR_DEFECTO),
+        plazo=PLAZOS_ENDPOINT.get(endpoint, PLAZO_POR_DEFECTO),
+    )
+
+def identificar_solicitud(usuario, endpoint: str) -> PrioridadSolicitud:
+    """Fija la prioridad de las llamadas a OpenAI que haga la solicitud en curso."""
+    prioridad = prioridad_para(usuario, endpoint)
+    solicitud_llm.set(prioridad)
+    return prioridad
+
+@dataclass
+class Turno:
+    prioridad: PrioridadSolicitud
+    inicio_virtual: float
+    fin_virtual: float
+    vence: float
+    encolado: float
+    futuro: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+class PlanificadorJusto:
+    """Weighted fair queuing entre usuarios.
+
+    Cada usuario tiene su propia cola FIFO. Al encolar, la solicitud recibe una
+    etiqueta de fin virtual `inicio + 1 / peso`, donde el inicio es el máximo
+    entre el tiempo virtual global y el fin de la solicitud anterior del mismo
+    usuario; así un usuario con muchas solicitudes pendientes no adelanta a los
+    demás y las cuentas con más peso avanzan más rápido. Las solicitudes cuyo
+    plazo está por vencer se atienden antes, por orden de vencimiento.
+    """
+
+    def __init__(self):
+        self._colas: Dict[Optional[int], deque] = {}
+        self._fin_usuario: Dict[Optional[int], float] = {}
+        self._tiempo_virtual = 0.0
+        self.en_cola = 0
+
+    def encolar(self, prioridad: PrioridadSolicitud) -> Turno:
+        usuario = prioridad.id_usuario
+        inicio = max(self._tiempo_virtual, self._fin_usuario.get(usuario, 0.0))
+        ahora = time.monotonic()
+        turno = Turno(prioridad, inicio, inicio + 1 / prioridad.peso, ahora + prioridad.plazo, ahora)
+        self._fin_usuario[usuario] = turno.fin_virtual
+        self._colas.setdefault(usuario, deque()).append(turno)
+        self.en_cola += 1
+        return turno
+
+    def siguiente(self, puede_entrar: Callable[[Optional[int]], bool]) -> Optional[Turno]:
+        """Saca el siguiente turno entre los usuarios que aún pueden tener llamadas en vuelo."""
+        candidatos = [cola[0] for usuario, cola in self._colas.items() if puede_entrar(usuario)]
+        if not candidatos:
+            return None
+        limite_urgencia = time.monotonic() + MARGEN_URGENCIA
+        urgentes = [turno for turno in candidatos if turno.vence <= limite_urgencia]
+        if urgentes:
+            turno = min(urgentes, key=lambda t: t.vence)
+        else:
+            turno = min(candidatos, key=lambda t: t.fin_virtual)
+        self._quitar(turno)
+        self._tiempo_virtual = max(self._tiempo_virtual, turno.inicio_virtual)
+        return turno
+
+    def cancelar(self, turno: Turno):
+        """Retira un turno que dejó de esperar (timeout o cancelación del cliente)."""
+        if turno in self._colas.get(turno.prioridad.id_usuario, ()):
+            self._quitar(turno)
+
+    def _quitar(self, turno: Turno):
+        usuario = turno.prioridad.id_usuario
+        cola = self._colas[usuario]
+        cola.remove(turno)
+        self.en_cola -= 1
+        if not cola:
+            del self._colas[usuario]
+            # Sin solicitudes pendientes, el usuario vuelve a competir desde el tiempo virtual actual
+            if self._fin_usuario.get(usuario, 0.0) <= self._tiempo_virtual:
+                self._fin_usuario.pop(usuario, None)
+
+    def resumen(self) -> dict:
+        return {
+            "en_cola": self.en_cola,
+            "usuarios_en_cola": len(self._colas),
+            "tiempo_virtual": round(self._tiempo_virtual, 3),
+        }
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from dataclasses import replace
+from typing import List
+from fastapi import HTTPException
+from common.utils.session_manager import SessionManager
+from .handlers import PASOS_CAMPANA
+from .planificador import PrioridadSolicitud, solicitud_llm
+from .trabajos import cola_trabajos
+
+logger = logging.getLogger(__name__)
+
+# Pregeneración especulativa del asistente al crear o actualizar un producto (desactivada por defecto)
+PREGENERACION_HABILITADA = os.getenv("PREGENERACION_HABILITADA", "false").lower() == "true"
+PREGENERACION_PASOS = [
+    paso.strip()
+    for paso in os.getenv("PREGENERACION_PASOS", "definir_campana,elegir_formato_cta,create_heading").split(",")
+    if paso.strip() in PASOS_CAMPANA
+]
+PREGENERACION_FACTOR_PESO = float(os.getenv("PREGENERACION_FACTOR_PESO", "0.25"))  # Peso frente a las solicitudes interactivas
+PREGENERACION_TTL = int(os.getenv("PREGENERACION_TTL", "604800"))                   # Segundos que se conservan los resultados
+TIPO_PREGENERACION = "pregenerar_producto"
+PREFIJO = "pregeneracion:"
+
+# Parámetros por defecto con los que se rellena el asistente a partir del producto
+VALORES_POR_DEFECTO = {
+    "tipoCampana": "Mediana",
+    "duracionPreferida": "Mediana",
+    "estiloEscritura": "Persuasivo",
+    "longitudMaxima": 40,
+    "variantes": 3,
+}
+
+# Escribe campos en los resultados de una versión solo si sigue siendo la actual del producto, y
+# renueva su TTL: una escritura tardía no puede recrear sin expiración la clave de una versión borrada.
+# KEYS[1] = versión actual, KEYS[2] = resultados; ARGV = versión, ttl, campo1, valor1, ...
+_SCRIPT_ESCRIBIR_SI_VIGENTE = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[2], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+def datos_producto(producto) -> dict:
+    """Copia de los campos del producto que usa la pregeneración (la sesión de BD no sobrevive a la respuesta)."""
+    return {
+        "id_producto": producto.id_producto,
+        "id_usuario": producto.id_usuario,
+        "nombre": producto.nombre,
+        "descripcion": producto.descripcion,
+        "caracteristicas": producto.caracteristicas,
+    }
+
+def version_producto(producto: dict) -> str:
+    """Versión de los campos que entran en los prompts; cambiar, p. ej., el precio no invalida nada."""
+    campos = [producto["nombre"], producto["descripcion"], producto["caracteristicas"]]
+    return hashlib.sha256(json.dumps(campos, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+def entradas_por_defecto(producto: dict) -> dict:
+    caracteristicas = [parte.strip() for parte in (producto["caracteristicas"] or "").split(",") if parte.strip()]
+    return {
+        **VALORES_POR_DEFECTO,
+        "nombreProducto": producto["nombre"],
+        "descripcionProducto": producto["descripcion"] or producto["caracteristicas"] or producto["nombre"],
+        "palabrasClave": caracteristicas[:5] or [producto["nombre"]],
+    }
+
+def _clave_version(id_producto) -> str:
+    return f"{PREFIJO}{id_producto}"
+
+def _clave_resultados(id_producto, version: str) -> str:
+    return f"{PREFIJO}{id_producto}:{version}"
+
+async def programar_pregeneracion(producto: dict, prioridad: PrioridadSolicitud):
+    """Invalida los resultados de versiones anteriores y encola la pregeneración de la actual.
+
+    Se ejecuta como tarea en segundo plano: cualquier error se registra sin afectar al producto.
+    """
+    if not PREGENERACION_HABILITADA or not PREGENERACION_PASOS:
+        return
+    redis = SessionManager.redis_client
+    if redis is None:
+        logger.warning("Pregeneración omitida: Redis no está inicializado")
+        return
+    id_producto = producto["id_producto"]
+    version = version_producto(producto)
+    try:
+        anterior = await redis.get(_clave_version(id_producto))
+        if anterior == version and await redis.exists(_clave_resultados(id_producto, version)):
+            return  # Sin cambios en los campos que usan los prompts
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.set(_clave_version(id_producto), version, ex=PREGENERACION_TTL)
+            if anterior:
+                pipe.delete(_clave_resultados(id_producto, anterior))
+            pipe.hset(_clave_resultados(id_producto, version), mapping={"estado": "pendiente", "actualizado": time.time()})
+            pipe.expire(_clave_resultados(id_producto, version), PREGENERACION_TTL)
+            await pipe.execute()
+        await cola_trabajos.encolar(
+            TIPO_PREGENERACION,
+            {"id_producto": id_producto, "version": version, "entradas": entradas_por_defecto(producto)},
+            replace(prioridad, peso=prioridad.peso * PREGENERACION_FACTOR_PESO),
+            baja_prioridad=True,
+        )
+    except Exception as e:
+        logger.error(f"No se pudo programar la pregeneración del producto {id_producto}: {e}")
+
+async def invalidar_pregeneracion(id_producto: int):
+    redis = SessionManager.redis_client
+    if redis is None:
+        return
+    try:
+        version = await redis.get(_clave_version(id_producto))
+        claves = [_clave_version(id_producto)] + ([_clave_resultados(id_producto, version)] if version else [])
+        await redis.delete(*claves)
+    except Exception as e:
+        logger.error(f"No se pudo invalidar la pregeneración del producto {id_producto}: {e}")
+
+async def _escribir_si_vigente(redis, id_producto, version: str, campos: dict) -> bool:
+    """Guarda los campos en los resultados de la versión; False si el producto ya cambió de versión."""
+    argumentos = [valor for campo_valor in campos.items() for valor in campo_valor]
+    return bool(await redis.eval(
+        _SCRIPT_ESCRIBIR_SI_VIGENTE, 2, _clave_version(id_producto), _clave_resultados(id_producto, version),
+        version, PREGENERACION_TTL, *argumentos,
+    ))
+
+async def ejecutar_pregeneracion(trabajo: dict):
+    """Ejecuta los pasos pregenerados de un producto mientras su versión siga siendo la actual."""
+    redis = SessionManager.redis_client
+    datos = json.loads(trabajo["datos"])
+    id_producto, version, entradas = datos["id_producto"], datos["version"], datos["entradas"]
+    solicitud_llm.set(PrioridadSolicitud(int(trabajo["id_usuario"]), trabajo["tipo_cuenta"], float(trabajo["peso"])))
+    completados: List[str] = []
+
+    async def escribir(campos: dict) -> bool:
+        # Si el producto cambió mientras tanto no se escribe nada y el resto del trabajo ya no sirve
+        if await _escribir_si_vigente(redis, id_producto, version, campos):
+            return True
+        logger.info(f"Pregeneración del producto {id_producto} descartada: versión {version} obsoleta")
+        await cola_trabajos.finalizar(trabajo["id"], resultado={"obsoleto": True, "pasos": completados})
+        return False
+
+    for paso in PREGENERACION_PASOS:
+        if not await escribir({"estado": "en_proceso", "actualizado": time.time()}):
+            return
+        esquema, generar = PASOS_CAMPANA[paso]
+        try:
+            respuesta, _ = await generar(esquema(**entradas))
+            resultado = {f"paso:{paso}": json.dumps(respuesta, ensure_ascii=False)}
+        except HTTPException as e:
+            resultado = {f"error:{paso}": str(e.detail)}
+        except Exception as e:
+            logger.exception(f"Error pregenerando {paso} del producto {id_producto}")
+            resultado = {f"error:{paso}": str(e)}
+        if not await escribir(resultado):
+            return
+        if f"paso:{paso}" in resultado:
+            completados.append(paso)
+    if not await escribir({"estado": "listo", "actualizado": time.time()}):
+        return
+    await cola_trabajos.finalizar(trabajo["id"], resultado={"id_producto": id_producto, "version": version, "pasos": completados})
+
+async def obtener_pregeneracion(producto: dict) -> dict:
+    """Resultados pregenerados para la versión actual del producto, si existen."""
+    version = version_producto(producto)
+    vacio = {"version": version, "estado": "no_disponible", "resultados": {}, "errores": {}, "pendientes": PREGENERACION_PASOS}
+    redis = SessionManager.redis_client
+    if redis is None or await redis.get(_clave_version(producto["id_producto"])) != version:
+        return vacio
+    guardado = await redis.hgetall(_clave_resultados(producto["id_producto"], version))
+    if not guardado:
+        return vacio
+    resultados = {campo[len("paso:"):]: json.loads(valor) for campo, valor in guardado.items() if campo.startswith("paso:")}
+    errores = {campo[len("error:"):]: valor for campo, valor in guardado.items() if campo.startswith("error:")}
+    return {
+        "version": version,
+        "estado": guardado.get("estado", "pendiente"),
+        "resultados": resultados,
+        "errores": errores,
+        "pendientes": [paso for paso in PREGENERACION_PASOS if paso not in resultados and paso not in errores],
+    }
@@ -0,0 +1,91 @@
+import os
+import math
+from collections import defaultdict, deque
+from typing import Dict
+
+# Configuración del presupuesto de tokens de salida
+TOKENS_MINIMOS = int(os.getenv("LLM_TOKENS_MINIMOS", "64"))
+TOKENS_MAXIMOS = int(os.getenv("LLM_TOKENS_MAXIMOS", "1500"))
+VENTANA_OBSERVACIONES = int(os.getenv("LLM_TOKENS_VENTANA", "200"))   # Observaciones recientes por endpoint
+MUESTRAS_MINIMAS = int(os.getenv("LLM_TOKENS_MUESTRAS_MINIMAS", "20"))
+FACTOR_INICIAL = 1.3      # Holgura sobre la estimación mientras no hay suficientes observaciones
+MARGEN = 1.15             # Holgura sobre el percentil 95 observado
+PENALIZACION_TRUNCADO = 1.5  # Una respuesta cortada necesitaba al menos esto más de lo asignado
+CARACTERES_POR_TOKEN = 3.5
+LIMITES_HISTOGRAMA = (64, 128, 256, 512, 1024, 2048)
+
+def _contar_elementos(texto: str) -> int:
+    return max(1, len([parte for parte in (texto or "").split(",") if parte.strip()]))
+
+def estimar_tokens_salida(endpoint: str, datos) -> int:
+    """Estima los tokens de salida de una generación a partir de los parámetros de la solicitud."""
+    if endpoint == "create_heading":
+        # Cada encabezado cabe en longitudMaxima caracteres, más comillas y separadores
+        por_encabezado = datos.longitudMaxima / CARACTERES_POR_TOKEN + 6
+        return int(datos.variantes * por_encabezado + 20)
+    if endpoint == "crear_contenido_creativo":
+        return 3 * (20 + 110) + 30  # Tres variaciones de título y contenido
+    if endpoint == "definir_publico_ubicaciones":
+        ubicaciones = max(_contar_elementos(datos.distrito), _contar_elementos(datos.provincia))
+        return 220 + 35 * ubicaciones
+    if endpoint == "definir_campana":
+        return 260
+    if endpoint == "elegir_formato_cta":
+        return 150
+    return 300
+
+def _percentil(valores, percentil: float) -> float:
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, math.ceil(percentil * len(ordenados)) - 1))
+    return ordenados[indice]
+
+class PresupuestoTokens:
+    """Calcula max_tokens por llamada y lo ajusta con las salidas observadas de cada endpoint."""
+
+    def __init__(self, ventana: int = VENTANA_OBSERVACIONES):
+        # Por endpoint: ratio entre tokens usados y estimados, y tokens usados
+        self._ratios: Dict[str, deque] = defaultdict(lambda: deque(maxlen=ventana))
+        self._tokens: Dict[str, deque] = defaultdict(lambda: deque(maxlen=ventana))
+        self._truncadas: Dict[str, int] = defaultdict(int)
+
+    def factor(self, endpoint: str) -> float:
+        ratios = self._ratios[endpoint]
+        if len(ratios) < MUESTRAS_MINIMAS:
+            return FACTOR_INICIAL
+        return _percentil(ratios, 0.95) * MARGEN
+
+    def presupuesto(self, endpoint: str, estimacion: int) -> int:
+        """Devuelve el max_tokens para una llamada con la estimación dada."""
+        return max(TOKENS_MINIMOS, min(TOKENS_MAXIMOS, math.ceil(estimacion * self.factor(endpoint))))
+
+    def registrar(self, endpoint: str, estimacion: int, tokens_usados: int, truncado: bool):
+        """Registra el tamaño real de una salida; las truncadas cuentan como mayores de lo asignado."""
+        if not estimacion or tokens_usados is None:
+            return
+        ratio = tokens_usados / estimacion
+        if truncado:
+            self._truncadas[endpoint] += 1
+            ratio *= PENALIZACION_TRUNCADO
+        self._ratios[endpoint].append(ratio)
+        self._tokens[endpoint].append(tokens_usados)
+
+    def resumen(self) -> dict:
+        resumen = {}
+        for endpoint, tokens in self._tokens.items():
+            histograma = {f"<={limite}": 0 for limite in LIMITES_HISTOGRAMA}
+            histograma[f">{LIMITES_HISTOGRAMA[-1]}"] = 0
+            for usados in tokens:
+                cubeta = next((f"<={limite}" for limite in LIMITES_HISTOGRAMA if usados <= limite), None)
+                histograma[cubeta or f">{LIMITES_HISTOGRAMA[-1]}"] += 1
+            resumen[endpoint] = {
+                "muestras": len(tokens),
+                "tokens_p50": _percentil(tokens, 0.5),
+                "tokens_p95": _percentil(tokens, 0.95),
+                "factor": round(self.factor(endpoint), 3),
+                "truncadas": self._truncadas[endpoint],
+                "histograma": histograma,
+            }
+        return resumen
+
+# Instancia compartida por todos los handlers del servicio
+presupuesto_tokens = PresupuestoTokens()
@@ -0,0 +1,275 @@
+import json
+import math
+import zlib
+import random
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional
+import httpx
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
+from .config import (
+    LLM_LOCAL_ELEMENTOS,
+    LLM_LOCAL_ERRORES,
+    LLM_LOCAL_LATENCIA_P50,
+    LLM_LOCAL_LATENCIA_P99,
+    LLM_LOCAL_RESPUESTAS,
+    LLM_LOCAL_SEMILLA,
+    LLM_PROVEEDOR,
+    OPENAI_API_KEY,
+    OPENAI_CONNECT_TIMEOUT,
+    OPENAI_KEEPALIVE_EXPIRY,
+    OPENAI_MAX_CONEXIONES,
+    OPENAI_MAX_KEEPALIVE,
+    OPENAI_MAX_REINTENTOS,
+    OPENAI_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class SolicitudLLM:
+    """Parámetros de una llamada al modelo, independientes del proveedor."""
+    modelo: str
+    mensajes: List[dict]
+    max_tokens: int
+    timeout: Optional[float] = None
+    response_format: Optional[dict] = None
+    esquema: Optional[dict] = None  # Esquema JSON esperado, para proveedores que no usan response_format
+
+@dataclass
+class RespuestaLLM:
+    texto: str
+    truncada: bool = False           # Cortada por max_tokens
+    tokens_salida: Optional[int] = None
+
+class ProveedorLLM(ABC):
+    """Interfaz común de los proveedores de modelos de lenguaje.
+
+    Los errores se señalan con las excepciones del SDK de OpenAI (429, 5xx,
+    timeout, conexión) para que el gobernador, el circuito y la traducción a
+    HTTP funcionen igual con cualquier proveedor.
+    """
+
+    nombre = "base"
+
+    @abstractmethod
+    async def completar(self, solicitud: SolicitudLLM) -> RespuestaLLM:
+        """Devuelve la respuesta completa del modelo."""
+
+    @abstractmethod
+    def transmitir(self, solicitud: SolicitudLLM) -> AsyncIterator[str]:
+        """Devuelve los fragmentos de texto a medida que el modelo los genera."""
+
+    async def cerrar(self):
+        pass
+
+class ProveedorOpenAI(ProveedorLLM):
+    nombre = "openai"
+
+    def __init__(self):
+        # Cliente HTTP compartido: un único pool con keep-alive para todas las llamadas
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONEXIONES,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        )
+        # Cliente asíncrono de OpenAI sobre el pool compartido
+        self.client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            http_client=self.http_client,
+            timeout=OPENAI_TIMEOUT,
+            # Pocos reintentos internos: el gobernador necesita ver los 429/5xx para ajustar la concurrencia
+            max_retries=OPENAI_MAX_REINTENTOS,
+        )
+
+    def _parametros(self, solicitud: SolicitudLLM) -> dict:
+        return {
+            "model": solicitud.modelo,
+            "messages": solicitud.mensajes,
+            "max_tokens": solicitud.max_tokens,
+            "temperature": 0.7,
+            **({"timeout": solicitud.timeout} if solicitud.timeout is not None else {}),
+            **({"response_format": solicitud.response_format} if solicitud.response_format else {}),
+        }
+
+    async def completar(self, solicitud: SolicitudLLM) -> RespuestaLLM:
+        response = await self.client.chat.completions.create(**self._parametros(solicitud))
+        texto = ''.join([
+            choice.message.content for choice in response.choices
+            if choice.message and choice.message.content
+        ]).strip()
+        return RespuestaLLM(
+            texto,
+            truncada=any(choice.finish_reason == "length" for choice in response.choices),
+            tokens_salida=response.usage.completion_tokens if response.usage else None,
+        )
+
+    async def transmitir(self, solicitud: SolicitudLLM) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(**self._parametros(solicitud), stream=True)
+        async for chunk in stream:
+            for choice in chunk.choices:
+                if choice.delta and choice.delta.content:
+                    yield choice.delta.content
+
+    async def cerrar(self):
+        await self.client.close()
+
+def _parsear_errores(valor: str) -> List[tuple]:
+    """Convierte "429:0.02,500:0.01,timeout:0.005" en [(tipo, probabilidad), ...]."""
+    errores = []
+    for parte in valor.split(","):
+        if ":" not in parte:
+            continue
+        tipo, probabilidad = parte.split(":", 1)
+        errores.append((tipo.strip().lower(), float(probabilidad)))
+    return errores
+
+def _error_simulado(tipo: str) -> Exception:
+    solicitud = httpx.Request("POST", "http://proveedor-local/v1/chat/completions")
+    if tipo == "timeout":
+        return APITimeoutError(request=solicitud)
+    if tipo == "conexion":
+        return APIConnectionError(request=solicitud)
+    codigo = int(tipo)
+    respuesta = httpx.Response(codigo, request=solicitud, headers={"retry-after": "1"} if codigo == 429 else None)
+    mensaje = f"Error {codigo} simulado por el proveedor local"
+    if codigo == 429:
+        return RateLimitError(mensaje, response=respuesta, body=None)
+    if codigo >= 500:
+        return InternalServerError(mensaje, response=respuesta, body=None)
+    return APIStatusError(mensaje, response=respuesta, body=None)
+
+class ProveedorLocal(ProveedorLLM):
+    """Proveedor sin red para pruebas de carga: devuelve JSON válido según el esquema pedido.
+
+    El contenido es determinista (depende solo del prompt y del esquema) y se
+    toma de LLM_LOCAL_RESPUESTAS si hay una respuesta fija para el modelo de
+    respuesta; si no, se genera a partir del esquema. La latencia sigue una
+    distribución log-normal ajustada a LLM_LOCAL_LATENCIA_P50/P99 y los errores
+    se sortean con las tasas de LLM_LOCAL_ERRORES.
+    """
+
+    nombre = "local"
+
+    def __init__(
+        self,
+        latencia_p50: float = LLM_LOCAL_LATENCIA_P50,
+        latencia_p99: float = LLM_LOCAL_LATENCIA_P99,
+        errores: str = LLM_LOCAL_ERRORES,
+        respuestas: Optional[str] = LLM_LOCAL_RESPUESTAS,
+        semilla: int = LLM_LOCAL_SEMILLA,
+    ):
+        self._mu = math.log(max(latencia_p50, 1e-3))
+        # 2.326 es el cuantil 0.99 de la normal estándar
+        self._sigma = max(0.0, math.log(max(latencia_p99, latencia_p50) / max(latencia_p50, 1e-3)) / 2.326)
+        self._errores = _parsear_errores(errores)
+        self._aleatorio = random.Random(semilla)
+        self._respuestas = {}
+        if respuestas:
+            with open(respuestas, encoding="utf-8") as archivo:
+                self._respuestas = json.load(archivo)
+
+    def _latencia(self) -> float:
+        return self._aleatorio.lognormvariate(self._mu, self._sigma)
+
+    def _sortear_error(self) -> Optional[Exception]:
+        tirada = self._aleatorio.random()
+        acumulado = 0.0
+        for tipo, probabilidad in self._errores:
+            acumulado += probabilidad
+            if tirada < acumulado:
+                return _error_simulado(tipo)
+        return None
+
+    def _contenido(self, solicitud: SolicitudLLM) -> str:
+        semilla = zlib.crc32(json.dumps(solicitud.mensajes, ensure_ascii=False).encode("utf-8"))
+        esquema = solicitud.esquema
+        if esquema is None:
+            return json.dumps({"respuesta": "Respuesta de prueba"}, ensure_ascii=False)
+        if esquema.get("title") in self._respuestas:
+            return json.dumps(self._respuestas[esquema["title"]], ensure_ascii=False)
+        return json.dumps(_valor_de_ejemplo(esquema, esquema.get("$defs", {}), semilla, "Respuesta"), ensure_ascii=False)
+
+    async def _simular(self, solicitud: SolicitudLLM) -> RespuestaLLM:
+        latencia = self._latencia()
+        error = self._sortear_error()
+        if error is not None and isinstance(error, APITimeoutError):
+            # Un timeout tarda lo que el timeout de la llamada antes de fallar
+            await asyncio.sleep(min(latencia * 4, solicitud.timeout or OPENAI_TIMEOUT))
+            raise error
+        await asyncio.sleep(latencia)
+        if error is not None:
+            raise error
+        texto = self._contenido(solicitud)
+        tokens = max(1, len(texto) // 4)  # Aproximación de ~4 caracteres por token
+        if tokens > solicitud.max_tokens:
+            return RespuestaLLM(texto[:solicitud.max_tokens * 4], truncada=True, tokens_salida=solicitud.max_tokens)
+        return RespuestaLLM(texto, tokens_salida=tokens)
+
+    async def completar(self, solicitud: SolicitudLLM) -> RespuestaLLM:
+        return await self._simular(solicitud)
+
+    async def transmitir(self, solicitud: SolicitudLLM) -> AsyncIterator[str]:
+        # El primer fragmento llega tras la latencia simulada y el resto se entrega de golpe en trozos
+        respuesta = await self._simular(solicitud)
+        for inicio in range(0, len(respuesta.texto), 16):
+            yield respuesta.texto[inicio:inicio + 16]
+            await asyncio.sleep(0)
+
+def _valor_de_ejemplo(esquema: dict, definiciones: dict, semilla: int, nombre: str):
+    """Genera un valor que cumple el esquema JSON de Pydantic (objetos, listas, enums y uniones)."""
+    if "$ref" in esquema:
+        return _valor_de_ejemplo(definiciones[esquema["$ref"].split("/")[-1]], definiciones, semilla, nombre)
+    if "enum" in esquema:
+        return esquema["enum"][semilla % len(esquema["enum"])]
+    if "anyOf" in esquema:
+        opciones = [opcion for opcion in esquema["anyOf"] if opcion.get("type") != "null"]
+        return _valor_de_ejemplo(opciones[0], definiciones, semilla, nombre)
+    tipo = esquema.get("type")
+    titulo = esquema.get("title", nombre)
+    if tipo == "object":
+        return {
+            propiedad: _valor_de_ejemplo(subesquema, definiciones, semilla, propiedad)
+            for propiedad, subesquema in esquema.get("properties", {}).items()
+            if propiedad in esquema.get("required", [])
+        }
+    if tipo == "array":
+        cantidad = max(esquema.get("minItems", 1), min(LLM_LOCAL_ELEMENTOS, esquema.get("maxItems", LLM_LOCAL_ELEMENTOS)))
+        return [
+            _valor_de_ejemplo(esquema.get("items", {}), definiciones, semilla + indice, f"{titulo} {indice + 1}")
+            for indice in range(cantidad)
+        ]
+    if tipo in ("number", "integer"):
+        return esquema.get("minimum", 1)
+    if tipo == "boolean":
+        return True
+    texto = f"{titulo} de prueba"
+    return texto[:esquema["maxLength"]] if "maxLength" in esquema else texto
+
+def crear_proveedor(nombre: str = LLM_PROVEEDOR) -> ProveedorLLM:
+    if nombre == "local":
+        logger.warning("Usando el proveedor LLM local: las respuestas son sintéticas.")
+        return ProveedorLocal()
+    if nombre == "openai":
+        return ProveedorOpenAI()
+    raise ValueError(f"Proveedor LLM desconocido: {nombre}")
+
+# Instancia compartida por todas las llamadas del servicio
+proveedor_llm = crear_proveedor()
+
+async def cerrar_proveedor():
+    """Cierra el proveedor de LLM y libera las conexiones del pool."""
+    await proveedor_llm.cerrar()
+    logger.info(f"Proveedor LLM '{proveedor_llm.nombre}' cerrado.")
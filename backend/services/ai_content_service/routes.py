@@ -1,66 +1,174 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from .handlers import (
     manejar_definir_campana,
     manejar_definir_publico_ubicaciones,
     manejar_elegir_formato_cta,
     manejar_crear_contenido_creativo,
-    manejar_create_heading
+    manejar_create_heading,
+    manejar_campaign_bundle,
+    manejar_crear_contenido_creativo_stream,
+    manejar_create_heading_stream,
+    manejar_encolar_trabajo,
+    manejar_consultar_trabajo
 )
 from .schemas import (
     CampanaDetallesInput,
     PublicoObjetivoUbicacionesInput,
     FormatoCTAInput,
     ContenidoCreativoInput,
-    EncabezadoAnuncio
+    EncabezadoAnuncio,
+    CampanaCompletaInput,
+    LoteEncabezadosInput
 )
+from .cache import cache_respuestas
+from .coalescing import coalescedor
+from .validacion import metricas_validacion
+from .presupuesto_tokens import presupuesto_tokens
+from .gobernador import gobernador_openai
+from .hedging import politica_hedging
+from .cascada import enrutador_modelos
+from .trabajos import TRABAJOS_ESPERA_MAXIMA, cola_trabajos
+from .persistencia import persistencia_documentos
+from .pregeneracion import datos_producto, obtener_pregeneracion
+from .lotes import manejar_consultar_lote, manejar_crear_lote
 from ..auth_service.security import get_current_user
 from common.models.usuario import Usuario
-from common.database.database import get_db
+from common.database.database import get_async_db
+from services.product_service.models import Producto
 
 router = APIRouter()
 
+# Cabeceras para que proxies y navegadores no almacenen en búfer el stream SSE
+CABECERAS_SSE = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+DESCRIPCION_ASINCRONO = "Encolar la generación y devolver el id del trabajo para consultarlo en /content/jobs/{id}"
+
+async def encolar_trabajo(tipo: str, data, current_user: Usuario) -> JSONResponse:
+    return JSONResponse(status_code=202, content=await manejar_encolar_trabajo(tipo, data, current_user))
+
 @router.post("/definir_campana", summary="Definir objetivo de campaña y detalles")
 async def definir_campana_endpoint(
     data: CampanaDetallesInput,
-    current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    asincrono: bool = Query(False, description=DESCRIPCION_ASINCRONO),
+    current_user: Usuario = Depends(get_current_user)
 ):
     print(f"Usuario ID: {current_user.id_usuario} | Datos recibidos en /definir_campana: {data.dict()}")
-    return await manejar_definir_campana(data, current_user, db)
+    if asincrono:
+        return await encolar_trabajo("definir_campana", data, current_user)
+    return await manejar_definir_campana(data, current_user)
 
 @router.post("/definir_publico_ubicaciones", summary="Definir público objetivo y ubicaciones")
 async def definir_publico_ubicaciones_endpoint(
     data: PublicoObjetivoUbicacionesInput,
-    current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    asincrono: bool = Query(False, description=DESCRIPCION_ASINCRONO),
+    current_user: Usuario = Depends(get_current_user)
 ):
     print(f"Usuario ID: {current_user.id_usuario} | Datos recibidos en /definir_publico_ubicaciones: {data.dict()}")
-    return await manejar_definir_publico_ubicaciones(data, current_user, db)
+    if asincrono:
+        return await encolar_trabajo("definir_publico_ubicaciones", data, current_user)
+    return await manejar_definir_publico_ubicaciones(data, current_user)
 
 @router.post("/elegir_formato_cta", summary="Elegir formato y CTA")
 async def elegir_formato_cta_endpoint(
     data: FormatoCTAInput,
-    current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    asincrono: bool = Query(False, description=DESCRIPCION_ASINCRONO),
+    current_user: Usuario = Depends(get_current_user)
 ):
     print(f"Usuario ID: {current_user.id_usuario} | Datos recibidos en /elegir_formato_cta: {data.dict()}")
-    return await manejar_elegir_formato_cta(data, current_user, db)
+    if asincrono:
+        return await encolar_trabajo("elegir_formato_cta", data, current_user)
+    return await manejar_elegir_formato_cta(data, current_user)
 
 @router.post("/crear_contenido_creativo", summary="Crear contenido creativo")
 async def crear_contenido_creativo_endpoint(
     data: ContenidoCreativoInput,
-    current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    asincrono: bool = Query(False, description=DESCRIPCION_ASINCRONO),
+    stream: bool = Query(False, description="Emitir tokens y variaciones por Server-Sent Events"),
+    current_user: Usuario = Depends(get_current_user)
 ):
     print(f"Usuario ID: {current_user.id_usuario} | Datos recibidos en /crear_contenido_creativo: {data.dict()}")
-    return await manejar_crear_contenido_creativo(data, current_user, db)
+    if asincrono:
+        return await encolar_trabajo("crear_contenido_creativo", data, current_user)
+    if stream:
+        return StreamingResponse(
+            manejar_crear_contenido_creativo_stream(data, current_user),
+            media_type="text/event-stream",
+            headers=CABECERAS_SSE
+        )
+    return await manejar_crear_contenido_creativo(data, current_user)
 
 @router.post("/create_heading", summary="Generar encabezados de anuncio")
 async def create_heading_endpoint(
     encabezado: EncabezadoAnuncio,
-    current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    asincrono: bool = Query(False, description=DESCRIPCION_ASINCRONO),
+    stream: bool = Query(False, description="Emitir tokens y encabezados por Server-Sent Events"),
+    current_user: Usuario = Depends(get_current_user)
 ):
     print(f"Usuario ID: {current_user.id_usuario} | Datos recibidos en /create_heading: {encabezado.dict()}")
-    return await manejar_create_heading(encabezado, current_user, db)
+    if asincrono:
+        return await encolar_trabajo("create_heading", encabezado, current_user)
+    if stream:
+        return StreamingResponse(
+            manejar_create_heading_stream(encabezado, current_user),
+            media_type="text/event-stream",
+            headers=CABECERAS_SSE
+        )
+    return await manejar_create_heading(encabezado, current_user)
+
+@router.post("/campaign_bundle", summary="Ejecutar todos los pasos del asistente en paralelo")
+async def campaign_bundle_endpoint(
+    data: CampanaCompletaInput,
+    current_user: Usuario = Depends(get_current_user)
+):
+    print(f"Usuario ID: {current_user.id_usuario} | Datos recibidos en /campaign_bundle: {data.dict()}")
+    return await manejar_campaign_bundle(data, current_user)
+
+@router.get("/jobs/{id_trabajo}", summary="Consultar un trabajo de generación")
+async def consultar_trabajo_endpoint(
+    id_trabajo: str,
+    esperar: float = Query(0, ge=0, le=TRABAJOS_ESPERA_MAXIMA, description="Segundos de long-polling hasta que el trabajo termine"),
+    current_user: Usuario = Depends(get_current_user)
+):
+    return await manejar_consultar_trabajo(id_trabajo, esperar, current_user)
+
+@router.post("/lotes/create_heading", status_code=202, summary="Generar encabezados para el catálogo de productos")
+async def crear_lote_encabezados_endpoint(
+    data: LoteEncabezadosInput,
+    current_user: Usuario = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await manejar_crear_lote(data, current_user, db)
+
+@router.get("/lotes/{id_lote}", summary="Progreso de un lote de generación")
+async def consultar_lote_endpoint(id_lote: str, current_user: Usuario = Depends(get_current_user)):
+    return await manejar_consultar_lote(id_lote, current_user)
+
+@router.get("/pregenerado/{id_producto}", summary="Sugerencias pregeneradas para un producto")
+async def pregenerado_endpoint(
+    id_producto: int,
+    current_user: Usuario = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    resultado = await db.execute(select(Producto).where(Producto.id_producto == id_producto, Producto.id_usuario == current_user.id_usuario))
+    producto = resultado.scalars().first()
+    if not producto:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    # Si aún no hay resultados para la versión actual, el asistente sigue el flujo interactivo
+    return await obtener_pregeneracion(datos_producto(producto))
+
+@router.get("/metricas", summary="Métricas de la capa de generación")
+async def metricas_endpoint(current_user: Usuario = Depends(get_current_user)):
+    return {
+        "cache": cache_respuestas.resumen(),
+        "coalescing": coalescedor.resumen(),
+        "validacion": metricas_validacion.resumen(),
+        "presupuesto_tokens": presupuesto_tokens.resumen(),
+        "gobernador": gobernador_openai.resumen(),
+        "hedging": politica_hedging.resumen(),
+        "modelos": enrutador_modelos.resumen(),
+        "trabajos": await cola_trabajos.resumen(),
+        "persistencia": persistencia_documentos.resumen(),
+    }
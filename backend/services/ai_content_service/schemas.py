@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import List
+from typing import List, Literal, Optional, Union
 
 class ObjetivoCampanaInput(BaseModel):
     nombreProducto: str
@@ -42,6 +42,31 @@ class CampanaDetallesInput(BaseModel):
     tipoCampana: str  # Por ejemplo: Pequeña, Mediana, Grande
     duracionPreferida: str  # Por ejemplo: Corta, Mediana, Larga
 
+class CampanaCompletaInput(BaseModel):
+    # Unión de las entradas de todos los pasos del asistente
+    nombreProducto: str
+    descripcionProducto: str
+    tipoCampana: Optional[str] = None  # definir_campana
+    duracionPreferida: Optional[str] = None  # definir_campana
+    distrito: Optional[str] = None  # definir_publico_ubicaciones
+    provincia: Optional[str] = None  # definir_publico_ubicaciones
+    departamento: Optional[str] = None  # definir_publico_ubicaciones
+    publicoObjetivo: Optional[str] = None  # crear_contenido_creativo
+    tonoEstilo: Optional[str] = None  # crear_contenido_creativo
+    palabrasClave: Optional[List[str]] = None  # create_heading
+    estiloEscritura: Optional[str] = None  # create_heading
+    longitudMaxima: Optional[int] = None  # create_heading
+    variantes: Optional[int] = None  # create_heading
+    pasos: Optional[List[str]] = None  # Pasos a ejecutar; por defecto todos
+
+class LoteEncabezadosInput(BaseModel):
+    # Productos del usuario a procesar; si no se indican, todo su catálogo
+    ids_productos: Optional[List[int]] = None
+    palabrasClave: Optional[List[str]] = None  # Por defecto, las características de cada producto
+    estiloEscritura: str = "Persuasivo"
+    longitudMaxima: int = 40
+    variantes: int = 3
+
 class DocumentoCreate(BaseModel):
     tipo_documento: str = Field(..., example="Artículo")
     contenido: str = Field(..., example="Contenido del documento...")
@@ -52,6 +77,101 @@ class DocumentoResponse(BaseModel):
     contenido: str
     fecha_creacion: datetime
     id_usuario: int
+    veces_generado: int = 1  # Veces que se generó este mismo contenido
+    fecha_ultima_generacion: Optional[datetime] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# Modelos de respuesta del asistente: se envían al modelo como formato de salida y se validan al recibirla
+
+class ObjetivoCampana(BaseModel):
+    objetivo: str
+    explicacion: str
+
+class PresupuestoTotal(BaseModel):
+    cantidad: Union[str, float]
+    explicacion: str
+
+class DuracionOptima(BaseModel):
+    duracion: str
+    explicacion: str
+
+class DetallesCampana(BaseModel):
+    objetivo_campana: ObjetivoCampana
+    presupuesto_total: PresupuestoTotal
+    duracion_optima: DuracionOptima
+
+class DetallesCampanaRespuesta(BaseModel):
+    detalles_campana: DetallesCampana
+
+class UbicacionGeografica(BaseModel):
+    distrito: str
+    provincia: str
+    departamento: str
+
+class PublicoDemografico(BaseModel):
+    edad: str
+    genero: str
+    ubicaciones: List[UbicacionGeografica] = Field(..., min_length=1)
+    otros: Optional[str] = None
+
+class PublicoPsicografico(BaseModel):
+    intereses: Union[str, List[str]]
+    comportamientos: Union[str, List[str]]
+
+class PublicoObjetivo(BaseModel):
+    demografico: PublicoDemografico
+    psicografico: PublicoPsicografico
+
+class UbicacionesAnuncios(BaseModel):
+    ubicaciones_seleccionadas: List[str] = Field(..., min_length=1)
+    justificacion: str
+
+class PublicoUbicacionesRespuesta(BaseModel):
+    publico_objetivo: PublicoObjetivo
+    ubicaciones_anuncios: UbicacionesAnuncios
+
+# Opciones cerradas entre las que elige el paso elegir_formato_cta
+FORMATOS_ANUNCIO = (
+    "Anuncios en carrusel",
+    "Anuncios en secuencia",
+    "Colecciones",
+    "Experiencias dinámicas",
+    "Anuncios de Messenger",
+    "Anuncios de Canvas",
+)
+LLAMADAS_A_LA_ACCION = (
+    "Enviar solicitud",
+    "Reservar",
+    "Comprar",
+    "Realizar pedido",
+    "Cotizar",
+    "Obtener oferta",
+    "Más información",
+    "Contactarnos",
+    "Descargar",
+    "Registrarte",
+)
+
+class FormatoAnuncio(BaseModel):
+    formato: Literal[FORMATOS_ANUNCIO]
+    explicacion: str
+
+class LlamadaALaAccion(BaseModel):
+    llamada_a_la_accion: Literal[LLAMADAS_A_LA_ACCION]
+    explicacion: str
+
+class FormatoCTARespuesta(BaseModel):
+    formato_anuncio: FormatoAnuncio
+    cta: LlamadaALaAccion
+
+class VariacionCreativa(BaseModel):
+    titulo: str
+    contenido: str
+
+class ContenidoCreativoRespuesta(BaseModel):
+    variaciones: List[VariacionCreativa] = Field(..., min_length=1)
+
+class EncabezadosRespuesta(BaseModel):
+    encabezados: List[str] = Field(..., min_length=1)
@@ -0,0 +1,91 @@
+import json
+import logging
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+def evento_sse(evento: str, datos) -> str:
+    """Serializa un evento en formato Server-Sent Events."""
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+class ExtractorElementosArray:
+    """Detecta, a medida que llegan los fragmentos, cada elemento completo del primer array del JSON.
+
+    Pensado para respuestas del tipo {"encabezados": ["...", "..."]} o
+    {"variaciones": [{...}, {...}]}: cada elemento se entrega en cuanto se
+    cierra, sin esperar al resto de la respuesta.
+    """
+
+    def __init__(self):
+        self._profundidad = 0
+        self._profundidad_array = None  # Profundidad del primer array encontrado
+        self._en_string = False
+        self._escape = False
+        self._buffer = []               # Caracteres del elemento en curso
+        self._inicio_elemento = None    # Primer carácter del elemento en curso
+        self._terminado = False
+
+    def alimentar(self, fragmento: str) -> List:
+        """Procesa un fragmento y devuelve los elementos que quedaron completos."""
+        completos = []
+        for caracter in fragmento:
+            if self._terminado:
+                break
+            elemento = self._procesar(caracter)
+            if elemento is not None:
+                try:
+                    completos.append(json.loads(elemento))
+                except json.JSONDecodeError:
+                    logger.warning(f"Elemento del stream descartado por JSON inválido: {elemento}")
+        return completos
+
+    def _procesar(self, caracter: str):
+        dentro_de_elemento = self._inicio_elemento is not None
+        if dentro_de_elemento:
+            self._buffer.append(caracter)
+
+        if self._en_string:
+            if self._escape:
+                self._escape = False
+            elif caracter == "\\":
+                self._escape = True
+            elif caracter == '"':
+                self._en_string = False
+                if self._inicio_elemento == '"' and self._profundidad == self._profundidad_array:
+                    return self._cerrar_elemento()
+            return None
+
+        if self._profundidad_array is not None and self._profundidad == self._profundidad_array:
+            # Estamos entre elementos del array (o dentro de un elemento primitivo)
+            if not dentro_de_elemento:
+                if caracter.isspace() or caracter == ",":
+                    return None
+                if caracter == "]":
+                    self._terminado = True
+                    return None
+                self._inicio_elemento = caracter
+                self._buffer.append(caracter)
+            elif self._inicio_elemento not in '"{[' and caracter in ",]":
+                self._buffer.pop()
+                elemento = self._cerrar_elemento()
+                if caracter == "]":
+                    self._terminado = True
+                return elemento
+
+        if caracter == '"':
+            self._en_string = True
+        elif caracter in "{[":
+            self._profundidad += 1
+            if caracter == "[" and self._profundidad_array is None:
+                self._profundidad_array = self._profundidad
+        elif caracter in "}]":
+            self._profundidad -= 1
+            if self._inicio_elemento in ("{", "[") and self._profundidad == self._profundidad_array:
+                return self._cerrar_elemento()
+        return None
+
+    def _cerrar_elemento(self) -> str:
+        elemento = "".join(self._buffer).strip()
+        self._buffer = []
+        self._inicio_elemento = None
+        return elemento
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from typing import Optional
+from fastapi import HTTPException
+from common.utils.session_manager import SessionManager
+
+logger = logging.getLogger(__name__)
+
+# Configuración de la cola de trabajos de generación
+TRABAJOS_TTL = int(os.getenv("TRABAJOS_TTL", "86400"))                    # Segundos que se conserva un trabajo
+TRABAJOS_VISIBILIDAD = int(os.getenv("TRABAJOS_VISIBILIDAD", "300"))      # Tras este tiempo sin avance, un trabajo en proceso se reencola
+TRABAJOS_MAX_INTENTOS = int(os.getenv("TRABAJOS_MAX_INTENTOS", "3"))      # Ejecuciones que se abandonan antes de dar el trabajo por fallido
+TRABAJOS_ESPERA_MAXIMA = float(os.getenv("TRABAJOS_ESPERA_MAXIMA", "30"))  # Máximo long-polling por consulta
+INTERVALO_SONDEO = float(os.getenv("TRABAJOS_INTERVALO_SONDEO", "0.25"))
+COLA_PENDIENTES = "trabajos:pendientes"
+COLA_BAJA_PRIORIDAD = "trabajos:pendientes_baja"  # Trabajos especulativos: solo se atienden sin pendientes normales
+COLA_EN_PROCESO = "trabajos:en_proceso"
+TRABAJO_PREFIJO = "trabajo:"
+
+ESTADOS_FINALES = ("completado", "fallido")
+
+# Mueve el siguiente pendiente (primero la cola normal, luego la de baja prioridad) a la lista
+# en proceso y lo marca (y cuenta el intento) en la misma operación: recuperar_huerfanos nunca
+# ve un trabajo recién tomado con el `actualizado` de cuando se encoló. La clave del trabajo se conoce solo tras
+# el LMOVE, así que no va en KEYS: requiere Redis standalone (no Redis Cluster).
+_SCRIPT_TOMAR = """
+for i = 1, 2 do
+    local id = redis.call('LMOVE', KEYS[i], KEYS[3], 'RIGHT', 'LEFT')
+    if id then
+        local clave = ARGV[1] .. id
+        if redis.call('EXISTS', clave) == 0 then
+            redis.call('LREM', KEYS[3], 1, id)
+            return false
+        end
+        redis.call('HSET', clave, 'estado', 'en_proceso', 'actualizado', ARGV[2])
+        redis.call('HINCRBY', clave, 'intentos', 1)
+        return id
+    end
+end
+return false
+"""
+
+# Marca en proceso (y cuenta el intento de) un trabajo que BLMOVE ya movió; si expiró, lo retira de la lista
+_SCRIPT_MARCAR_EN_PROCESO = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('LREM', KEYS[2], 1, ARGV[1])
+    return 0
+end
+redis.call('HSET', KEYS[1], 'estado', 'en_proceso', 'actualizado', ARGV[2])
+redis.call('HINCRBY', KEYS[1], 'intentos', 1)
+return 1
+"""
+
+def _redis():
+    redis = SessionManager.redis_client
+    if redis is None:
+        raise HTTPException(status_code=503, detail="La cola de trabajos no está disponible (Redis no inicializado).")
+    return redis
+
+class ColaTrabajos:
+    """Cola de trabajos de generación en Redis.
+
+    Cada trabajo es un hash `trabajo:<id>` con su estado, entrada y resultado.
+    Los workers lo mueven de forma atómica de la lista de pendientes a la de
+    en proceso y lo retiran al terminar; si un worker muere, el trabajo se
+    reencola cuando lleva más de TRABAJOS_VISIBILIDAD segundos sin avanzar.
+    Cada toma cuenta un intento: un trabajo que ya agotó TRABAJOS_MAX_INTENTOS
+    (p. ej. uno que tumba al worker cada vez) se da por fallido en lugar de
+    reencolarse sin fin.
+    """
+
+    async def encolar(
+        self, tipo: str, datos: dict, prioridad, baja_prioridad: bool = False, id_trabajo: Optional[str] = None
+    ) -> str:
+        """Crea el trabajo y lo encola; `id_trabajo` permite preparar antes el estado asociado a ese id."""
+        redis = _redis()
+        cola = COLA_BAJA_PRIORIDAD if baja_prioridad else COLA_PENDIENTES
+        id_trabajo = id_trabajo or uuid.uuid4().hex
+        ahora = time.time()
+        clave = TRABAJO_PREFIJO + id_trabajo
+        try:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.hset(clave, mapping={
+                    "id": id_trabajo,
+                    "tipo": tipo,
+                    "estado": "pendiente",
+                    "id_usuario": prioridad.id_usuario,
+                    "tipo_cuenta": prioridad.tipo_cuenta,
+                    "peso": prioridad.peso,
+                    "datos": json.dumps(datos, ensure_ascii=False),
+                    "cola": cola,
+                    "creado": ahora,
+                    "actualizado": ahora,
+                })
+                pipe.expire(clave, TRABAJOS_TTL)
+                pipe.lpush(cola, id_trabajo)
+                await pipe.execute()
+        except Exception as e:
+            logger.exception("Error encolando el trabajo de generación")
+            raise HTTPException(status_code=503, detail=f"No se pudo encolar el trabajo: {str(e)}")
+        return id_trabajo
+
+    async def obtener(self, id_trabajo: str) -> Optional[dict]:
+        trabajo = await _redis().hgetall(TRABAJO_PREFIJO + id_trabajo)
+        return trabajo or None
+
+    async def esperar(self, id_trabajo: str, espera: float) -> Optional[dict]:
+        """Long-polling: devuelve el trabajo en cuanto termina o al agotar la espera."""
+        limite = time.monotonic() + min(espera, TRABAJOS_ESPERA_MAXIMA)
+        while True:
+            trabajo = await self.obtener(id_trabajo)
+            if trabajo is None or trabajo["estado"] in ESTADOS_FINALES or time.monotonic() >= limite:
+                return trabajo
+            await asyncio.sleep(INTERVALO_SONDEO)
+
+    async def tomar(self, timeout: int = 2) -> Optional[dict]:
+        """Toma el siguiente trabajo pendiente y lo marca en proceso; None si no llega ninguno."""
+        redis = _redis()
+        id_trabajo = await redis.eval(
+            _SCRIPT_TOMAR, 3, COLA_PENDIENTES, COLA_BAJA_PRIORIDAD, COLA_EN_PROCESO, TRABAJO_PREFIJO, time.time()
+        )
+        if id_trabajo is None:
+            # Sin nada pendiente se bloquea solo en la cola normal; los de baja prioridad esperan al siguiente ciclo.
+            # BLMOVE no puede ir dentro de un script: lo que devuelve se encoló durante la espera, así que
+            # su `actualizado` es reciente y la marca posterior no deja hueco para recuperar_huerfanos
+            id_trabajo = await redis.blmove(COLA_PENDIENTES, COLA_EN_PROCESO, timeout, "RIGHT", "LEFT")
+            if id_trabajo is None:
+                return None
+            clave = TRABAJO_PREFIJO + id_trabajo
+            if not await redis.eval(_SCRIPT_MARCAR_EN_PROCESO, 2, clave, COLA_EN_PROCESO, id_trabajo, time.time()):
+                # El trabajo expiró antes de procesarse
+                return None
+        return await redis.hgetall(TRABAJO_PREFIJO + id_trabajo)
+
+    async def latido(self, id_trabajo: str):
+        """Señala que un trabajo largo sigue avanzando, para que no se reencole como huérfano."""
+        clave = TRABAJO_PREFIJO + id_trabajo
+        # Un latido tardío no debe recrear (sin TTL) el hash de un trabajo que ya expiró
+        if await _redis().exists(clave):
+            await _redis().hset(clave, "actualizado", time.time())
+
+    async def finalizar(self, id_trabajo: str, resultado: Optional[dict] = None, error: Optional[str] = None):
+        redis = _redis()
+        campos = {"estado": "fallido" if error is not None else "completado", "actualizado": time.time()}
+        if error is not None:
+            campos["error"] = error
+        else:
+            campos["resultado"] = json.dumps(resultado, ensure_ascii=False)
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hset(TRABAJO_PREFIJO + id_trabajo, mapping=campos)
+            pipe.lrem(COLA_EN_PROCESO, 1, id_trabajo)
+            await pipe.execute()
+
+    async def recuperar_huerfanos(self) -> int:
+        """Reencola los trabajos en proceso que dejaron de avanzar (worker caído)."""
+        redis = _redis()
+        recuperados = 0
+        limite = time.time() - TRABAJOS_VISIBILIDAD
+        for id_trabajo in await redis.lrange(COLA_EN_PROCESO, 0, -1):
+            actualizado, cola, intentos = await redis.hmget(
+                TRABAJO_PREFIJO + id_trabajo, ["actualizado", "cola", "intentos"]
+            )
+            if actualizado is not None and float(actualizado) >= limite:
+                continue
+            # Solo lo reencola quien consigue retirarlo de la lista de en proceso
+            if await redis.lrem(COLA_EN_PROCESO, 1, id_trabajo):
+                if actualizado is not None and int(intentos or 0) >= TRABAJOS_MAX_INTENTOS:
+                    logger.error(f"El trabajo {id_trabajo} se abandonó {intentos} veces: se da por fallido")
+                    await self.finalizar(id_trabajo, error=f"El trabajo no terminó tras {intentos} intentos")
+                elif actualizado is not None:
+                    # Con `actualizado` renovado, como un trabajo recién encolado
+                    await redis.hset(TRABAJO_PREFIJO + id_trabajo, mapping={"estado": "pendiente", "actualizado": time.time()})
+                    await redis.rpush(cola or COLA_PENDIENTES, id_trabajo)
+                    recuperados += 1
+        if recuperados:
+            logger.warning(f"{recuperados} trabajo(s) huérfano(s) reencolado(s)")
+        return recuperados
+
+    async def resumen(self) -> dict:
+        redis = SessionManager.redis_client
+        if redis is None:
+            return {"disponible": False}
+        try:
+            return {
+                "disponible": True,
+                "pendientes": await redis.llen(COLA_PENDIENTES),
+                "pendientes_baja_prioridad": await redis.llen(COLA_BAJA_PRIORIDAD),
+                "en_proceso": await redis.llen(COLA_EN_PROCESO),
+            }
+        except Exception as e:
+            logger.warning(f"No se pudo leer el estado de la cola de trabajos: {e}")
+            return {"disponible": False}
+
+# Instancia compartida por las rutas y los workers
+cola_trabajos = ColaTrabajos()
+
+def presentar_trabajo(trabajo: dict) -> dict:
+    """Vista pública de un trabajo para /content/jobs/{id}."""
+    vista = {
+        "id_trabajo": trabajo["id"],
+        "tipo": trabajo["tipo"],
+        "estado": trabajo["estado"],
+    }
+    if trabajo.get("resultado"):
+        vista["resultado"] = json.loads(trabajo["resultado"])
+    if trabajo.get("error"):
+        vista["error"] = trabajo["error"]
+    return vista
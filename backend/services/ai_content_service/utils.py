@@ -1,30 +1,302 @@
-import re
+import os
 import json
+import time
 import logging
 from fastapi import HTTPException
-from .config import client
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+from common.utils.circuit_breaker import CircuitoAbiertoError, crear_circuit_breaker
+from typing import AsyncIterator, List, Optional, Tuple, Type
+from pydantic import BaseModel
+from .proveedores import SolicitudLLM, proveedor_llm
+from .cache import cache_respuestas
+from .coalescing import coalescedor
+from .gobernador import es_sobrecarga, gobernador_openai
+from .hedging import politica_hedging
+from .cascada import MODELO_BASICO, enrutador_modelos
+from .presupuesto_tokens import presupuesto_tokens
+from .json_extractor import ErrorExtraccionJSON, extraer_primer_objeto, reparar_json_truncado
+from .validacion import (
+    ErrorValidacionRespuesta,
+    Restricciones,
+    formato_respuesta,
+    metricas_validacion,
+    prompt_reparacion,
+    validar_respuesta
+)
 
 logger = logging.getLogger(__name__)
 
-async def generar_respuesta_openai(prompt: str, max_tokens: int = 300) -> str:
+def es_fallo_servicio(error: Exception) -> bool:
+    """Errores que indican que OpenAI está caído o degradado (no los 4xx de la propia solicitud)."""
+    if isinstance(error, (APITimeoutError, APIConnectionError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+# Circuito de OpenAI: si falla o se vuelve muy lenta, las llamadas se rechazan al instante
+circuito_openai = crear_circuit_breaker(
+    "openai",
+    latencia_lenta=float(os.getenv("CB_OPENAI_LATENCIA_LENTA", "20")),
+    es_fallo=es_fallo_servicio,
+)
+
+class RespuestaGenerada(str):
+    """Texto devuelto por el modelo junto con si tuvo que repararse por un corte de max_tokens
+    y los tokens de salida que consumió."""
+
+    def __new__(cls, texto: str, truncado: bool = False, tokens_salida: Optional[int] = None):
+        instancia = super().__new__(cls, texto)
+        instancia.truncado = truncado
+        instancia.tokens_salida = tokens_salida
+        return instancia
+
+def error_openai(error: Exception, origen: str) -> HTTPException:
+    """Traduce un error de la llamada a OpenAI a la respuesta HTTP adecuada."""
+    if isinstance(error, HTTPException):
+        return error  # Rechazo del gobernador (503 con Retry-After)
+    if isinstance(error, CircuitoAbiertoError):
+        return error.como_http()
+    if isinstance(error, APITimeoutError):
+        logger.warning(f"Timeout de OpenAI en {origen}")
+        return HTTPException(status_code=504, detail="OpenAI no respondió a tiempo.")
+    if es_sobrecarga(error):
+        logger.warning(f"OpenAI saturado en {origen}: {error}")
+        return HTTPException(
+            status_code=503,
+            detail="OpenAI está saturado en este momento. Intenta de nuevo en unos segundos.",
+            headers={"Retry-After": str(gobernador_openai.retry_after_sugerido())},
+        )
+    logger.exception(f"Error en {origen}")
+    return HTTPException(status_code=500, detail=f"Error en la llamada a OpenAI: {str(error)}")
+
+def respuesta_truncada(resultado: str) -> bool:
+    """Indica si la respuesta se recortó por max_tokens y se conservó solo su parte utilizable."""
+    return getattr(resultado, "truncado", False)
+
+async def _llamar_openai(
+    mensajes: List[dict],
+    max_tokens: int,
+    timeout: Optional[float],
+    response_format: Optional[dict] = None,
+    modelo: str = MODELO_BASICO,
+    esquema: Optional[dict] = None,
+    endpoint: str = "general",
+) -> RespuestaGenerada:
+    solicitud = SolicitudLLM(modelo, mensajes, max_tokens, timeout, response_format, esquema)
+    clave_latencias = (endpoint, modelo)
+
+    async def intento():
+        # El gobernador acota las llamadas en vuelo; el event loop sigue libre mientras se espera al proveedor
+        async with gobernador_openai.turno(), circuito_openai.proteger_async():
+            inicio = time.monotonic()
+            respuesta = await proveedor_llm.completar(solicitud)
+            politica_hedging.registrar_latencia(clave_latencias, time.monotonic() - inicio)
+            return respuesta
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",  # Puedes cambiar al modelo que prefieras
-            messages=[
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=max_tokens,
-            temperature=0.7,
+        # Con el circuito abierto se falla al instante, sin esperar turno en el gobernador
+        circuito_openai.verificar()
+        # Si el intento se retrasa más de lo habitual se lanza otro idéntico y gana el primero en responder
+        respuesta = await politica_hedging.ejecutar(intento, clave_latencias, permitir=gobernador_openai.tiene_holgura)
+    except Exception as e:
+        raise error_openai(e, "generar_respuesta_openai")
+
+    resultado = respuesta.texto
+    if respuesta.truncada:
+        # Cortada por max_tokens: se conserva la parte utilizable en lugar de regenerar
+        resultado, truncado = reparar_json_truncado(resultado)
+        if truncado:
+            logger.warning("Respuesta de OpenAI truncada por max_tokens; se descartó el elemento incompleto.")
+        return RespuestaGenerada(resultado, truncado, respuesta.tokens_salida)
+    return RespuestaGenerada(resultado, tokens_salida=respuesta.tokens_salida)
+
+async def reparar_respuesta(
+    prompt: str,
+    resultado: str,
+    error: ErrorValidacionRespuesta,
+    modelo_respuesta: Type[BaseModel],
+    max_tokens: int = 300,
+    timeout: Optional[float] = None,
+    modelo: str = MODELO_BASICO,
+    endpoint: str = "general",
+) -> str:
+    """Único intento de reparación: devuelve al modelo su respuesta con los errores de validación."""
+    mensajes = [
+        {"role": "user", "content": prompt},
+        {"role": "assistant", "content": resultado},
+        {"role": "user", "content": prompt_reparacion(error, modelo_respuesta)},
+    ]
+    return await _llamar_openai(
+        mensajes, max_tokens, timeout, formato_respuesta(modelo_respuesta), modelo, modelo_respuesta.model_json_schema(),
+        endpoint=endpoint,
+    )
+
+async def validar_o_reparar(
+    prompt: str,
+    resultado: str,
+    modelo_respuesta: Type[BaseModel],
+    endpoint: str,
+    max_tokens: int = 300,
+    timeout: Optional[float] = None,
+    restricciones: Optional[Restricciones] = None,
+) -> Tuple[dict, bool]:
+    """Valida la respuesta; solo si la validación falla se hace un intento de reparación.
+
+    La reparación la hace el modelo más capaz de la cascada del endpoint.
+    Devuelve el contenido validado y si la respuesta usada venía truncada.
+    """
+    try:
+        datos = validar_respuesta(resultado, modelo_respuesta, restricciones)
+        metricas_validacion.registrar(endpoint, "validas")
+        return datos, respuesta_truncada(resultado)
+    except ErrorValidacionRespuesta as error:
+        logger.warning(f"Respuesta inválida en {endpoint}, intentando reparación: {error}")
+        error_validacion = error
+
+    resultado = await reparar_respuesta(
+        prompt, resultado, error_validacion, modelo_respuesta, max_tokens, timeout,
+        enrutador_modelos.modelo_mas_capaz(endpoint), endpoint,
+    )
+    try:
+        datos = validar_respuesta(resultado, modelo_respuesta, restricciones)
+    except ErrorValidacionRespuesta as error_reparacion:
+        metricas_validacion.registrar(endpoint, "fallidas")
+        raise HTTPException(
+            status_code=500,
+            detail=f"La respuesta del modelo no cumple el esquema esperado: {error_reparacion}\nRespuesta del modelo:\n{resultado}"
         )
-        # Acceder al contenido de la respuesta
-        resultado = ''.join([
-            choice.message.content for choice in response.choices
-            if choice.message and choice.message.content
-        ]).strip()
+    metricas_validacion.registrar(endpoint, "reparadas")
+    return datos, respuesta_truncada(resultado)
+
+async def _generar_validado(
+    prompt: str,
+    max_tokens: int,
+    timeout: Optional[float],
+    modelo_respuesta: Type[BaseModel],
+    endpoint: str,
+    restricciones: Optional[Restricciones] = None,
+) -> RespuestaGenerada:
+    """Genera con salida estructurada recorriendo la cascada de modelos del endpoint.
+
+    Cada modelo se prueba en orden, del más barato al más capaz, y solo se
+    escala al siguiente si su respuesta no supera la validación. El último
+    modelo de la cascada tiene además un intento de reparación.
+    """
+    mensajes = [{"role": "user", "content": prompt}]
+    formato = formato_respuesta(modelo_respuesta)
+    esquema = modelo_respuesta.model_json_schema()
+    cascada = enrutador_modelos.cascada(endpoint)
+    for indice, modelo in enumerate(cascada):
+        inicio = time.monotonic()
+        resultado = await _llamar_openai(mensajes, max_tokens, timeout, formato, modelo, esquema, endpoint=endpoint)
+        if indice < len(cascada) - 1:
+            try:
+                datos = validar_respuesta(resultado, modelo_respuesta, restricciones)
+            except ErrorValidacionRespuesta as error:
+                enrutador_modelos.registrar_intento(
+                    endpoint, modelo, False, time.monotonic() - inicio, resultado.tokens_salida
+                )
+                logger.info(f"{endpoint}: {modelo} no superó la validación ({error}); se escala a {cascada[indice + 1]}")
+                continue
+            metricas_validacion.registrar(endpoint, "validas")
+            truncado = respuesta_truncada(resultado)
+        else:
+            try:
+                datos, truncado = await validar_o_reparar(
+                    prompt, resultado, modelo_respuesta, endpoint, max_tokens, timeout, restricciones
+                )
+            except HTTPException:
+                enrutador_modelos.registrar_intento(
+                    endpoint, modelo, False, time.monotonic() - inicio, resultado.tokens_salida
+                )
+                enrutador_modelos.registrar_respuesta(endpoint, escalada=indice > 0)
+                raise
+        enrutador_modelos.registrar_intento(endpoint, modelo, True, time.monotonic() - inicio, resultado.tokens_salida)
+        enrutador_modelos.registrar_respuesta(endpoint, escalada=indice > 0)
+        return RespuestaGenerada(json.dumps(datos, ensure_ascii=False), truncado, resultado.tokens_salida)
+
+async def generar_respuesta_openai(
+    prompt: str,
+    max_tokens: int = 300,
+    timeout: Optional[float] = None,
+    clave_solicitud: Optional[str] = None,
+    modelo_respuesta: Optional[Type[BaseModel]] = None,
+    estimacion_tokens: Optional[int] = None,
+    restricciones: Optional[Restricciones] = None,
+) -> str:
+    """Genera una respuesta con el proveedor de LLM configurado (OpenAI o el local).
+
+    Si se indica la clave de la solicitud, se consulta antes la caché y las
+    solicitudes idénticas concurrentes comparten una sola llamada a OpenAI.
+    Con un modelo de respuesta, la salida se pide en formato estructurado a la
+    cascada de modelos del endpoint y se devuelve ya validada como JSON. Con una estimación de tokens de salida,
+    max_tokens se calcula con el presupuesto adaptativo del endpoint.
+    """
+    endpoint = clave_solicitud.split(":", 1)[0] if clave_solicitud else "general"
+    if estimacion_tokens is not None:
+        max_tokens = presupuesto_tokens.presupuesto(endpoint, estimacion_tokens)
+
+    async def llamar() -> str:
+        if modelo_respuesta is not None:
+            resultado = await _generar_validado(prompt, max_tokens, timeout, modelo_respuesta, endpoint, restricciones)
+        else:
+            resultado = await _llamar_openai(
+                [{"role": "user", "content": prompt}], max_tokens, timeout, modelo=enrutador_modelos.cascada(endpoint)[0],
+                endpoint=endpoint,
+            )
+        if respuesta_truncada(resultado):
+            metricas_validacion.registrar_truncado(endpoint)
+        if estimacion_tokens is not None:
+            presupuesto_tokens.registrar(
+                endpoint, estimacion_tokens, resultado.tokens_salida, respuesta_truncada(resultado)
+            )
         return resultado
+
+    if not clave_solicitud:
+        return await llamar()
+
+    usar_cache = cache_respuestas.habilitada_para(clave_solicitud)
+    if usar_cache:
+        en_cache = await cache_respuestas.obtener(clave_solicitud)
+        if en_cache is not None:
+            return en_cache
+
+    async def generar() -> str:
+        resultado = await llamar()
+        # Las respuestas truncadas no se cachean: una nueva generación puede salir completa
+        if usar_cache and not respuesta_truncada(resultado):
+            # Solo se cachean respuestas parseables para no servir errores repetidamente
+            try:
+                extraer_json_de_respuesta(resultado)
+                await cache_respuestas.guardar(clave_solicitud, resultado)
+            except HTTPException:
+                logger.warning(f"Respuesta no cacheada por no contener JSON válido: {clave_solicitud}")
+        return resultado
+
+    return await coalescedor.ejecutar(clave_solicitud, generar)
+
+async def generar_respuesta_openai_stream(
+    prompt: str,
+    max_tokens: int = 300,
+    timeout: Optional[float] = None,
+    modelo_respuesta: Optional[Type[BaseModel]] = None,
+    modelo: str = MODELO_BASICO,
+) -> AsyncIterator[str]:
+    """Genera una respuesta con el proveedor de LLM entregando los fragmentos de texto a medida que llegan."""
+    solicitud = SolicitudLLM(
+        modelo,
+        [{"role": "user", "content": prompt}],
+        max_tokens,
+        timeout,
+        formato_respuesta(modelo_respuesta) if modelo_respuesta else None,
+        modelo_respuesta.model_json_schema() if modelo_respuesta else None,
+    )
+    try:
+        circuito_openai.verificar()
+        async with gobernador_openai.turno(), circuito_openai.proteger_async():
+            async for fragmento in proveedor_llm.transmitir(solicitud):
+                yield fragmento
     except Exception as e:
-        logger.exception("Error en generar_respuesta_openai")
-        raise HTTPException(status_code=500, detail=f"Error en la llamada a OpenAI: {str(e)}")
+        raise error_openai(e, "generar_respuesta_openai_stream")
 
 def extraer_json_de_respuesta(respuesta: str) -> dict:
     if not isinstance(respuesta, str):
@@ -35,20 +307,11 @@ def extraer_json_de_respuesta(respuesta: str) -> dict:
         data = json.loads(respuesta)
         return data
     except json.JSONDecodeError:
-        # Si falla, buscar el primer objeto JSON en la respuesta
-        match = re.search(r'\{(?:[^{}]|(?R))*\}', respuesta, re.DOTALL)
-        if match:
-            json_str = match.group()
-            try:
-                data = json.loads(json_str)
-                return data
-            except json.JSONDecodeError as e:
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Error al parsear JSON: {e.msg}\nRespuesta del modelo:\n{respuesta}"
-                )
-        else:
+        # Si falla, buscar el primer objeto JSON en la respuesta con un escáner lineal
+        try:
+            return extraer_primer_objeto(respuesta)
+        except ErrorExtraccionJSON as e:
             raise HTTPException(
                 status_code=500,
-                detail=f"No se pudo encontrar un JSON válido en la respuesta.\nRespuesta del modelo:\n{respuesta}"
+                detail=f"No se pudo extraer un JSON válido: {e}\nRespuesta del modelo:\n{respuesta}"
             )
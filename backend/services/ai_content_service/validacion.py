@@ -0,0 +1,90 @@
+import os
+import json
+from collections import defaultdict
+from typing import Callable, Optional, Type
+from pydantic import BaseModel, ValidationError
+from .json_extractor import ErrorExtraccionJSON, extraer_primer_objeto
+
+# Modo de salida estructurada: "json_object" (compatible con gpt-3.5-turbo), "json_schema"
+# (requiere modelos con structured outputs, p. ej. gpt-4o-mini) o "ninguno" para medir la línea base
+FORMATO_RESPUESTA = os.getenv("LLM_FORMATO_RESPUESTA", "json_object")
+
+class ErrorValidacionRespuesta(ValueError):
+    """La respuesta del modelo no es JSON o no cumple el modelo de respuesta esperado."""
+
+def formato_respuesta(modelo: Type[BaseModel]) -> Optional[dict]:
+    """Construye el parámetro response_format para la API de OpenAI."""
+    if FORMATO_RESPUESTA == "json_schema":
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": modelo.__name__, "schema": modelo.model_json_schema()},
+        }
+    if FORMATO_RESPUESTA == "json_object":
+        return {"type": "json_object"}
+    return None
+
+# Comprobaciones adicionales que dependen de la solicitud (p. ej. longitud máxima); reciben el contenido
+# y si la respuesta venía truncada por max_tokens, y devuelven el error o None
+Restricciones = Callable[[dict, bool], Optional[str]]
+
+def validar_respuesta(respuesta: str, modelo: Type[BaseModel], restricciones: Optional[Restricciones] = None) -> dict:
+    """Extrae el JSON de la respuesta y lo valida contra el modelo y las restricciones; devuelve el contenido normalizado."""
+    try:
+        datos = json.loads(respuesta)
+    except json.JSONDecodeError:
+        try:
+            datos = extraer_primer_objeto(respuesta)
+        except ErrorExtraccionJSON as e:
+            raise ErrorValidacionRespuesta(str(e))
+    try:
+        datos = modelo.model_validate(datos).model_dump()
+    except ValidationError as e:
+        errores = "; ".join(
+            f"{'.'.join(str(parte) for parte in error['loc'])}: {error['msg']}" for error in e.errors()
+        )
+        raise ErrorValidacionRespuesta(errores)
+    if restricciones is not None:
+        error = restricciones(datos, getattr(respuesta, "truncado", False))
+        if error:
+            raise ErrorValidacionRespuesta(error)
+    return datos
+
+def prompt_reparacion(error: ErrorValidacionRespuesta, modelo: Type[BaseModel]) -> str:
+    """Instrucción para el único intento de reparación tras una validación fallida."""
+    return f"""
+    Tu respuesta anterior no cumple el esquema requerido. Errores encontrados: {error}
+
+    Corrige únicamente esos problemas y devuelve **solo** el JSON válido que cumple este esquema JSON:
+    {json.dumps(modelo.model_json_schema(), ensure_ascii=False)}
+    """
+
+class MetricasValidacion:
+    """Contadores por endpoint de validaciones, reparaciones y fallos."""
+
+    def __init__(self):
+        self._contadores = defaultdict(
+            lambda: {"total": 0, "validas": 0, "reparadas": 0, "fallidas": 0, "truncadas": 0}
+        )
+
+    def registrar(self, endpoint: str, resultado: str):
+        contadores = self._contadores[endpoint]
+        contadores["total"] += 1
+        contadores[resultado] += 1
+
+    def registrar_truncado(self, endpoint: str):
+        """Cuenta una respuesta cortada por max_tokens de la que se conservó la parte utilizable."""
+        self._contadores[endpoint]["truncadas"] += 1
+
+    def resumen(self) -> dict:
+        resumen = {"formato_respuesta": FORMATO_RESPUESTA, "endpoints": {}}
+        for endpoint, contadores in self._contadores.items():
+            total = contadores["total"] or 1
+            resumen["endpoints"][endpoint] = {
+                **contadores,
+                # Proporción de generaciones que necesitaron una segunda llamada
+                "tasa_reintento": round((contadores["reparadas"] + contadores["fallidas"]) / total, 4),
+                "tasa_fallo": round(contadores["fallidas"] / total, 4),
+            }
+        return resumen
+
+metricas_validacion = MetricasValidacion()
@@ -0,0 +1,98 @@
+"""Pool de workers que ejecuta los trabajos de generación encolados por /content/*?asincrono=true.
+
+Se escala de forma independiente al API. Ejecutar desde la carpeta backend:
+
+    python -m services.ai_content_service.worker
+"""
+import os
+import signal
+import asyncio
+import logging
+from common.database.database import async_engine
+from common.utils.session_manager import SessionManager
+# Registrar todos los modelos para que las relaciones de Usuario se resuelvan fuera del API
+from common.models.usuario import Usuario, Cuenta  # noqa: F401
+from services.product_service.models import Producto  # noqa: F401
+from .proveedores import cerrar_proveedor
+from .persistencia import persistencia_documentos
+from .handlers import ejecutar_trabajo
+from .pregeneracion import TIPO_PREGENERACION, ejecutar_pregeneracion
+from .lotes import TIPO_LOTE, ejecutar_lote
+from .trabajos import TRABAJOS_VISIBILIDAD, cola_trabajos
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TRABAJOS_WORKERS = int(os.getenv("TRABAJOS_WORKERS", "4"))  # Trabajos simultáneos por proceso
+INTERVALO_LATIDO = TRABAJOS_VISIBILIDAD / 3  # Varios latidos por ventana de visibilidad, aunque alguno falle
+
+# Trabajos con ejecución propia; el resto son pasos del asistente (ejecutar_trabajo)
+EJECUTORES = {
+    TIPO_PREGENERACION: ejecutar_pregeneracion,
+    TIPO_LOTE: ejecutar_lote,
+}
+
+async def latir(id_trabajo: str):
+    """Renueva el trabajo en curso mientras se ejecuta, para que no se reencole aunque dure más que la visibilidad."""
+    while True:
+        await asyncio.sleep(INTERVALO_LATIDO)
+        try:
+            await cola_trabajos.latido(id_trabajo)
+        except Exception as e:
+            logger.warning(f"No se pudo renovar el trabajo {id_trabajo}: {e}")
+
+async def bucle_worker(numero: int, detener: asyncio.Event):
+    """Toma trabajos de la cola hasta que se pide detener el proceso."""
+    while not detener.is_set():
+        try:
+            trabajo = await cola_trabajos.tomar()
+        except Exception as e:
+            logger.error(f"Worker {numero}: error leyendo la cola de trabajos: {e}")
+            await asyncio.sleep(1)
+            continue
+        if trabajo is not None:
+            logger.info(f"Worker {numero}: ejecutando trabajo {trabajo['id']} ({trabajo['tipo']})")
+            latidos = asyncio.create_task(latir(trabajo["id"]))
+            try:
+                await EJECUTORES.get(trabajo["tipo"], ejecutar_trabajo)(trabajo)
+            except Exception as e:
+                # El trabajo queda en proceso y se reencola al vencer su visibilidad (hasta TRABAJOS_MAX_INTENTOS)
+                logger.exception(f"Worker {numero}: error ejecutando el trabajo {trabajo['id']}: {e}")
+            finally:
+                latidos.cancel()
+
+async def bucle_recuperacion(detener: asyncio.Event):
+    """Reencola periódicamente los trabajos de workers caídos."""
+    while not detener.is_set():
+        try:
+            await cola_trabajos.recuperar_huerfanos()
+        except Exception as e:
+            logger.error(f"Error recuperando trabajos huérfanos: {e}")
+        try:
+            await asyncio.wait_for(detener.wait(), TRABAJOS_VISIBILIDAD)
+        except asyncio.TimeoutError:
+            pass
+
+async def ejecutar_pool(workers: int = TRABAJOS_WORKERS):
+    await SessionManager.initialize_redis()
+    persistencia_documentos.iniciar()
+    detener = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for senal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(senal, detener.set)
+
+    logger.info(f"Iniciando {workers} worker(s) de generación")
+    try:
+        # Al detenerse, cada worker termina el trabajo en curso antes de salir
+        await asyncio.gather(
+            bucle_recuperacion(detener),
+            *(bucle_worker(numero, detener) for numero in range(workers)),
+        )
+    finally:
+        await persistencia_documentos.detener()
+        await async_engine.dispose()
+        await SessionManager.close_redis()
+        await cerrar_proveedor()
+
+if __name__ == "__main__":
+    asyncio.run(ejecutar_pool())
@@ -1,13 +1,14 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from .models import Usuario
 from .schemas import RegisterRequest
 from .security import get_password_hash
 from fastapi import HTTPException
 
-def register_user(db: Session, user: RegisterRequest) -> Usuario:
+async def register_user(db: AsyncSession, user: RegisterRequest) -> Usuario:
     # Verificar si el email ya está registrado
-    db_user = db.query(Usuario).filter(Usuario.email == user.email).first()
-    if db_user:
+    resultado = await db.execute(select(Usuario.id_usuario).where(Usuario.email == user.email))
+    if resultado.first():
         raise HTTPException(status_code=400, detail="Email ya registrado")
 
     # Crear un nuevo usuario
@@ -18,6 +19,6 @@ def register_user(db: Session, user: RegisterRequest) -> Usuario:
         contraseña=hashed_password
     )
     db.add(nuevo_usuario)
-    db.commit()
-    db.refresh(nuevo_usuario)
+    await db.commit()
+    await db.refresh(nuevo_usuario)
     return nuevo_usuario
\ No newline at end of file
@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Optional, Tuple
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+from common.models.usuario import Cuenta, Usuario
+from common.utils.session_manager import SessionManager
+
+logger = logging.getLogger(__name__)
+
+# Caché de usuarios autenticados (evita la consulta de Usuario en cada petición)
+USUARIOS_CACHE_HABILITADA = os.getenv("USUARIOS_CACHE_HABILITADA", "true").lower() == "true"
+USUARIOS_CACHE_MAX_ENTRADAS = int(os.getenv("USUARIOS_CACHE_MAX_ENTRADAS", "10000"))  # Tamaño máximo del nivel en memoria
+USUARIOS_CACHE_TTL_MEMORIA = int(os.getenv("USUARIOS_CACHE_TTL_MEMORIA", "30"))        # Acota lo que otra instancia puede ver de un cambio
+USUARIOS_CACHE_TTL_REDIS = int(os.getenv("USUARIOS_CACHE_TTL_REDIS", "300"))
+USUARIOS_CACHE_PREFIJO = "usuario_autenticado:"
+USUARIOS_VERSION_PREFIJO = "usuario_autenticado_version:"  # Se incrementa en cada invalidación del email
+CANAL_INVALIDACION_USUARIOS = "usuarios:invalidacion"
+
+# Escribe la copia solo si la versión del email sigue siendo la leída antes de consultar la base de datos.
+# KEYS[1] = entrada, KEYS[2] = versión; ARGV = versión esperada ("" si no existe), valor, ttl
+_SCRIPT_GUARDAR = """
+local version = redis.call('GET', KEYS[2]) or ''
+if version ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+# (contador local de invalidaciones, versión del email en Redis o None si no se pudo leer)
+MarcaUsuario = Tuple[int, Optional[str]]
+
+@dataclass(frozen=True)
+class CuentaAutenticada:
+    tipo_cuenta: str = "Standard"
+
+@dataclass(frozen=True)
+class UsuarioAutenticado:
+    """Copia inmutable de los campos del usuario que usan las rutas tras autenticar.
+
+    Sustituye a la instancia ORM en `current_user`: no depende de una sesión de
+    base de datos abierta y puede compartirse entre peticiones sin riesgo.
+    """
+    id_usuario: int
+    email: str
+    nombre: str
+    cuenta: Optional[CuentaAutenticada] = None
+
+    @classmethod
+    def desde_usuario(cls, usuario) -> "UsuarioAutenticado":
+        cuenta = CuentaAutenticada(usuario.cuenta.tipo_cuenta) if usuario.cuenta else None
+        return cls(id_usuario=usuario.id_usuario, email=usuario.email, nombre=usuario.nombre, cuenta=cuenta)
+
+    def a_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def desde_json(cls, valor: str) -> "UsuarioAutenticado":
+        datos = json.loads(valor)
+        cuenta = CuentaAutenticada(**datos.pop("cuenta")) if datos.get("cuenta") else None
+        return cls(**{**datos, "cuenta": cuenta})
+
+class CacheUsuarios:
+    """Caché de dos niveles (TTL en memoria delante de Redis) de usuarios autenticados por email.
+
+    Al confirmar cambios en un Usuario o su Cuenta se borra la entrada de Redis,
+    se incrementa la versión del email y se publica en CANAL_INVALIDACION_USUARIOS;
+    cada proceso lo descarta de su nivel en memoria al recibirlo. Mientras el
+    suscriptor no está conectado el nivel en memoria no se usa (y se vacía al
+    reconectar), como en CacheSesiones.
+
+    Quien lee el usuario de la base de datos toma antes `marca(email)` y se la
+    pasa a `guardar`: si la versión cambió entretanto (una invalidación se cruzó
+    con la lectura) la copia, posiblemente obsoleta, no se guarda en ningún nivel.
+    """
+
+    def __init__(self, max_entradas: int = USUARIOS_CACHE_MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self.instancia = uuid.uuid4().hex  # Para ignorar los mensajes publicados por este mismo proceso
+        self._memoria = OrderedDict()  # email -> (UsuarioAutenticado, expira_en)
+        self._tarea: Optional[asyncio.Task] = None
+        self._suscrito = False
+        self._invalidaciones = 0  # Contador para no guardar lecturas que se cruzaron con una invalidación
+        self.estadisticas = {
+            "hits_memoria": 0, "hits_redis": 0, "misses": 0, "invalidaciones": 0, "errores_redis": 0,
+            "invalidaciones_recibidas": 0, "reconexiones": 0, "escrituras_descartadas": 0,
+        }
+
+    @property
+    def memoria_activa(self) -> bool:
+        return self._suscrito
+
+    def _guardar_en_memoria(self, usuario: UsuarioAutenticado, marca: Optional[int] = None):
+        if not self.memoria_activa:
+            return
+        if marca is not None and marca != self._invalidaciones:
+            return  # Llegó una invalidación mientras se leía de Redis: el valor puede estar obsoleto
+        self._memoria[usuario.email] = (usuario, time.monotonic() + USUARIOS_CACHE_TTL_MEMORIA)
+        self._memoria.move_to_end(usuario.email)
+        while len(self._memoria) > self.max_entradas:
+            self._memoria.popitem(last=False)
+
+    async def obtener(self, email: str) -> Optional[UsuarioAutenticado]:
+        if not USUARIOS_CACHE_HABILITADA:
+            return None
+        entrada = self._memoria.get(email) if self.memoria_activa else None
+        if entrada is not None:
+            usuario, expira_en = entrada
+            if expira_en > time.monotonic():
+                self._memoria.move_to_end(email)
+                self.estadisticas["hits_memoria"] += 1
+                return usuario
+            del self._memoria[email]
+
+        redis = SessionManager.redis_client
+        if redis is not None:
+            marca = self._invalidaciones
+            try:
+                valor = await redis.get(USUARIOS_CACHE_PREFIJO + email)
+                if valor is not None:
+                    usuario = UsuarioAutenticado.desde_json(valor)
+                    self._guardar_en_memoria(usuario, marca)
+                    self.estadisticas["hits_redis"] += 1
+                    return usuario
+            except Exception as e:
+                self.estadisticas["errores_redis"] += 1
+                logger.warning(f"Error leyendo la caché de usuarios de Redis: {e}")
+
+        self.estadisticas["misses"] += 1
+        return None
+
+    async def marca(self, email: str) -> MarcaUsuario:
+        """Toma la marca que `guardar` compara; se llama antes de leer el usuario de la base de datos."""
+        local = self._invalidaciones
+        redis = SessionManager.redis_client
+        if not USUARIOS_CACHE_HABILITADA or redis is None:
+            return local, None
+        try:
+            version = await redis.get(USUARIOS_VERSION_PREFIJO + email)
+        except Exception as e:
+            self.estadisticas["errores_redis"] += 1
+            logger.warning(f"Error leyendo la versión del usuario de Redis: {e}")
+            return local, None
+        return local, version or ""
+
+    async def guardar(self, usuario, marca: MarcaUsuario) -> UsuarioAutenticado:
+        """Guarda la copia del usuario ORM en ambos niveles si no hubo invalidaciones desde `marca` y la devuelve."""
+        copia = UsuarioAutenticado.desde_usuario(usuario)
+        if not USUARIOS_CACHE_HABILITADA:
+            return copia
+        local, version = marca
+        redis = SessionManager.redis_client
+        if redis is not None:
+            if version is None:
+                return copia  # Sin versión no se puede descartar que la lectura esté obsoleta
+            try:
+                guardado = await redis.eval(
+                    _SCRIPT_GUARDAR, 2, USUARIOS_CACHE_PREFIJO + copia.email, USUARIOS_VERSION_PREFIJO + copia.email,
+                    version, copia.a_json(), USUARIOS_CACHE_TTL_REDIS,
+                )
+            except Exception as e:
+                self.estadisticas["errores_redis"] += 1
+                logger.warning(f"Error escribiendo en la caché de usuarios de Redis: {e}")
+                return copia
+            if not guardado:
+                self.estadisticas["escrituras_descartadas"] += 1
+                return copia
+        self._guardar_en_memoria(copia, local)
+        return copia
+
+    def descartar(self, email: str):
+        self._invalidaciones += 1
+        self._memoria.pop(email, None)
+
+    async def invalidar(self, *emails: str):
+        """Elimina los usuarios de ambos niveles en todos los procesos (p. ej., el email anterior y el nuevo tras un cambio)."""
+        emails = [email for email in emails if email]
+        for email in emails:
+            self.descartar(email)
+        self.estadisticas["invalidaciones"] += len(emails)
+        redis = SessionManager.redis_client
+        if redis is not None and emails:
+            try:
+                async with redis.pipeline(transaction=False) as pipe:
+                    pipe.delete(*(USUARIOS_CACHE_PREFIJO + email for email in emails))
+                    for email in emails:
+                        # La versión dura lo mismo que una entrada: cubre cualquier lectura en curso
+                        pipe.incr(USUARIOS_VERSION_PREFIJO + email)
+                        pipe.expire(USUARIOS_VERSION_PREFIJO + email, USUARIOS_CACHE_TTL_REDIS)
+                        pipe.publish(CANAL_INVALIDACION_USUARIOS, f"{self.instancia}|{email}")
+                    await pipe.execute()
+            except Exception as e:
+                self.estadisticas["errores_redis"] += 1
+                logger.warning(f"Error invalidando la caché de usuarios de Redis: {e}")
+
+    def iniciar(self, redis):
+        """Arranca el suscriptor de invalidaciones en el event loop actual."""
+        if self._tarea is None and USUARIOS_CACHE_HABILITADA and redis is not None:
+            self._tarea = asyncio.create_task(self._escuchar(redis))
+
+    async def detener(self):
+        if self._tarea is None:
+            return
+        self._tarea.cancel()
+        try:
+            await self._tarea
+        except asyncio.CancelledError:
+            pass
+        self._tarea = None
+        self._suscrito = False
+        self._memoria.clear()
+
+    async def _escuchar(self, redis):
+        espera = 0.5
+        while True:
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.subscribe(CANAL_INVALIDACION_USUARIOS)
+                # Lo guardado antes de (re)conectar pudo invalidarse sin que nos enterásemos
+                self._memoria.clear()
+                self._suscrito = True
+                espera = 0.5
+                while True:
+                    mensaje = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if mensaje is None:
+                        continue
+                    instancia, _, email = mensaje["data"].partition("|")
+                    if instancia != self.instancia:
+                        self.descartar(email)
+                        self.estadisticas["invalidaciones_recibidas"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._suscrito = False
+                self.estadisticas["reconexiones"] += 1
+                logger.warning(f"Suscripción de invalidación de usuarios interrumpida: {e}")
+                await asyncio.sleep(espera)
+                espera = min(espera * 2, 10)
+            finally:
+                self._suscrito = False
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    def resumen(self) -> dict:
+        """Devuelve los contadores de hits/misses y la tasa de aciertos."""
+        hits = self.estadisticas["hits_memoria"] + self.estadisticas["hits_redis"]
+        total = hits + self.estadisticas["misses"]
+        return {
+            **self.estadisticas,
+            "memoria_activa": self.memoria_activa,
+            "entradas_memoria": len(self._memoria),
+            "tasa_aciertos": round(hits / total, 4) if total else 0.0,
+        }
+
+# Instancia compartida por todas las rutas autenticadas del proceso
+cache_usuarios = CacheUsuarios()
+
+# Invalidación automática: cualquier cambio confirmado en un Usuario o su Cuenta (email, nombre,
+# tipo_cuenta, borrado...) invalida la copia en caché, venga de la ruta que venga
+_CLAVE_EMAILS_MODIFICADOS = "usuarios_a_invalidar"
+_tareas_invalidacion = set()
+
+def _emails_afectados(session, objeto):
+    if isinstance(objeto, Usuario):
+        historial = inspect(objeto).attrs.email.history
+        return [objeto.email, *historial.deleted]
+    if isinstance(objeto, Cuenta) and objeto.id_usuario is not None:
+        usuario = inspect(objeto).attrs.usuario.loaded_value
+        if isinstance(usuario, Usuario):
+            return [usuario.email]
+        resultado = session.connection().execute(select(Usuario.email).where(Usuario.id_usuario == objeto.id_usuario))
+        return [resultado.scalar()]
+    return []
+
+@event.listens_for(Session, "after_flush")
+def _recoger_usuarios_modificados(session, contexto):
+    emails = session.info.setdefault(_CLAVE_EMAILS_MODIFICADOS, set())
+    # En after_flush new/dirty/deleted aún reflejan lo que se acaba de escribir
+    modificados = [objeto for objeto in session.dirty if session.is_modified(objeto)]
+    nuevas_cuentas = [objeto for objeto in session.new if isinstance(objeto, Cuenta)]
+    for objeto in modificados + nuevas_cuentas + list(session.deleted):
+        emails.update(email for email in _emails_afectados(session, objeto) if email)
+
+@event.listens_for(Session, "after_commit")
+def _invalidar_usuarios_modificados(session):
+    emails = session.info.pop(_CLAVE_EMAILS_MODIFICADOS, None)
+    if not emails or not USUARIOS_CACHE_HABILITADA:
+        return
+    for email in emails:
+        cache_usuarios.descartar(email)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        logger.warning(f"Commit fuera del event loop: no se invalidan en Redis los usuarios {sorted(emails)}")
+        return
+    tarea = loop.create_task(cache_usuarios.invalidar(*emails))
+    _tareas_invalidacion.add(tarea)
+    tarea.add_done_callback(_tareas_invalidacion.discard)
+
+@event.listens_for(Session, "after_rollback")
+def _olvidar_usuarios_modificados(session):
+    session.info.pop(_CLAVE_EMAILS_MODIFICADOS, None)
@@ -1,16 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Response, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from jose import JWTError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from services.auth_service import security, schemas
-from common.database.database import get_db
+from common.database.database import get_async_db
 from datetime import timedelta
 from common.models.usuario import Usuario, Cuenta
 from common.schemas.usuario import UsuarioCreate, UsuarioResponse
 # from common.utils.session_manager import SessionManager  # Eliminar esta línea
 from services.auth_service.security import get_session_manager  # Importar la dependencia
+from services.auth_service.tokens import AUTH_SIN_ESTADO, COOKIE_TOKEN, revocaciones_tokens
 
 router = APIRouter()
 
+def dispositivo(request: Request):
+    """User-Agent e IP con los que se identifica cada sesión en el listado."""
+    return request.headers.get("user-agent", ""), request.client.host if request.client else ""
+
+def configurar_cookie_token(response: Response, access_token: str):
+    """En modo sin estado el propio JWT firmado viaja en una cookie y las peticiones no consultan Redis."""
+    if not AUTH_SIN_ESTADO:
+        return
+    response.set_cookie(
+        key=COOKIE_TOKEN,
+        value=access_token,
+        httponly=True,
+        samesite="Lax",
+        secure=False,
+        max_age=security.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    )
+
 @router.post(
     "/register",
     response_model=UsuarioResponse,
@@ -20,15 +40,16 @@ router = APIRouter()
 async def register_usuario(
     usuario: UsuarioCreate,
     response: Response,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
     session_manager: security.SessionManager = Depends(get_session_manager)  # Usar la dependencia
 ):
     logs = [
         f"Datos de registro recibidos - Nombre: {usuario.nombre}, Email: {usuario.email}, Contraseña: {usuario.password}"
     ]
 
-    db_usuario = db.query(Usuario).filter(Usuario.email == usuario.email).first()
-    if db_usuario:
+    resultado = await db.execute(select(Usuario.id_usuario).where(Usuario.email == usuario.email))
+    if resultado.first():
         raise HTTPException(status_code=400, detail="El email ya está registrado.")
 
     try:
@@ -51,8 +72,7 @@ async def register_usuario(
 
         # Guardar en la base de datos
         db.add(nuevo_usuario)
-        db.commit()
-        db.refresh(nuevo_usuario)
+        await db.commit()
         logs.append("Usuario y cuenta guardados en la base de datos")
 
         # Generar token JWT
@@ -62,9 +82,9 @@ async def register_usuario(
         )
         logs.append("Token JWT generado")
 
-        # Almacenar el JWT en Redis
-        session_id = f"session_{nuevo_usuario.email}"
-        await session_manager.store_jwt(session_id, access_token)
+        # Almacenar el JWT en Redis en una sesión nueva para este dispositivo
+        agente, ip = dispositivo(request)
+        session_id = await session_manager.crear_sesion(nuevo_usuario.id_usuario, access_token, agente, ip)
         logs.append("Token JWT almacenado en Redis")
 
         # Configurar la cookie con el session_id
@@ -75,6 +95,7 @@ async def register_usuario(
             samesite="Lax",
             secure=False
             )
+        configurar_cookie_token(response, access_token)
         logs.append("Cookie de sesión configurada en la respuesta")
 
         # Imprimir todos los logs en un solo print
@@ -82,21 +103,22 @@ async def register_usuario(
 
         return nuevo_usuario
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error en register_usuario: {e}")
         raise HTTPException(status_code=500, detail="Error al registrar el usuario.")
 
 @router.post("/login", summary="Iniciar sesión de un usuario")
 async def login(
     response: Response,
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     session_manager: security.SessionManager = Depends(get_session_manager)  # Usar la dependencia
 ):
     logs = [f"Intento de inicio de sesión - Email: {form_data.username}"]
 
     # Autenticar al usuario
-    user = security.authenticate_user(db, form_data.username, form_data.password)
+    user = await security.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -110,9 +132,9 @@ async def login(
     )
     logs.append("Token JWT generado")
 
-    # Almacenar el JWT en Redis
-    session_id = f"session_{user.email}"
-    await session_manager.store_jwt(session_id, access_token)
+    # Almacenar el JWT en Redis en una sesión nueva: cada dispositivo conserva la suya
+    agente, ip = dispositivo(request)
+    session_id = await session_manager.crear_sesion(user.id_usuario, access_token, agente, ip)
     logs.append("Token JWT almacenado en Redis")
 
     # Configurar la cookie con el session_id
@@ -123,6 +145,7 @@ async def login(
         samesite="Lax",
         secure=False
     )
+    configurar_cookie_token(response, access_token)
     logs.append("Cookie de sesión configurada en la respuesta")
 
     # Imprimir todos los logs en un solo print
@@ -147,6 +170,17 @@ async def logout(
     else:
         logs.append("No se encontró session_id en las cookies")
 
+    # Modo sin estado: el token sigue siendo válido hasta su exp, así que se revoca su jti
+    token = request.cookies.get(COOKIE_TOKEN)
+    if token:
+        try:
+            claims = security.tokens_verificados.verificar(token)
+            await revocaciones_tokens.revocar(claims.get("jti"), claims.get("exp"))
+            logs.append("Token revocado")
+        except JWTError:
+            pass
+        response.delete_cookie(COOKIE_TOKEN)
+
     # Imprimir todos los logs en un solo print
     print("\n".join(logs))
 
@@ -155,4 +189,40 @@ async def logout(
 @router.get("/check_session", summary="Verificar sesión")
 async def check_session(current_user: Usuario = Depends(security.get_current_user)):
     print(f"Verificación de sesión para el usuario: {current_user.email}")
-    return {"message": "Sesión válida", "user": current_user.email}
\ No newline at end of file
+    return {"message": "Sesión válida", "user": current_user.email}
+
+@router.get("/sesiones", summary="Listar las sesiones activas del usuario")
+async def listar_sesiones(
+    request: Request,
+    current_user: Usuario = Depends(security.get_current_user),
+    session_manager: security.SessionManager = Depends(get_session_manager)
+):
+    sesiones = await session_manager.listar_sesiones(current_user.id_usuario, request.cookies.get("session_id"))
+    return {"sesiones": sesiones}
+
+@router.post("/logout_todas", summary="Cerrar sesión en todos los dispositivos")
+async def logout_todas(
+    response: Response,
+    request: Request,
+    mantener_actual: bool = Query(False, description="Conservar la sesión desde la que se hace la petición"),
+    current_user: Usuario = Depends(security.get_current_user),
+    session_manager: security.SessionManager = Depends(get_session_manager)
+):
+    sesion_actual = request.cookies.get("session_id")
+    cerradas = await session_manager.cerrar_todas(current_user.id_usuario, sesion_actual if mantener_actual else None)
+
+    # Los JWT de las sesiones cerradas también viajan en la cookie del modo sin estado: se revocan todos
+    tokens = []
+    for _, token in cerradas:
+        try:
+            claims = security.tokens_verificados.verificar(token)
+            tokens.append((claims.get("jti"), claims.get("exp")))
+        except JWTError:
+            pass
+    await revocaciones_tokens.revocar_varios(tokens)
+
+    if not mantener_actual:
+        response.delete_cookie("session_id")
+        response.delete_cookie(COOKIE_TOKEN)
+    print(f"Cerradas {len(cerradas)} sesiones del usuario {current_user.id_usuario}")
+    return {"message": "Sesiones cerradas", "cerradas": len(cerradas)}
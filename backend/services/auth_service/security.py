@@ -1,11 +1,16 @@
 from fastapi import Depends, HTTPException, status, Request
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
-from common.database.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from common.database.database import get_async_db
 from common.models.usuario import Usuario
 from passlib.context import CryptContext
 from common.utils.session_manager import SessionManager  # Importar SessionManager
+from services.auth_service.cache_usuarios import cache_usuarios
+from services.auth_service.tokens import AUTH_SIN_ESTADO, COOKIE_TOKEN, TokensVerificados, revocaciones_tokens
 import os
+import secrets
 from datetime import datetime, timedelta, timezone
 import logging
 
@@ -22,6 +27,12 @@ if not SECRET_KEY:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+def decodificar_token(token: str, verificar_exp: bool = True) -> dict:
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": verificar_exp})
+
+# Instancia compartida: claims de los tokens ya verificados (evita repetir el HMAC)
+tokens_verificados = TokensVerificados(decodificar_token)
+
 # Función para inicializar `SessionManager` como dependencia
 async def get_session_manager() -> SessionManager:
     """Devuelve una instancia de SessionManager."""
@@ -39,18 +50,28 @@ def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # El jti identifica al token para poder revocarlo en modo sin estado
+    to_encode.update({"exp": expire, "jti": secrets.token_urlsafe(16)})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 async def get_current_user(
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     session_manager: SessionManager = Depends(get_session_manager),
 ):
-    """Obtiene al usuario actual a partir de un token almacenado en Redis."""
+    """Obtiene al usuario actual a partir de un token almacenado en Redis.
+
+    Con sesión, su vigencia la decide el registro de Redis (expiración deslizante):
+    del JWT guardado se comprueba la firma pero no su `exp`, que solo marca el
+    inicio de sesión. En modo sin estado (AUTH_SIN_ESTADO) se acepta directamente
+    el JWT firmado de la cookie `access_token`, con su `exp` y comprobando que no
+    esté revocado.
+    """
+    token = request.cookies.get(COOKIE_TOKEN) if AUTH_SIN_ESTADO else None
     session_id = request.cookies.get("session_id")
-    if not session_id:
+    desde_sesion = not token
+    if not token and not session_id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Credenciales no proporcionadas.",
@@ -58,30 +79,33 @@ async def get_current_user(
         )
 
     # Obtener el JWT desde Redis
-    try:
-        token = await session_manager.get_jwt(session_id)
-        if not token:
+    if not token:
+        try:
+            token = await session_manager.get_jwt(session_id)
+            if not token:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Sesión inválida o expirada.",
+                    headers={"WWW-Authenticate": "Bearer"},
+                )
+
+            # Convertir bytes a string si es necesario
+            if isinstance(token, bytes):
+                token = token.decode("utf-8")
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error al obtener el token desde Redis: {e}")
             raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Sesión inválida o expirada.",
-                headers={"WWW-Authenticate": "Bearer"},
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Error interno del servidor.",
             )
 
-        # Convertir bytes a string si es necesario
-        if isinstance(token, bytes):
-            token = token.decode("utf-8")
-    except Exception as e:
-        logger.error(f"Error al obtener el token desde Redis: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Error interno del servidor.",
-        )
-
     try:
-        # Decodificar el token y verificar su validez
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Decodificar el token y verificar su validez (los ya verificados salen de la caché)
+        payload = tokens_verificados.verificar(token, verificar_exp=not desde_sesion)
         email: str = payload.get("sub")
-        if email is None:
+        if email is None or revocaciones_tokens.esta_revocado(payload.get("jti")):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Token inválido.",
@@ -94,20 +118,31 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    # Buscar al usuario en la base de datos
-    user = db.query(Usuario).filter(Usuario.email == email).first()
+    # Buscar al usuario: primero en la caché de usuarios autenticados y, si no está, en la base de datos
+    user = await cache_usuarios.obtener(email)
     if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Usuario no encontrado.",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        marca = await cache_usuarios.marca(email)
+        usuario = await buscar_usuario_por_email(db, email)
+        if usuario is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Usuario no encontrado.",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        user = await cache_usuarios.guardar(usuario, marca)
 
     return user
 
-def authenticate_user(db: Session, email: str, password: str):
+async def buscar_usuario_por_email(db: AsyncSession, email: str):
+    """Usuario con su cuenta ya cargada: con AsyncSession no hay carga perezosa de relaciones."""
+    resultado = await db.execute(
+        select(Usuario).options(selectinload(Usuario.cuenta)).where(Usuario.email == email)
+    )
+    return resultado.scalars().first()
+
+async def authenticate_user(db: AsyncSession, email: str, password: str):
     """Autentica a un usuario verificando su email y contraseña."""
-    user = db.query(Usuario).filter(Usuario.email == email).first()
+    user = await buscar_usuario_por_email(db, email)
     if not user:
         return False
     if not verify_password(password, user.contraseña):
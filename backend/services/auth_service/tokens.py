@@ -0,0 +1,164 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from common.utils.session_manager import SessionManager
+
+logger = logging.getLogger(__name__)
+
+# Caché de tokens ya verificados y modo sin estado (cookie con el JWT firmado)
+AUTH_SIN_ESTADO = os.getenv("AUTH_SIN_ESTADO", "false").lower() == "true"      # Confiar en el JWT de la cookie sin pasar por Redis
+TOKENS_CACHE_MAX_ENTRADAS = int(os.getenv("TOKENS_CACHE_MAX_ENTRADAS", "10000"))
+REVOCACIONES_INTERVALO = float(os.getenv("REVOCACIONES_INTERVALO", "2"))      # Segundos entre sincronizaciones con Redis
+COOKIE_TOKEN = "access_token"
+CLAVE_REVOCADOS = "tokens_revocados"                  # Sorted set jti -> exp
+CLAVE_VERSION_REVOCADOS = "tokens_revocados:version"  # Se incrementa con cada revocación
+
+def digest_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+class TokensVerificados:
+    """Claims de los JWT ya verificados, indexados por el digest del token.
+
+    Un token visto hace poco no vuelve a pasar por la verificación HMAC: se
+    devuelven sus claims mientras no alcance su `exp` (o siempre, si quien
+    verifica no exige `exp`, como las sesiones de Redis). Los tokens sin `exp`
+    no se guardan. El tamaño está acotado (LRU).
+    """
+
+    def __init__(self, decodificar: Callable[..., dict], max_entradas: int = TOKENS_CACHE_MAX_ENTRADAS):
+        self._decodificar = decodificar
+        self.max_entradas = max_entradas
+        self._claims = OrderedDict()  # digest -> (claims, exp)
+        self.estadisticas = {"hits": 0, "verificaciones": 0}
+
+    def verificar(self, token: str, verificar_exp: bool = True) -> dict:
+        """Devuelve los claims del token; lanza JWTError si la firma no es válida o (con verificar_exp) ha expirado."""
+        digest = digest_token(token)
+        entrada = self._claims.get(digest)
+        if entrada is not None:
+            claims, exp = entrada
+            if exp > time.time() or not verificar_exp:
+                self._claims.move_to_end(digest)
+                self.estadisticas["hits"] += 1
+                return dict(claims)
+            # Expirado: jwt.decode lanzará ExpiredSignatureError como hasta ahora
+            del self._claims[digest]
+
+        self.estadisticas["verificaciones"] += 1
+        claims = self._decodificar(token, verificar_exp=verificar_exp)
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            self._claims[digest] = (dict(claims), exp)
+            while len(self._claims) > self.max_entradas:
+                self._claims.popitem(last=False)
+        return claims
+
+    def resumen(self) -> dict:
+        total = self.estadisticas["hits"] + self.estadisticas["verificaciones"]
+        return {
+            **self.estadisticas,
+            "entradas": len(self._claims),
+            "tasa_aciertos": round(self.estadisticas["hits"] / total, 4) if total else 0.0,
+        }
+
+class RevocacionesTokens:
+    """Copia en memoria de los `jti` revocados, sincronizada periódicamente desde Redis.
+
+    En modo sin estado el logout revoca el `jti` del token hasta su `exp` en un
+    sorted set de Redis y sube un contador de versión. Cada instancia consulta
+    solo ese contador cada REVOCACIONES_INTERVALO segundos y recarga el conjunto
+    cuando cambia, de modo que comprobar una revocación no cuesta ninguna ida y
+    vuelta a Redis. Las entradas expiradas se descartan en cada recarga.
+    """
+
+    def __init__(self):
+        self._revocados: Dict[str, float] = {}  # jti -> exp
+        self._version: Optional[str] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self._detener: Optional[asyncio.Event] = None
+        self.estadisticas = {"revocaciones": 0, "recargas": 0, "rechazados": 0, "errores_redis": 0}
+
+    def iniciar(self):
+        """Arranca la sincronización en el event loop actual (startup de la aplicación)."""
+        if self._tarea is not None:
+            return
+        self._detener = asyncio.Event()
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self):
+        if self._tarea is None:
+            return
+        self._detener.set()
+        await self._tarea
+        self._tarea = None
+
+    def esta_revocado(self, jti: Optional[str]) -> bool:
+        if not jti:
+            return False
+        exp = self._revocados.get(jti)
+        if exp is None:
+            return False
+        if exp <= time.time():
+            del self._revocados[jti]
+            return False
+        self.estadisticas["rechazados"] += 1
+        return True
+
+    async def revocar(self, jti: Optional[str], exp: Optional[float]):
+        """Revoca el token hasta su expiración, en esta instancia de inmediato y en las demás al sincronizar."""
+        await self.revocar_varios([(jti, exp)])
+
+    async def revocar_varios(self, tokens: List[Tuple[Optional[str], Optional[float]]]):
+        """Revoca varios (jti, exp) con un único pipeline, p. ej. al cerrar todas las sesiones."""
+        ahora = time.time()
+        vigentes = {jti: exp for jti, exp in tokens if jti and exp and exp > ahora}
+        if not vigentes:
+            return
+        self._revocados.update(vigentes)
+        self.estadisticas["revocaciones"] += len(vigentes)
+        redis = SessionManager.redis_client
+        if redis is None:
+            return
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(CLAVE_REVOCADOS, vigentes)
+            pipe.zremrangebyscore(CLAVE_REVOCADOS, "-inf", ahora)
+            pipe.incr(CLAVE_VERSION_REVOCADOS)
+            await pipe.execute()
+
+    async def sincronizar(self):
+        redis = SessionManager.redis_client
+        if redis is None:
+            return
+        try:
+            version = await redis.get(CLAVE_VERSION_REVOCADOS)
+            if version == self._version:
+                return
+            ahora = time.time()
+            revocados = await redis.zrangebyscore(CLAVE_REVOCADOS, ahora, "+inf", withscores=True)
+            # Se conservan las revocaciones locales aún no visibles en Redis
+            locales = {jti: exp for jti, exp in self._revocados.items() if exp > ahora}
+            self._revocados = {**locales, **{jti: exp for jti, exp in revocados}}
+            self._version = version
+            self.estadisticas["recargas"] += 1
+        except Exception as e:
+            # Con Redis caído se sigue usando la última copia conocida
+            self.estadisticas["errores_redis"] += 1
+            logger.warning(f"No se pudo sincronizar la lista de tokens revocados: {e}")
+
+    async def _bucle(self):
+        while not self._detener.is_set():
+            await self.sincronizar()
+            try:
+                await asyncio.wait_for(self._detener.wait(), REVOCACIONES_INTERVALO)
+            except asyncio.TimeoutError:
+                pass
+
+    def resumen(self) -> dict:
+        return {**self.estadisticas, "revocados": len(self._revocados), "sin_estado": AUTH_SIN_ESTADO}
+
+# Instancia compartida por todas las rutas autenticadas del proceso
+revocaciones_tokens = RevocacionesTokens()
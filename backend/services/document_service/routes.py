@@ -1,60 +1,90 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from common.database.database import get_db
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from common.database.database import get_async_db
 from common.models.usuario import Usuario
-from ..ai_content_service.models import Documento
+from ..ai_content_service.models import Documento, calcular_hash_contenido
+from ..ai_content_service.persistencia import sentencia_upsert_documentos
 from services.document_service.schemas import DocumentoCreate, DocumentoUpdate, DocumentoResponse
 from services.auth_service.security import get_current_user
 from datetime import datetime, timezone
 
 router = APIRouter()
 
+async def _buscar_documento(db: AsyncSession, id_documento: int, id_usuario: int):
+    resultado = await db.execute(select(Documento).where(Documento.id_documento == id_documento, Documento.id_usuario == id_usuario))
+    return resultado.scalars().first()
+
 @router.post("/", response_model=DocumentoResponse, status_code=status.HTTP_201_CREATED, summary="Crear un nuevo documento")
-def crear_documento(documento: DocumentoCreate, db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
-    nuevo_documento = Documento(
+async def crear_documento(documento: DocumentoCreate, db: AsyncSession = Depends(get_async_db), current_user: Usuario = Depends(get_current_user)):
+    ahora = datetime.now(timezone.utc)
+    # Si el usuario ya tiene este mismo contenido con el mismo tipo, se reutiliza el documento y se cuenta
+    # la repetición; el upsert evita la carrera entre dos peticiones idénticas simultáneas
+    sentencia = sentencia_upsert_documentos(db.get_bind().dialect.name).values(
         tipo_documento=documento.tipo_documento,
         contenido=documento.contenido,
+        content_hash=calcular_hash_contenido(documento.contenido),
         id_usuario=current_user.id_usuario,
-        fecha_creacion=datetime.now(timezone.utc)
-    )
-    db.add(nuevo_documento)
-    db.commit()
-    db.refresh(nuevo_documento)
-    return nuevo_documento
+        veces_generado=1,
+        fecha_creacion=ahora,
+        fecha_ultima_generacion=ahora
+    ).returning(Documento)
+    resultado = await db.execute(sentencia, execution_options={"populate_existing": True})
+    documento_guardado = resultado.scalars().one()
+    await db.commit()
+    return documento_guardado
 
 @router.get("/{id_documento}", response_model=DocumentoResponse, summary="Obtener información de un documento")
-def obtener_documento(id_documento: int, db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
-    documento = db.query(Documento).filter(Documento.id_documento == id_documento, Documento.id_usuario == current_user.id_usuario).first()
+async def obtener_documento(id_documento: int, db: AsyncSession = Depends(get_async_db), current_user: Usuario = Depends(get_current_user)):
+    documento = await _buscar_documento(db, id_documento, current_user.id_usuario)
     if not documento:
         raise HTTPException(status_code=404, detail="Documento no encontrado.")
     return documento
 
 @router.get("/", response_model=list[DocumentoResponse], summary="Obtener todos los documentos del usuario")
-def listar_documentos(db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
-    documentos = db.query(Documento).filter(Documento.id_usuario == current_user.id_usuario).all()
-    return documentos
+async def listar_documentos(db: AsyncSession = Depends(get_async_db), current_user: Usuario = Depends(get_current_user)):
+    resultado = await db.execute(select(Documento).where(Documento.id_usuario == current_user.id_usuario))
+    return resultado.scalars().all()
 
 @router.put("/{id_documento}", response_model=DocumentoResponse, summary="Actualizar un documento existente")
-def actualizar_documento(id_documento: int, documento_update: DocumentoUpdate, db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
-    documento = db.query(Documento).filter(Documento.id_documento == id_documento, Documento.id_usuario == current_user.id_usuario).first()
+async def actualizar_documento(id_documento: int, documento_update: DocumentoUpdate, db: AsyncSession = Depends(get_async_db), current_user: Usuario = Depends(get_current_user)):
+    documento = await _buscar_documento(db, id_documento, current_user.id_usuario)
     if not documento:
         raise HTTPException(status_code=404, detail="Documento no encontrado.")
     
-    if documento_update.tipo_documento is not None:
-        documento.tipo_documento = documento_update.tipo_documento
+    tipo_documento = documento_update.tipo_documento if documento_update.tipo_documento is not None else documento.tipo_documento
+    content_hash = calcular_hash_contenido(documento_update.contenido) if documento_update.contenido is not None else documento.content_hash
+    if tipo_documento != documento.tipo_documento or content_hash != documento.content_hash:
+        resultado = await db.execute(select(Documento).where(
+            Documento.id_usuario == current_user.id_usuario,
+            Documento.tipo_documento == tipo_documento,
+            Documento.content_hash == content_hash,
+            Documento.id_documento != id_documento
+        ))
+        duplicado = resultado.scalars().first()
+        if duplicado:
+            raise HTTPException(status_code=409, detail=f"Ya existe un documento del mismo tipo con el mismo contenido (id {duplicado.id_documento}).")
+    documento.tipo_documento = tipo_documento
     if documento_update.contenido is not None:
         documento.contenido = documento_update.contenido
+        documento.content_hash = content_hash
     
-    db.commit()
-    db.refresh(documento)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Otra petición guardó ese mismo contenido y tipo entre la comprobación y el commit
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Ya existe un documento del mismo tipo con el mismo contenido.")
+    await db.refresh(documento)
     return documento
 
 @router.delete("/{id_documento}", status_code=status.HTTP_200_OK, summary="Eliminar un documento")
-def eliminar_documento(id_documento: int, db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
-    documento = db.query(Documento).filter(Documento.id_documento == id_documento, Documento.id_usuario == current_user.id_usuario).first()
+async def eliminar_documento(id_documento: int, db: AsyncSession = Depends(get_async_db), current_user: Usuario = Depends(get_current_user)):
+    documento = await _buscar_documento(db, id_documento, current_user.id_usuario)
     if not documento:
         raise HTTPException(status_code=404, detail="Documento no encontrado.")
     
-    db.delete(documento)
-    db.commit()
+    await db.delete(documento)
+    await db.commit()
     return {"msg": "Documento eliminado exitosamente."}
\ No newline at end of file
@@ -31,6 +31,8 @@ class DocumentoResponse(BaseModel):
     contenido: str
     fecha_creacion: datetime
     id_usuario: int
+    veces_generado: int = 1  # Veces que se generó este mismo contenido
+    fecha_ultima_generacion: Optional[datetime] = None
 
     class Config:
         from_attributes = True
\ No newline at end of file
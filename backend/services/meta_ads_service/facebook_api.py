@@ -1,10 +1,31 @@
 from facebook_business.api import FacebookAdsApi
 from facebook_business.exceptions import FacebookRequestError
+from fastapi import HTTPException
+from common.utils.circuit_breaker import crear_circuit_breaker
 import logging
+import os
+
+# Timeout de las llamadas al Graph API (segundos); sin él una llamada colgada retiene el hilo indefinidamente
+GRAPH_TIMEOUT = float(os.getenv("GRAPH_TIMEOUT", "20"))
+
+def es_fallo_graph(error: Exception) -> bool:
+    """Errores que indican que graph.facebook.com está caído o degradado (no los 4xx de la solicitud)."""
+    if isinstance(error, FacebookRequestError):
+        return (error.http_status() or 500) >= 500
+    if isinstance(error, HTTPException):
+        return error.status_code >= 500
+    return True
+
+# Circuito del Graph API, compartido por las llamadas del SDK y las subidas con httpx
+circuito_graph = crear_circuit_breaker(
+    "graph_facebook",
+    latencia_lenta=float(os.getenv("CB_GRAPH_LATENCIA_LENTA", "10")),
+    es_fallo=es_fallo_graph,
+)
 
 def initialize_facebook_api(access_token: str):
     try:
-        FacebookAdsApi.init(access_token=access_token)
+        FacebookAdsApi.init(access_token=access_token, timeout=GRAPH_TIMEOUT)
         logging.info("FacebookAdsApi inicializada correctamente.")
     except FacebookRequestError as e:
         logging.error(f"Error al inicializar FacebookAdsApi: {e}")
@@ -7,7 +7,8 @@ from facebook_business.adobjects.ad import Ad
 from facebook_business.adobjects.adcreative import AdCreative
 from facebook_business.adobjects.adset import AdSet
 from facebook_business.exceptions import FacebookRequestError
-from .facebook_api import initialize_facebook_api
+from .facebook_api import GRAPH_TIMEOUT, circuito_graph, initialize_facebook_api
+from common.utils.circuit_breaker import CircuitoAbiertoError
 import tempfile
 import uuid
 
@@ -74,7 +75,8 @@ def create_campaign(campaign_data: CampaignCreateRequest):
         }
 
         # Crear la campaña
-        campaign = ad_account.create_campaign(params=params_campaign)
+        with circuito_graph.proteger():
+            campaign = ad_account.create_campaign(params=params_campaign)
         campaign_id = campaign.get_id()
         logging.info(f"Campaña creada con éxito. ID: {campaign_id}")
 
@@ -82,6 +84,8 @@ def create_campaign(campaign_data: CampaignCreateRequest):
             message="Campaña creada exitosamente.",
             campaign_id=campaign_id
         )
+    except CircuitoAbiertoError as e:
+        raise e.como_http()
     except FacebookRequestError as e:
         logging.error(f"FacebookRequestError: {e.api_error_message()}")
         raise HTTPException(status_code=400, detail=e.api_error_message())
@@ -100,7 +104,8 @@ def create_ad_set(ad_set_data: AdSetCreateRequest):
         logging.debug("Objeto AdAccount creado correctamente.")
 
         # Validar que la campaña exista y obtener su objetivo
-        campaign = Campaign(ad_set_data.campaign_id).api_get(fields=[Campaign.Field.objective])
+        with circuito_graph.proteger():
+            campaign = Campaign(ad_set_data.campaign_id).api_get(fields=[Campaign.Field.objective])
         campaign_objective = campaign.get('objective')
         logging.debug(f"Objetivo de la campaña obtenida: {campaign_objective}")
 
@@ -155,7 +160,8 @@ def create_ad_set(ad_set_data: AdSetCreateRequest):
             params_adset['dsa_beneficiary'] = ad_set_data.dsa_beneficiary
 
         # Crear el Ad Set
-        ad_set = ad_account.create_ad_set(params=params_adset)
+        with circuito_graph.proteger():
+            ad_set = ad_account.create_ad_set(params=params_adset)
         ad_set_id = ad_set.get_id()
         logging.info(f"Conjunto de anuncios creado con éxito. ID: {ad_set_id}")
 
@@ -163,6 +169,8 @@ def create_ad_set(ad_set_data: AdSetCreateRequest):
             message="Conjunto de anuncios creado exitosamente.",
             ad_set_id=ad_set_id
         )
+    except CircuitoAbiertoError as e:
+        raise e.como_http()
     except FacebookRequestError as e:
         logging.error(f"FacebookRequestError: {e.api_error_message()} (Code: {e.api_error_code()}, Subcode: {e.api_error_subcode()})")
         logging.error(f"Error JSON: {e.body}")
@@ -215,9 +223,12 @@ async def upload_image(file: UploadFile = File(...)):
         form_data = {'filename': sanitized_filename, 'access_token': ACCESS_TOKEN}
 
         # Enviar solicitud
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(timeout=GRAPH_TIMEOUT) as client:
             logging.info(f"Enviando datos: {form_data}, archivo: {sanitized_filename}")
-            response = await client.post(url, data=form_data, files=files)
+            async with circuito_graph.proteger_async():
+                response = await client.post(url, data=form_data, files=files)
+                if response.status_code >= 500:
+                    raise HTTPException(status_code=502, detail="Graph API no disponible al subir la imagen.")
 
         # Validar respuesta
         if response.status_code != 200:
@@ -234,6 +245,8 @@ async def upload_image(file: UploadFile = File(...)):
 
     except HTTPException as e:
         raise e
+    except CircuitoAbiertoError as e:
+        raise e.como_http()
     except Exception as e:
         logging.error(f"Error inesperado: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor.")
@@ -267,7 +280,8 @@ def create_ad_creative(ad_creative_data: AdCreativeCreateRequest):
             raise HTTPException(status_code=400, detail="object_story_spec debe ser un diccionario.")
 
         # Crear el Ad Creative
-        ad_creative = ad_account.create_ad_creative(params=params)
+        with circuito_graph.proteger():
+            ad_creative = ad_account.create_ad_creative(params=params)
         ad_creative_id = ad_creative.get_id()
         logging.info(f"Ad Creative creado con éxito. ID: {ad_creative_id}")
 
@@ -275,6 +289,8 @@ def create_ad_creative(ad_creative_data: AdCreativeCreateRequest):
             message="Ad Creative creado exitosamente.",
             ad_creative_id=ad_creative_id
         )
+    except CircuitoAbiertoError as e:
+        raise e.como_http()
     except FacebookRequestError as e:
         logging.error(f"FacebookRequestError: {e.api_error_message()} (Code: {e.api_error_code()}, Subcode: {e.api_error_subcode()})")
         logging.error(f"Error JSON: {e.body}")
@@ -338,7 +354,8 @@ def create_ad(ad_data: AdCreateRequest):
         logging.debug(f"Parámetros para crear el anuncio: {params_ad}")
         
         # Crear el anuncio
-        ad = ad_account.create_ad(params=params_ad)
+        with circuito_graph.proteger():
+            ad = ad_account.create_ad(params=params_ad)
         ad_id = ad.get_id()
         logging.info(f"Anuncio creado con éxito. ID: {ad_id}")
         
@@ -347,6 +364,8 @@ def create_ad(ad_data: AdCreateRequest):
             ad_id=ad_id
         )
         
+    except CircuitoAbiertoError as e:
+        raise e.como_http()
     except FacebookRequestError as e:
         logging.error(f"FacebookRequestError: {e.api_error_message()} (Code: {e.api_error_code()}, Subcode: {e.api_error_subcode()})")
         logging.error(f"Error JSON: {e.body}")
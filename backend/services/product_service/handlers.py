@@ -1,41 +1,43 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
 from . import models, schemas
 
-def obtener_productos_por_usuario(db: Session, usuario_id: int, skip: int = 0, limit: int = 10):
-    return db.query(models.Producto).filter(models.Producto.id_usuario == usuario_id).offset(skip).limit(limit).all()
+async def obtener_productos_por_usuario(db: AsyncSession, usuario_id: int, skip: int = 0, limit: int = 10):
+    resultado = await db.execute(select(models.Producto).where(models.Producto.id_usuario == usuario_id).offset(skip).limit(limit))
+    return resultado.scalars().all()
 
-def crear_producto(db: Session, producto: schemas.ProductoCreate, usuario_id: int):
+async def crear_producto(db: AsyncSession, producto: schemas.ProductoCreate, usuario_id: int):
     nuevo_producto = models.Producto(**producto.dict(), id_usuario=usuario_id)
     db.add(nuevo_producto)
-    db.commit()
-    db.refresh(nuevo_producto)
+    await db.commit()
+    await db.refresh(nuevo_producto)
     return nuevo_producto
 
-def obtener_producto(db: Session, producto_id: int, usuario_id: int):
-    producto = db.query(models.Producto).filter(models.Producto.id_producto == producto_id, models.Producto.id_usuario == usuario_id).first()
+async def _buscar_producto(db: AsyncSession, producto_id: int, usuario_id: int):
+    resultado = await db.execute(select(models.Producto).where(models.Producto.id_producto == producto_id, models.Producto.id_usuario == usuario_id))
+    producto = resultado.scalars().first()
     if not producto:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado")
     return producto
 
-def actualizar_producto(db: Session, producto_id: int, producto_update: schemas.ProductoUpdate, usuario_id: int):
-    producto = db.query(models.Producto).filter(models.Producto.id_producto == producto_id, models.Producto.id_usuario == usuario_id).first()
-    if not producto:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado")
+async def obtener_producto(db: AsyncSession, producto_id: int, usuario_id: int):
+    return await _buscar_producto(db, producto_id, usuario_id)
+
+async def actualizar_producto(db: AsyncSession, producto_id: int, producto_update: schemas.ProductoUpdate, usuario_id: int):
+    producto = await _buscar_producto(db, producto_id, usuario_id)
     
     for var, value in vars(producto_update).items():
         if value is not None:
             setattr(producto, var, value)
     
-    db.commit()
-    db.refresh(producto)
+    await db.commit()
+    await db.refresh(producto)
     return producto
 
-def eliminar_producto(db: Session, producto_id: int, usuario_id: int):
-    producto = db.query(models.Producto).filter(models.Producto.id_producto == producto_id, models.Producto.id_usuario == usuario_id).first()
-    if not producto:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado")
+async def eliminar_producto(db: AsyncSession, producto_id: int, usuario_id: int):
+    producto = await _buscar_producto(db, producto_id, usuario_id)
     
-    db.delete(producto)
-    db.commit()
-    return {"detail": "Producto eliminado exitosamente"}
\ No newline at end of file
+    await db.delete(producto)
+    await db.commit()
+    return {"detail": "Producto eliminado exitosamente"}
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from common.database.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from common.database.database import get_async_db
 from common.models.usuario import Usuario
 from common.schemas.usuario import UsuarioResponse, UsuarioUpdate
 from datetime import datetime, timezone
@@ -8,28 +10,36 @@ from services.auth_service.security import get_password_hash, get_current_user
 
 router = APIRouter()
 
+async def _buscar_usuario(db: AsyncSession, id_usuario: int):
+    # La respuesta incluye la cuenta: se carga junto al usuario
+    resultado = await db.execute(
+        select(Usuario).options(selectinload(Usuario.cuenta)).where(Usuario.id_usuario == id_usuario)
+    )
+    return resultado.scalars().first()
+
 @router.get("/{id_usuario}", response_model=UsuarioResponse, summary="Obtener información de un usuario")
-def obtener_usuario(id_usuario: int, current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
+async def obtener_usuario(id_usuario: int, current_user: Usuario = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     if current_user.id_usuario != id_usuario:
         raise HTTPException(status_code=403, detail="No tienes permisos para acceder a este recurso.")
-    db_usuario = db.query(Usuario).filter(Usuario.id_usuario == id_usuario).first()
+    db_usuario = await _buscar_usuario(db, id_usuario)
     if not db_usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado.")
     return db_usuario
 
 @router.put("/{id_usuario}", response_model=UsuarioResponse, summary="Actualizar información del usuario")
-def actualizar_usuario(id_usuario: int, usuario: UsuarioUpdate, current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
+async def actualizar_usuario(id_usuario: int, usuario: UsuarioUpdate, current_user: Usuario = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     if current_user.id_usuario != id_usuario:
         raise HTTPException(status_code=403, detail="No tienes permisos para modificar este usuario.")
     
-    db_usuario = db.query(Usuario).filter(Usuario.id_usuario == id_usuario).first()
+    db_usuario = await _buscar_usuario(db, id_usuario)
     if not db_usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado.")
     
     if usuario.email:
         # Verificar si el nuevo email ya está en uso
-        email_existente = db.query(Usuario).filter(Usuario.email == usuario.email).first()
-        if email_existente and email_existente.id_usuario != id_usuario:
+        resultado = await db.execute(select(Usuario.id_usuario).where(Usuario.email == usuario.email))
+        email_existente = resultado.scalars().first()
+        if email_existente is not None and email_existente != id_usuario:
             raise HTTPException(status_code=400, detail="El email ya está registrado por otro usuario.")
         db_usuario.email = usuario.email
     
@@ -46,21 +56,21 @@ def actualizar_usuario(id_usuario: int, usuario: UsuarioUpdate, current_user: Us
     
     db_usuario.fecha_actualizacion_perfil = datetime.now(timezone.utc)
     
-    db.commit()
-    db.refresh(db_usuario)
+    # Al confirmar, la caché de usuarios autenticados invalida el email anterior y el nuevo (ver cache_usuarios)
+    await db.commit()
     
     return db_usuario
 
 @router.delete("/{id_usuario}", status_code=status.HTTP_200_OK, summary="Eliminar un usuario")
-def eliminar_usuario(id_usuario: int, current_user: Usuario = Depends(get_current_user), db: Session = Depends(get_db)):
+async def eliminar_usuario(id_usuario: int, current_user: Usuario = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     if current_user.id_usuario != id_usuario:
         raise HTTPException(status_code=403, detail="No tienes permisos para eliminar este usuario.")
     
-    db_usuario = db.query(Usuario).filter(Usuario.id_usuario == id_usuario).first()
+    db_usuario = await _buscar_usuario(db, id_usuario)
     if not db_usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado.")
     
-    db.delete(db_usuario)
-    db.commit()
+    await db.delete(db_usuario)
+    await db.commit()
     
     return {"msg": "Usuario eliminado exitosamente."}
@@ -1,28 +1,28 @@
+import asyncio
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, patch
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.pool import StaticPool
 from backend.main import app
-from backend.common.database.database import Base, get_db
+from backend.common.database.database import Base, get_async_db
 from backend.common.models.usuario import Usuario, Cuenta
 
-# Crear una URL para la base de datos de prueba (en memoria)
-TEST_DATABASE_URL = "sqlite:///:memory:"
+# Crear una URL para la base de datos de prueba (en memoria, con el driver asíncrono)
+TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 
 # Crear el motor de la base de datos de prueba
-test_engine = create_engine(
+test_engine = create_async_engine(
     TEST_DATABASE_URL,
-    connect_args={"check_same_thread": False},
     poolclass=StaticPool  # Asegura que la base de datos en memoria persista durante toda la sesión de prueba
 )
 
 # Crear una clase de sesión configurada para las pruebas
-TestingSessionLocal = sessionmaker(
-    autocommit=False,
+TestingSessionLocal = async_sessionmaker(
+    test_engine,
+    class_=AsyncSession,
     autoflush=False,
-    bind=test_engine
+    expire_on_commit=False
 )
 
 # Importar todos los modelos antes de crear las tablas
@@ -30,24 +30,22 @@ TestingSessionLocal = sessionmaker(
 from backend.common.models.usuario import Usuario, Cuenta  # Asegúrate de importar todos los modelos necesarios
 
 # Crear las tablas en la base de datos de prueba
-Base.metadata.create_all(bind=test_engine)
+async def crear_tablas():
+    async with test_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
 
-# Fixture para sobrescribir la dependencia get_db
-@pytest.fixture(scope="module")
-def override_get_db():
+asyncio.run(crear_tablas())
+
+# Dependencia que sustituye a `get_async_db`
+async def override_get_async_db():
     """
-    Esta fixture reemplaza la dependencia `get_db` en la aplicación FastAPI para usar la base de datos de prueba.
+    Reemplaza la dependencia `get_async_db` en la aplicación FastAPI para usar la base de datos de prueba.
     """
-    try:
-        # Crear una nueva sesión de la base de datos de prueba
-        db = TestingSessionLocal()
+    async with TestingSessionLocal() as db:
         yield db
-    finally:
-        # Cerrar la sesión después de las pruebas
-        db.close()
 
 # Aplicar la sobrescritura de la dependencia
-app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 # Crear una instancia de TestClient usando la aplicación FastAPI con la dependencia sobrescrita
 client = TestClient(app)
@@ -61,7 +59,7 @@ def mock_redis():
     with patch("backend.services.auth_service.security.SessionManager") as MockSessionManager:
         # Crear una instancia simulada de SessionManager
         instance = MockSessionManager.return_value
-        instance.store_jwt = AsyncMock()
+        instance.crear_sesion = AsyncMock(return_value="sesion-de-prueba")
         instance.get_jwt = AsyncMock()
         instance.delete_jwt = AsyncMock()
         yield instance
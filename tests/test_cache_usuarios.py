@@ -0,0 +1,99 @@
+import sys
+import asyncio
+import pytest
+from types import SimpleNamespace
+import fakeredis.aioredis
+from sqlalchemy import create_engine
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.orm import sessionmaker
+from common.models.usuario import Cuenta, Usuario
+from common.utils.session_manager import SessionManager
+from services.ai_content_service.models import Documento  # noqa: F401 (relaciones de Usuario)
+from services.product_service.models import Producto  # noqa: F401
+from services.auth_service import cache_usuarios as modulo
+from services.auth_service.cache_usuarios import USUARIOS_CACHE_PREFIJO, CacheUsuarios
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(SessionManager, "redis_client", redis)
+    return redis
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = CacheUsuarios()
+    cache._suscrito = True
+    monkeypatch.setattr(modulo, "cache_usuarios", cache)
+    return cache
+
+# test_auth importa los modelos también como `backend.common...`: con dos clases Cuenta en el registro
+# los mappers no se pueden configurar, así que las pruebas con ORM solo corren sin esa doble importación
+requiere_orm = pytest.mark.skipif(
+    "backend.common.models.usuario" in sys.modules, reason="modelos importados dos veces por test_auth"
+)
+
+@pytest.fixture
+def sesion():
+    motor = create_engine("sqlite://")
+    # Solo las tablas (sin índices): otras pruebas pueden haber re-registrado los modelos con extend_existing
+    with motor.begin() as conexion:
+        for tabla in (Usuario.__table__, Cuenta.__table__):
+            conexion.execute(CreateTable(tabla))
+    sesion = sessionmaker(bind=motor, expire_on_commit=False)()
+    usuario = Usuario(nombre="Ana", email="ana@b.com", contraseña="x", cuenta=Cuenta(tipo_cuenta="Standard"))
+    sesion.add(usuario)
+    sesion.commit()
+    yield sesion
+    sesion.close()
+
+# Prueba: una lectura de la base de datos que se cruza con una invalidación no se guarda en ningún nivel
+def test_guardar_descarta_lectura_cruzada(redis, cache):
+    usuario = SimpleNamespace(id_usuario=1, email="ana@b.com", nombre="Ana", cuenta=SimpleNamespace(tipo_cuenta="Standard"))
+
+    async def prueba():
+        marca = await cache.marca(usuario.email)
+        await cache.invalidar(usuario.email)
+        copia = await cache.guardar(usuario, marca)
+        assert copia.email == "ana@b.com"
+        assert await redis.get(USUARIOS_CACHE_PREFIJO + usuario.email) is None
+        assert usuario.email not in cache._memoria
+        assert cache.estadisticas["escrituras_descartadas"] == 1
+
+        await cache.guardar(usuario, await cache.marca(usuario.email))
+        assert (await cache.obtener(usuario.email)).cuenta.tipo_cuenta == "Standard"
+        assert await redis.get(USUARIOS_CACHE_PREFIJO + usuario.email) is not None
+    asyncio.run(prueba())
+
+# Prueba: cambiar el tipo de cuenta (o el email) invalida la copia en caché al confirmar
+@requiere_orm
+def test_commit_invalida_usuario_y_cuenta(redis, cache, sesion):
+    usuario = sesion.query(Usuario).one()
+
+    async def prueba():
+        await cache.guardar(usuario, await cache.marca(usuario.email))
+        usuario.cuenta.tipo_cuenta = "Premium"
+        sesion.commit()
+        assert usuario.email not in cache._memoria
+        await asyncio.sleep(0)
+        assert await redis.get(USUARIOS_CACHE_PREFIJO + "ana@b.com") is None
+
+        await cache.guardar(usuario, await cache.marca(usuario.email))
+        usuario.email = "ana@c.com"
+        sesion.commit()
+        await asyncio.sleep(0)
+        assert cache.estadisticas["invalidaciones"] == 3
+        assert await redis.get(USUARIOS_CACHE_PREFIJO + "ana@b.com") is None
+    asyncio.run(prueba())
+
+# Prueba: un rollback descarta los emails recogidos sin invalidar nada
+@requiere_orm
+def test_rollback_no_invalida(redis, cache, sesion):
+    usuario = sesion.query(Usuario).one()
+
+    async def prueba():
+        usuario.nombre = "Otra"
+        sesion.flush()
+        sesion.rollback()
+        await asyncio.sleep(0)
+        assert cache.estadisticas["invalidaciones"] == 0
+    asyncio.run(prueba())
@@ -0,0 +1,68 @@
+import json
+import asyncio
+import pytest
+from types import SimpleNamespace
+from services.ai_content_service import utils
+from services.ai_content_service.cascada import MODELO_AVANZADO, MODELO_BASICO, EnrutadorModelos
+from services.ai_content_service.handlers import restricciones_encabezados
+from services.ai_content_service.schemas import EncabezadosRespuesta
+from services.ai_content_service.utils import RespuestaGenerada, _generar_validado
+
+class ModelosFalsos:
+    """Sustituye a `_llamar_openai`: devuelve la respuesta preparada para cada modelo y registra las llamadas."""
+
+    def __init__(self, respuestas):
+        self.respuestas = respuestas
+        self.llamadas = []
+
+    async def llamar(self, mensajes, max_tokens, timeout, formato, modelo, esquema, endpoint="general"):
+        self.llamadas.append(modelo)
+        return self.respuestas[modelo]
+
+@pytest.fixture
+def enrutador(monkeypatch):
+    enrutador = EnrutadorModelos()
+    enrutador._cascadas["create_heading"] = ["barato", "capaz"]
+    monkeypatch.setattr(utils, "enrutador_modelos", enrutador)
+    return enrutador
+
+# Prueba: cada tarea tiene su cascada y se puede sobrescribir por variable de entorno
+def test_cascadas_por_tarea(monkeypatch):
+    monkeypatch.setenv("LLM_CASCADA_DEFINIR_CAMPANA", "modelo-a, modelo-b")
+    enrutador = EnrutadorModelos()
+    assert enrutador.cascada("elegir_formato_cta") == [MODELO_BASICO]
+    assert enrutador.cascada("crear_contenido_creativo") == [MODELO_AVANZADO]
+    assert enrutador.cascada("create_heading") == [MODELO_BASICO, MODELO_AVANZADO]
+    assert enrutador.cascada("definir_campana") == ["modelo-a", "modelo-b"]
+    assert enrutador.modelo_mas_capaz("otro") == MODELO_BASICO
+
+def encabezados(*textos, truncado=False):
+    return RespuestaGenerada(json.dumps({"encabezados": list(textos)}), truncado)
+
+def generar(restricciones):
+    return asyncio.run(_generar_validado("prompt", 100, None, EncabezadosRespuesta, "create_heading", restricciones))
+
+# Prueba: si faltan variantes sin truncado, se escala al modelo más capaz
+def test_faltan_variantes_escala(enrutador, monkeypatch):
+    modelos = ModelosFalsos({"barato": encabezados("Uno"), "capaz": encabezados("Uno", "Dos", "Tres")})
+    monkeypatch.setattr(utils, "_llamar_openai", modelos.llamar)
+    respuesta = generar(restricciones_encabezados(SimpleNamespace(variantes=3, longitudMaxima=30)))
+    assert modelos.llamadas == ["barato", "capaz"]
+    assert len(json.loads(respuesta)["encabezados"]) == 3
+
+# Prueba: una respuesta truncada con menos variantes se acepta en el primer modelo, sin escalar ni reparar
+def test_truncada_con_menos_variantes_no_escala(enrutador, monkeypatch):
+    modelos = ModelosFalsos({"barato": encabezados("Uno", truncado=True)})
+    monkeypatch.setattr(utils, "_llamar_openai", modelos.llamar)
+    respuesta = generar(restricciones_encabezados(SimpleNamespace(variantes=3, longitudMaxima=30)))
+    assert modelos.llamadas == ["barato"]
+    assert respuesta.truncado is True
+    assert json.loads(respuesta)["encabezados"] == ["Uno"]
+    assert enrutador.resumen()["create_heading"]["tasa_escalado"] == 0.0
+
+# Prueba: el límite de longitud sigue aplicándose aunque la respuesta venga truncada
+def test_truncada_demasiado_larga_escala(enrutador, monkeypatch):
+    modelos = ModelosFalsos({"barato": encabezados("X" * 40, truncado=True), "capaz": encabezados("Uno", "Dos")})
+    monkeypatch.setattr(utils, "_llamar_openai", modelos.llamar)
+    generar(restricciones_encabezados(SimpleNamespace(variantes=2, longitudMaxima=30)))
+    assert modelos.llamadas == ["barato", "capaz"]
@@ -0,0 +1,129 @@
+import asyncio
+import pytest
+from common.utils import circuit_breaker
+from common.utils.circuit_breaker import ABIERTO, CERRADO, SEMIABIERTO, CircuitBreaker, CircuitoAbiertoError
+
+class RelojFalso:
+    """Sustituye al módulo `time` del circuit breaker para avanzar el tiempo a voluntad."""
+
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def monotonic(self):
+        return self.ahora
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = RelojFalso()
+    monkeypatch.setattr(circuit_breaker, "time", reloj)
+    return reloj
+
+def crear_circuito(**opciones):
+    valores = dict(ventana=30, muestras_minimas=4, umbral_errores=0.5, umbral_lentitud=0.8, espera_apertura=10, pruebas_semiabierto=2)
+    valores.update(opciones)
+    return CircuitBreaker("prueba", latencia_lenta=5, **valores)
+
+def llamar(circuito, fallo=False):
+    try:
+        with circuito.proteger():
+            if fallo:
+                raise RuntimeError("servicio caído")
+    except RuntimeError:
+        pass
+
+def abrir(circuito):
+    for _ in range(4):
+        llamar(circuito, fallo=True)
+    assert circuito.estado == ABIERTO
+
+# Prueba: con pocas muestras en la ventana no se evalúa, aunque todas fallen
+def test_no_abre_sin_muestras_minimas(reloj):
+    circuito = crear_circuito()
+    for _ in range(3):
+        llamar(circuito, fallo=True)
+    assert circuito.estado == CERRADO
+
+# Prueba: superado el umbral de errores se abre y rechaza al instante con Retry-After
+def test_abre_por_errores(reloj):
+    circuito = crear_circuito()
+    llamar(circuito)
+    llamar(circuito)
+    llamar(circuito, fallo=True)
+    assert circuito.estado == CERRADO
+    llamar(circuito, fallo=True)
+    assert circuito.estado == ABIERTO
+    with pytest.raises(CircuitoAbiertoError) as error:
+        llamar(circuito)
+    assert error.value.como_http().headers["Retry-After"] == "10"
+    assert circuito.estadisticas == {"rechazadas": 1, "aperturas": 1}
+
+# Prueba: las llamadas lentas también abren el circuito
+def test_abre_por_lentitud(reloj):
+    circuito = crear_circuito()
+    for _ in range(4):
+        circuito.registrar(prueba=False, fallo=False, latencia=6)
+    assert circuito.estado == ABIERTO
+
+# Prueba: los fallos fuera de la ventana móvil no cuentan
+def test_ventana_movil(reloj):
+    circuito = crear_circuito()
+    for _ in range(3):
+        llamar(circuito, fallo=True)
+    reloj.ahora += 31
+    llamar(circuito, fallo=True)
+    assert circuito.estado == CERRADO
+
+# Prueba: los errores que no son fallos del servicio (p. ej. 4xx) no abren el circuito
+def test_errores_del_cliente_no_cuentan(reloj):
+    circuito = crear_circuito(es_fallo=lambda error: not isinstance(error, RuntimeError))
+    for _ in range(4):
+        llamar(circuito, fallo=True)
+    assert circuito.estado == CERRADO
+
+# Prueba: pasada la espera pasa a semiabierto y se cierra tras las pruebas correctas
+def test_semiabierto_se_cierra(reloj):
+    circuito = crear_circuito()
+    abrir(circuito)
+    reloj.ahora += 10
+    llamar(circuito)
+    assert circuito.estado == SEMIABIERTO
+    llamar(circuito)
+    assert circuito.estado == CERRADO
+    assert circuito.resumen()["llamadas_ventana"] == 0
+
+# Prueba: una prueba fallida en semiabierto vuelve a abrir el circuito
+def test_semiabierto_vuelve_a_abrir(reloj):
+    circuito = crear_circuito()
+    abrir(circuito)
+    reloj.ahora += 10
+    llamar(circuito, fallo=True)
+    assert circuito.estado == ABIERTO
+    assert circuito.estadisticas["aperturas"] == 2
+    with pytest.raises(CircuitoAbiertoError):
+        circuito.verificar()
+
+# Prueba: en semiabierto solo se admiten tantas llamadas simultáneas como pruebas
+def test_semiabierto_limita_pruebas_concurrentes(reloj):
+    circuito = crear_circuito()
+    abrir(circuito)
+    reloj.ahora += 10
+    assert circuito.antes_de_llamar() is True
+    assert circuito.antes_de_llamar() is True
+    with pytest.raises(CircuitoAbiertoError):
+        circuito.antes_de_llamar()
+
+# Prueba: una prueba cancelada libera su hueco sin contar como fallo
+def test_prueba_cancelada_libera_hueco(reloj):
+    circuito = crear_circuito(pruebas_semiabierto=1)
+    abrir(circuito)
+    reloj.ahora += 10
+
+    async def prueba():
+        async with circuito.proteger_async():
+            raise asyncio.CancelledError()
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(prueba())
+    assert circuito.estado == SEMIABIERTO
+    llamar(circuito)
+    assert circuito.estado == CERRADO
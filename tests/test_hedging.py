@@ -0,0 +1,37 @@
+import asyncio
+from services.ai_content_service import hedging
+from services.ai_content_service.hedging import HEDGE_RETRASO_INICIAL, MUESTRAS_MINIMAS, PoliticaHedging
+
+# Prueba: cada endpoint y modelo calcula su retraso con su propia ventana de latencias
+def test_ventana_por_endpoint_y_modelo():
+    politica = PoliticaHedging()
+    for _ in range(MUESTRAS_MINIMAS):
+        politica.registrar_latencia(("create_heading", "mini"), 2.0)
+        politica.registrar_latencia(("crear_contenido_creativo", "grande"), 20.0)
+    assert politica.retraso(("create_heading", "mini")) == 2.0
+    assert politica.retraso(("crear_contenido_creativo", "grande")) == 20.0
+    assert politica.retraso(("create_heading", "grande")) == HEDGE_RETRASO_INICIAL
+    assert politica.resumen()["retraso_actual_s"] == {
+        "create_heading/mini": 2.0, "crear_contenido_creativo/grande": 20.0,
+    }
+
+# Prueba: un endpoint lento no hace que se cubran las llamadas normales de otro más rápido
+def test_cobertura_usa_el_retraso_de_su_clave(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_RETRASO_MINIMO", 0.01)
+    politica = PoliticaHedging()
+    for _ in range(MUESTRAS_MINIMAS):
+        politica.registrar_latencia(("rapido", "mini"), 0.01)
+        politica.registrar_latencia(("lento", "mini"), 5.0)
+    llamadas = []
+
+    async def intento():
+        llamadas.append(1)
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def prueba():
+        assert await politica.ejecutar(intento, ("lento", "mini")) == "ok"
+        assert len(llamadas) == 1
+        assert await politica.ejecutar(intento, ("rapido", "mini")) == "ok"
+        assert len(llamadas) == 3
+    asyncio.run(prueba())
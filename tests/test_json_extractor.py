@@ -0,0 +1,102 @@
+import json
+import pytest
+from services.ai_content_service.json_extractor import (
+    ErrorExtraccionJSON,
+    ExtractorJSONIncremental,
+    extraer_primer_objeto,
+    reparar_json_truncado,
+)
+
+# Respuesta de ejemplo con objetos anidados, arrays y escapes (incluido un par suplente)
+RESPUESTA = '{"titulos": ["Oferta \\"única\\"", "Envío {gratis}"], "meta": {"tono": "caf\\u00e9 \\ud83d\\ude00", "n": 2}}'
+
+# Prueba: extrae el primer objeto ignorando el texto alrededor y las llaves dentro de strings
+def test_extraer_objeto_anidado_con_escapes():
+    datos = extraer_primer_objeto("Aquí tienes:\n```json\n" + RESPUESTA + "\n```\n{\"otro\": 1}")
+    assert datos == json.loads(RESPUESTA)
+
+# Prueba: un candidato con llaves balanceadas pero JSON inválido se descarta y se sigue buscando
+def test_extraer_salta_candidato_invalido():
+    extractor = ExtractorJSONIncremental()
+    assert extractor.alimentar('{no es json} {"ok": true}') == {"ok": True}
+    assert len(extractor.errores) == 1
+    assert extractor.errores[0].offset == 1
+
+# Prueba: alimentado carácter a carácter, el objeto aparece justo al cerrarse
+def test_extraer_por_fragmentos():
+    extractor = ExtractorJSONIncremental()
+    resultados = [extractor.alimentar(caracter) for caracter in "x " + RESPUESTA]
+    assert all(resultado is None for resultado in resultados[:-1])
+    assert resultados[-1] == json.loads(RESPUESTA)
+    assert extractor.finalizar() == json.loads(RESPUESTA)
+
+# Prueba: un escape partido entre dos fragmentos no cierra el string antes de tiempo
+def test_extraer_escape_partido_entre_fragmentos():
+    extractor = ExtractorJSONIncremental()
+    assert extractor.alimentar('{"a": "dice \\') is None
+    assert extractor.alimentar('"hola\\"}"}') == {"a": 'dice "hola"}'}
+
+# Prueba: una respuesta truncada falla indicando las llaves que faltan
+def test_extraer_objeto_incompleto():
+    with pytest.raises(ErrorExtraccionJSON) as error:
+        extraer_primer_objeto('{"a": {"b": "}')
+    assert "faltan 2 llave(s)" in str(error.value)
+
+# Prueba: sin objeto se informa desde el offset 0
+def test_extraer_sin_objeto():
+    with pytest.raises(ErrorExtraccionJSON) as error:
+        extraer_primer_objeto("nada por aquí")
+    assert error.value.offset == 0
+
+# Prueba: un objeto completo se devuelve tal cual y sin marcar como truncado
+def test_reparar_objeto_completo():
+    texto, truncado = reparar_json_truncado("Respuesta: " + RESPUESTA + " fin")
+    assert texto == RESPUESTA
+    assert truncado is False
+
+# Prueba: sin ningún objeto se devuelve el texto sin cambios
+def test_reparar_sin_objeto():
+    assert reparar_json_truncado("sin json") == ("sin json", False)
+
+# Prueba: el elemento incompleto del array abierto se descarta y se cierran los contenedores
+def test_reparar_descarta_elemento_incompleto_del_array():
+    texto, truncado = reparar_json_truncado('{"titulos": ["Uno", "Dos", "Tr')
+    assert truncado is True
+    assert json.loads(texto) == {"titulos": ["Uno", "Dos"]}
+
+# Prueba: un valor string cortado dentro de un objeto se cierra conservando el texto parcial
+def test_reparar_conserva_valor_string_parcial():
+    texto, truncado = reparar_json_truncado('{"titulo": "Hola", "descripcion": "Texto a medi')
+    assert truncado is True
+    assert json.loads(texto) == {"titulo": "Hola", "descripcion": "Texto a medi"}
+
+# Prueba: el corte justo después de una barra descarta el escape incompleto
+def test_reparar_corte_tras_barra():
+    texto, _ = reparar_json_truncado('{"a": "comillas \\')
+    assert json.loads(texto) == {"a": "comillas "}
+
+# Prueba: el corte dentro de un escape \u00.. no deja JSON inválido
+@pytest.mark.parametrize("corte", ['{"a": "caf\\u', '{"a": "caf\\u0', '{"a": "caf\\u00', '{"a": "caf\\u00e'])
+def test_reparar_corte_dentro_de_escape_unicode(corte):
+    texto, truncado = reparar_json_truncado(corte)
+    assert truncado is True
+    assert json.loads(texto) == {"a": "caf"}
+
+# Prueba: no se conserva la mitad alta de un par suplente sin la baja
+def test_reparar_corte_entre_par_suplente():
+    texto, _ = reparar_json_truncado('{"a": "emoji \\ud83d')
+    assert json.loads(texto) == {"a": "emoji "}
+    texto, _ = reparar_json_truncado('{"a": "emoji \\ud83d\\ude')
+    assert json.loads(texto) == {"a": "emoji "}
+
+# Prueba: una barra escapada seguida de "u" no se confunde con un escape unicode
+def test_reparar_barra_escapada_seguida_de_u():
+    texto, _ = reparar_json_truncado('{"a": "ruta C:\\\\ud83d')
+    assert json.loads(texto) == {"a": "ruta C:\\ud83d"}
+
+# Prueba: cualquier prefijo de la respuesta se repara a JSON válido y codificable
+def test_reparar_cualquier_prefijo():
+    for corte in range(1, len(RESPUESTA)):
+        texto, _ = reparar_json_truncado(RESPUESTA[:corte])
+        datos = json.loads(texto)
+        json.dumps(datos, ensure_ascii=False).encode("utf-8")
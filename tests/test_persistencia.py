@@ -0,0 +1,158 @@
+import asyncio
+import pytest
+import fakeredis.aioredis
+from fastapi import HTTPException
+from common.utils.session_manager import SessionManager
+from services.ai_content_service import persistencia
+from services.ai_content_service.persistencia import PersistenciaDocumentos, agrupar_duplicados, fila_documento
+
+# Referencia al sleep real: las pruebas anulan las esperas entre reintentos del módulo
+dormir = asyncio.sleep
+
+class BaseDeDatosFalsa:
+    """Sustituye a `_insertar_lote`: falla las primeras `fallos` veces y registra los lotes insertados."""
+
+    def __init__(self, fallos=0, demora=0.0):
+        self.fallos = fallos
+        self.demora = demora
+        self.lotes = []
+        self.en_curso = 0
+        self.max_en_curso = 0
+
+    async def insertar(self, filas):
+        self.en_curso += 1
+        self.max_en_curso = max(self.max_en_curso, self.en_curso)
+        try:
+            await dormir(self.demora)
+            if self.fallos:
+                self.fallos -= 1
+                raise RuntimeError("base de datos no disponible")
+            self.lotes.append([fila["contenido"] for fila in filas])
+        finally:
+            self.en_curso -= 1
+
+    @property
+    def insertadas(self):
+        return [contenido for lote in self.lotes for contenido in lote]
+
+@pytest.fixture
+def base_de_datos(monkeypatch):
+    base_de_datos = BaseDeDatosFalsa()
+    monkeypatch.setattr(persistencia, "_insertar_lote", base_de_datos.insertar)
+    monkeypatch.setattr(persistencia, "DOCUMENTOS_LOTE", 2)
+    monkeypatch.setattr(persistencia, "DOCUMENTOS_REINTENTOS", 2)
+    monkeypatch.setattr(persistencia, "DOCUMENTOS_WRITE_BEHIND", True)
+    monkeypatch.setattr(SessionManager, "redis_client", None)
+    # Sin esperas entre reintentos
+    monkeypatch.setattr(persistencia.asyncio, "sleep", lambda segundos: dormir(0))
+    return base_de_datos
+
+def filas(*contenidos):
+    return [fila_documento(1, "Informe", contenido) for contenido in contenidos]
+
+# Prueba: las filas repetidas del lote se funden por usuario, tipo y contenido
+def test_agrupar_duplicados():
+    lote = filas("a", "a", "b") + [fila_documento(1, "Reporte", "a"), fila_documento(2, "Informe", "a")]
+    agrupadas = agrupar_duplicados(lote)
+    assert len(agrupadas) == 4
+    assert [fila["veces_generado"] for fila in agrupadas] == [2, 1, 1, 1]
+
+# Prueba: sin volcador en marcha las filas se insertan al encolar
+def test_sin_volcador_inserta_al_encolar(base_de_datos):
+    async def prueba():
+        servicio = PersistenciaDocumentos()
+        await servicio.encolar(1, "Informe", "a")
+        assert base_de_datos.insertadas == ['"a"']
+    asyncio.run(prueba())
+
+# Prueba: agotados los reintentos de la inserción directa se responde 500
+def test_insercion_directa_fallida(base_de_datos):
+    base_de_datos.fallos = 2
+
+    async def prueba():
+        with pytest.raises(HTTPException) as error:
+            await PersistenciaDocumentos().insertar(filas("a"))
+        assert error.value.status_code == 500
+    asyncio.run(prueba())
+
+# Prueba: un lote que falla se reintenta y, si se recupera, se inserta una sola vez
+def test_reintento_de_lote(base_de_datos):
+    base_de_datos.fallos = 1
+
+    async def prueba():
+        servicio = PersistenciaDocumentos()
+        assert await servicio._volcar_lote(filas("a", "b")) is True
+        assert base_de_datos.lotes == [['"a"', '"b"']]
+        assert servicio.estadisticas["reintentos"] == 1
+    asyncio.run(prueba())
+
+# Prueba: un lote fallido vuelve a la cabeza de la cola en su orden y se inserta en el siguiente ciclo
+def test_lote_fallido_vuelve_a_la_cola_en_orden(base_de_datos):
+    base_de_datos.fallos = 2
+
+    async def prueba():
+        servicio = PersistenciaDocumentos()
+        servicio.iniciar()
+        servicio._pendientes.extend(filas("a", "b", "c"))
+        await servicio._volcar_pendientes()
+        assert [fila["contenido"] for fila in servicio._pendientes] == ['"a"', '"b"', '"c"']
+        assert servicio.estadisticas["lotes_fallidos"] == 1
+        await servicio.detener()
+        assert base_de_datos.lotes == [['"a"', '"b"'], ['"c"']]
+    asyncio.run(prueba())
+
+# Prueba: con la cola llena quien encola inserta sus filas y recibe el error si la base de datos falla
+def test_cola_llena_inserta_directamente(base_de_datos, monkeypatch):
+    monkeypatch.setattr(persistencia, "DOCUMENTOS_MAX_PENDIENTES", 3)
+    monkeypatch.setattr(persistencia, "DOCUMENTOS_INTERVALO", 60)
+
+    async def prueba():
+        servicio = PersistenciaDocumentos()
+        servicio.iniciar()
+        await servicio.encolar_filas(filas("a"))
+        base_de_datos.fallos = 2
+        with pytest.raises(HTTPException) as error:
+            await servicio.encolar_filas(filas("b", "c", "d"))
+        assert error.value.status_code == 500
+        assert servicio.resumen()["pendientes"] == 1
+        await servicio.encolar_filas(filas("e", "f", "g"))
+        assert base_de_datos.insertadas[-3:] == ['"e"', '"f"', '"g"']
+        assert servicio.estadisticas["insertadas_directamente"] == 6
+        await servicio.detener()
+        assert sorted(base_de_datos.insertadas) == ['"a"', '"e"', '"f"', '"g"']
+    asyncio.run(prueba())
+
+# Prueba: lo que el cierre no puede insertar se guarda en Redis y el siguiente volcador lo recupera
+def test_cierre_derrama_en_redis_y_se_recupera(base_de_datos, monkeypatch):
+    redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(SessionManager, "redis_client", redis)
+    monkeypatch.setattr(persistencia, "DOCUMENTOS_PLAZO_CIERRE", 0)
+    base_de_datos.fallos = 100
+
+    async def prueba():
+        servicio = PersistenciaDocumentos()
+        servicio.iniciar()
+        await servicio.encolar_filas(filas("a", "b", "c"))
+        await servicio.detener()
+        assert await redis.llen(persistencia.DOCUMENTOS_DERRAMADOS) == 3
+        assert servicio.estadisticas["derramadas"] == 3
+
+        base_de_datos.fallos = 0
+        otro = PersistenciaDocumentos()
+        otro.iniciar()
+        await otro.detener()
+        assert base_de_datos.insertadas == ['"a"', '"b"', '"c"']
+        assert await redis.llen(persistencia.DOCUMENTOS_DERRAMADOS) == 0
+    asyncio.run(prueba())
+
+# Prueba: con DOCUMENTOS_WRITE_BEHIND desactivado (Lambda) no arranca el volcador
+def test_sin_write_behind_no_arranca_volcador(base_de_datos, monkeypatch):
+    monkeypatch.setattr(persistencia, "DOCUMENTOS_WRITE_BEHIND", False)
+
+    async def prueba():
+        servicio = PersistenciaDocumentos()
+        servicio.iniciar()
+        await servicio.encolar(1, "Informe", "a")
+        assert base_de_datos.insertadas == ['"a"']
+        assert servicio.resumen()["pendientes"] == 0
+    asyncio.run(prueba())
@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+from services.ai_content_service.planificador import PlanificadorJusto, PrioridadSolicitud, prioridad_para
+
+# Los turnos crean su futuro en el event loop en marcha: cada prueba corre dentro de uno
+def ejecutar(prueba):
+    return asyncio.run(prueba())
+
+def prioridad(id_usuario, peso=1.0, plazo=60.0):
+    return PrioridadSolicitud(id_usuario=id_usuario, tipo_cuenta="Standard", peso=peso, plazo=plazo)
+
+def orden(planificador, puede_entrar=lambda usuario: True):
+    usuarios = []
+    while True:
+        turno = planificador.siguiente(puede_entrar)
+        if turno is None:
+            return usuarios
+        usuarios.append(turno.prioridad.id_usuario)
+
+# Prueba: el peso de cada tipo de cuenta sale de la configuración del planificador
+def test_prioridad_por_tipo_de_cuenta():
+    usuario = SimpleNamespace(id_usuario=1, cuenta=SimpleNamespace(tipo_cuenta="Premium"))
+    assert prioridad_para(usuario, "create_heading").peso == 4
+    sin_cuenta = SimpleNamespace(id_usuario=2, cuenta=None)
+    assert prioridad_para(sin_cuenta, "create_heading").peso == 1
+
+# Prueba: una cuenta con peso 4 recibe cuatro turnos por cada uno de una con peso 1
+def test_reparto_por_peso():
+    async def prueba():
+        planificador = PlanificadorJusto()
+        for _ in range(3):
+            planificador.encolar(prioridad(1, peso=1))
+        for _ in range(12):
+            planificador.encolar(prioridad(2, peso=4))
+        usuarios = orden(planificador)
+        assert usuarios[:5].count(2) == 4
+        assert usuarios[:10].count(2) == 8
+        assert planificador.en_cola == 0
+    ejecutar(prueba)
+
+# Prueba: un usuario con muchas solicitudes no adelanta a quien llega después con una sola
+def test_usuario_con_rafaga_no_acapara():
+    async def prueba():
+        planificador = PlanificadorJusto()
+        for _ in range(5):
+            planificador.encolar(prioridad(1))
+        planificador.encolar(prioridad(2))
+        assert orden(planificador)[:2] == [1, 2]
+    ejecutar(prueba)
+
+# Prueba: dentro de un mismo usuario se respeta el orden de llegada
+def test_fifo_por_usuario():
+    async def prueba():
+        planificador = PlanificadorJusto()
+        turnos = [planificador.encolar(prioridad(1)) for _ in range(3)]
+        assert [planificador.siguiente(lambda usuario: True) for _ in range(3)] == turnos
+    ejecutar(prueba)
+
+# Prueba: las solicitudes a punto de vencer se atienden antes, por orden de vencimiento
+def test_urgentes_primero():
+    async def prueba():
+        planificador = PlanificadorJusto()
+        planificador.encolar(prioridad(1, peso=8))
+        planificador.encolar(prioridad(2, plazo=0.3))
+        planificador.encolar(prioridad(3, plazo=0.1))
+        assert orden(planificador) == [3, 2, 1]
+    ejecutar(prueba)
+
+# Prueba: los usuarios que no pueden tener más llamadas en vuelo se saltan
+def test_respeta_usuarios_sin_hueco():
+    async def prueba():
+        planificador = PlanificadorJusto()
+        planificador.encolar(prioridad(1, peso=8))
+        planificador.encolar(prioridad(2))
+        assert orden(planificador, lambda usuario: usuario != 1) == [2]
+        assert planificador.en_cola == 1
+    ejecutar(prueba)
+
+# Prueba: un turno cancelado sale de la cola y no se entrega
+def test_cancelar_turno():
+    async def prueba():
+        planificador = PlanificadorJusto()
+        cancelado = planificador.encolar(prioridad(1))
+        planificador.encolar(prioridad(2))
+        planificador.cancelar(cancelado)
+        planificador.cancelar(cancelado)
+        assert orden(planificador) == [2]
+        assert planificador.resumen()["en_cola"] == 0
+    ejecutar(prueba)
@@ -0,0 +1,59 @@
+import json
+import asyncio
+import pytest
+import fakeredis.aioredis
+from pydantic import BaseModel
+from common.utils.session_manager import SessionManager
+from services.ai_content_service import pregeneracion
+from services.ai_content_service.pregeneracion import ejecutar_pregeneracion, invalidar_pregeneracion
+from services.ai_content_service.trabajos import TRABAJO_PREFIJO
+
+class Entradas(BaseModel):
+    nombre: str
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(SessionManager, "redis_client", redis)
+    return redis
+
+def preparar_pasos(monkeypatch, *pasos):
+    """Sustituye los pasos del asistente por generadores de prueba."""
+    monkeypatch.setattr(pregeneracion, "PASOS_CAMPANA", {nombre: (Entradas, generar) for nombre, generar in pasos})
+    monkeypatch.setattr(pregeneracion, "PREGENERACION_PASOS", [nombre for nombre, _ in pasos])
+
+def trabajo(version):
+    datos = {"id_producto": 7, "version": version, "entradas": {"nombre": "Café"}}
+    return {"id": "t1", "id_usuario": "1", "tipo_cuenta": "Standard", "peso": "0.25", "datos": json.dumps(datos)}
+
+async def generar(entradas):
+    return {"texto": entradas.nombre}, None
+
+# Prueba: los resultados se guardan con su TTL renovado en cada escritura
+def test_pregeneracion_completa(redis, monkeypatch):
+    preparar_pasos(monkeypatch, ("uno", generar), ("dos", generar))
+
+    async def prueba():
+        await redis.set("pregeneracion:7", "v1")
+        await ejecutar_pregeneracion(trabajo("v1"))
+        resultados = await redis.hgetall("pregeneracion:7:v1")
+        assert resultados["estado"] == "listo"
+        assert json.loads(resultados["paso:dos"]) == {"texto": "Café"}
+        assert 0 < await redis.ttl("pregeneracion:7:v1") <= pregeneracion.PREGENERACION_TTL
+    asyncio.run(prueba())
+
+# Prueba: si el producto se invalida durante un paso, su resultado no recrea la clave borrada
+def test_invalidacion_durante_un_paso(redis, monkeypatch):
+    async def generar_e_invalidar(entradas):
+        await invalidar_pregeneracion(7)
+        return await generar(entradas)
+
+    preparar_pasos(monkeypatch, ("uno", generar_e_invalidar), ("dos", generar))
+
+    async def prueba():
+        await redis.set("pregeneracion:7", "v1")
+        await ejecutar_pregeneracion(trabajo("v1"))
+        assert await redis.exists("pregeneracion:7:v1") == 0
+        resultado = json.loads(await redis.hget(TRABAJO_PREFIJO + "t1", "resultado"))
+        assert resultado == {"obsoleto": True, "pasos": []}
+    asyncio.run(prueba())
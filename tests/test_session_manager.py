@@ -0,0 +1,142 @@
+import asyncio
+import random
+import pytest
+from common.utils import session_manager
+from common.utils.session_manager import CacheSesiones, SessionManager, referencia_sesion
+
+class PipelineFalso:
+    """Encola las llamadas y las ejecuta en orden sobre el Redis falso."""
+
+    def __init__(self, redis):
+        self._redis = redis
+        self._llamadas = []
+
+    def __getattr__(self, nombre):
+        metodo = getattr(self._redis, "_" + nombre)
+        return lambda *args, **kwargs: self._llamadas.append((metodo, args, kwargs))
+
+    async def execute(self):
+        return [metodo(*args, **kwargs) for metodo, args, kwargs in self._llamadas]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *error):
+        return False
+
+class RedisFalso:
+    """Lo mínimo de Redis que usa SessionManager para crear y listar sesiones."""
+
+    def __init__(self):
+        self.hashes = {}
+        self.ttls = {}
+        self.sets = {}
+        self.muestras = []
+
+    def pipeline(self, transaction=True):
+        return PipelineFalso(self)
+
+    def _hset(self, clave, mapping):
+        self.hashes.setdefault(clave, {}).update({campo: str(valor) for campo, valor in mapping.items()})
+
+    def _expire(self, clave, ttl):
+        self.ttls[clave] = ttl
+
+    def _sadd(self, clave, *miembros):
+        self.sets.setdefault(clave, set()).update(miembros)
+
+    def _hmget(self, clave, *campos):
+        valores = self.hashes.get(clave, {})
+        return [valores.get(campo) for campo in campos]
+
+    def _ttl(self, clave):
+        return self.ttls.get(clave, -2) if clave in self.hashes else -2
+
+    def _exists(self, clave):
+        return int(clave in self.hashes)
+
+    async def smembers(self, clave):
+        return set(self.sets.get(clave, set()))
+
+    async def srandmember(self, clave, cantidad):
+        miembros = sorted(self.sets.get(clave, set()))
+        self.muestras.append(cantidad)
+        return random.sample(miembros, min(cantidad, len(miembros)))
+
+    async def srem(self, clave, *miembros):
+        self.sets.get(clave, set()).difference_update(miembros)
+
+    def caducar(self, session_id):
+        """Simula que Redis expiró la hash de la sesión (el índice la sigue listando)."""
+        clave = session_manager._clave_sesion(session_id)
+        self.hashes.pop(clave, None)
+        self.ttls.pop(clave, None)
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = RedisFalso()
+    monkeypatch.setattr(SessionManager, "redis_client", redis)
+    return redis
+
+def indice(redis, id_usuario):
+    return redis.sets.get(session_manager._clave_indice(id_usuario), set())
+
+# Prueba: cada inicio de sesión crea una sesión opaca propia indexada por usuario
+def test_crear_sesion_por_dispositivo(redis):
+    gestor = SessionManager()
+    primera = asyncio.run(gestor.crear_sesion(7, "jwt-1", "Firefox", "10.0.0.1"))
+    segunda = asyncio.run(gestor.crear_sesion(7, "jwt-2", "Safari", "10.0.0.2"))
+    assert primera != segunda and len(primera) >= 32
+    assert indice(redis, 7) == {primera, segunda}
+
+# Prueba: listar devuelve las sesiones vivas sin exponer su id y poda del índice las caducadas
+def test_listar_poda_caducadas(redis):
+    gestor = SessionManager()
+    viva = asyncio.run(gestor.crear_sesion(7, "jwt-1", "Firefox", "10.0.0.1"))
+    caducada = asyncio.run(gestor.crear_sesion(7, "jwt-2", "Safari", "10.0.0.2"))
+    redis.caducar(caducada)
+
+    sesiones = asyncio.run(gestor.listar_sesiones(7, sesion_actual=viva))
+    assert [(sesion["id"], sesion["actual"], sesion["agente"]) for sesion in sesiones] == [
+        (referencia_sesion(viva), True, "Firefox")
+    ]
+    assert viva not in str(sesiones)
+    assert indice(redis, 7) == {viva}
+
+# Prueba: crear una sesión solo comprueba una muestra acotada del índice y poda sus caducadas
+def test_crear_sesion_poda_una_muestra_acotada(redis, monkeypatch):
+    monkeypatch.setattr(session_manager, "SESIONES_PODA_MUESTRA", 3)
+    gestor = SessionManager()
+    antiguas = [asyncio.run(gestor.crear_sesion(7, f"jwt-{numero}")) for numero in range(10)]
+    for session_id in antiguas:
+        redis.caducar(session_id)
+
+    nueva = asyncio.run(gestor.crear_sesion(7, "jwt-nuevo"))
+    assert redis.muestras[-1] == 3
+    assert len(indice(redis, 7)) == 10 - 3 + 1
+    assert nueva in indice(redis, 7)
+
+    # La poda completa llega al listar
+    assert len(asyncio.run(gestor.listar_sesiones(7))) == 1
+    assert indice(redis, 7) == {nueva}
+
+# Prueba: la caché L1 solo se usa con el suscriptor conectado y descarta lecturas cruzadas con una invalidación
+def test_cache_sesiones_invalidacion():
+    cache = CacheSesiones(max_entradas=2)
+    cache.guardar("s1", "jwt-1", 60)
+    assert cache.obtener("s1") is None
+
+    cache._suscrito = True
+    cache.guardar("s1", "jwt-1", 60)
+    assert cache.obtener("s1") == "jwt-1"
+    cache.descartar("s1")
+    assert cache.obtener("s1") is None
+
+    marca = cache.marca()
+    cache.descartar("s2")
+    cache.guardar("s2", "jwt-2", 60, marca)
+    assert cache.obtener("s2") is None
+
+    for session_id in ("a", "b", "c"):
+        cache.guardar(session_id, "jwt", 60)
+    assert cache.obtener("a") is None and cache.obtener("c") == "jwt"
@@ -0,0 +1,124 @@
+import asyncio
+import pytest
+from jose import ExpiredSignatureError
+from common.utils.session_manager import SessionManager
+from services.auth_service import tokens
+from services.auth_service.tokens import RevocacionesTokens, TokensVerificados
+
+class RelojFalso:
+    """Sustituye al módulo `time` de tokens para avanzar el tiempo a voluntad."""
+
+    def __init__(self):
+        self.ahora = 1_000_000.0
+
+    def time(self):
+        return self.ahora
+
+class RedisRevocados:
+    """Lo mínimo de Redis que usa RevocacionesTokens.sincronizar."""
+
+    def __init__(self, version, revocados):
+        self.version = version
+        self.revocados = revocados  # jti -> exp
+        self.lecturas = 0
+
+    async def get(self, clave):
+        return self.version
+
+    async def zrangebyscore(self, clave, minimo, maximo, withscores=False):
+        self.lecturas += 1
+        return [(jti, exp) for jti, exp in self.revocados.items() if exp >= minimo]
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = RelojFalso()
+    monkeypatch.setattr(tokens, "time", reloj)
+    return reloj
+
+@pytest.fixture
+def sin_redis(monkeypatch):
+    monkeypatch.setattr(SessionManager, "redis_client", None)
+
+def decodificador(reloj, llamadas):
+    """Decodificador de prueba: "sin_exp" no trae exp, "caducado" expiró hace un segundo y el resto vence en 60 s."""
+    def decodificar(token, verificar_exp=True):
+        llamadas.append(token)
+        if token == "sin_exp":
+            return {"sub": "a@b.com"}
+        if token == "caducado":
+            if verificar_exp:
+                raise ExpiredSignatureError("Signature has expired.")
+            return {"sub": "a@b.com", "exp": reloj.ahora - 1}
+        return {"sub": "a@b.com", "exp": reloj.ahora + 60}
+    return decodificar
+
+# Prueba: un token ya verificado sale de la caché sin repetir la verificación hasta su exp
+def test_tokens_verificados_cachea_hasta_exp(reloj):
+    llamadas = []
+    verificados = TokensVerificados(decodificador(reloj, llamadas))
+    assert verificados.verificar("token")["sub"] == "a@b.com"
+    assert verificados.verificar("token")["sub"] == "a@b.com"
+    assert len(llamadas) == 1
+    reloj.ahora += 61
+    verificados.verificar("token")
+    assert len(llamadas) == 2
+    assert verificados.resumen()["hits"] == 1
+
+# Prueba: los tokens sin exp no se guardan y el tamaño de la caché está acotado
+def test_tokens_verificados_sin_exp_y_lru(reloj):
+    llamadas = []
+    verificados = TokensVerificados(decodificador(reloj, llamadas), max_entradas=2)
+    verificados.verificar("sin_exp")
+    verificados.verificar("sin_exp")
+    assert len(llamadas) == 2
+    for token in ("t1", "t2", "t3"):
+        verificados.verificar(token)
+    assert verificados.resumen()["entradas"] == 2
+
+# Prueba: sin exigir exp (sesiones de Redis) se aceptan tokens caducados; exigiéndolo, no
+def test_tokens_verificados_sin_verificar_exp(reloj):
+    verificados = TokensVerificados(decodificador(reloj, []))
+    assert verificados.verificar("caducado", verificar_exp=False)["sub"] == "a@b.com"
+    with pytest.raises(ExpiredSignatureError):
+        verificados.verificar("caducado")
+
+# Prueba: una revocación rige hasta el exp del token y después se descarta
+def test_revocacion_caduca_con_el_token(reloj, sin_redis):
+    revocaciones = RevocacionesTokens()
+    asyncio.run(revocaciones.revocar("jti-1", reloj.ahora + 30))
+    assert revocaciones.esta_revocado("jti-1") is True
+    assert revocaciones.esta_revocado("otro") is False
+    assert revocaciones.esta_revocado(None) is False
+    reloj.ahora += 30
+    assert revocaciones.esta_revocado("jti-1") is False
+    assert revocaciones.resumen()["revocados"] == 0
+
+# Prueba: no se revocan tokens ya caducados ni sin jti
+def test_revocar_ignora_caducados(reloj, sin_redis):
+    revocaciones = RevocacionesTokens()
+    asyncio.run(revocaciones.revocar_varios([("viejo", reloj.ahora - 1), (None, reloj.ahora + 30), ("nuevo", reloj.ahora + 30)]))
+    assert revocaciones.estadisticas["revocaciones"] == 1
+    assert revocaciones.esta_revocado("viejo") is False
+    assert revocaciones.esta_revocado("nuevo") is True
+
+# Prueba: la sincronización recarga solo si cambia la versión, sin perder las revocaciones locales vigentes
+def test_sincronizar_por_version(reloj, monkeypatch):
+    redis = RedisRevocados("1", {"remoto": reloj.ahora + 60, "remoto_caducado": reloj.ahora - 1})
+    monkeypatch.setattr(SessionManager, "redis_client", None)
+    revocaciones = RevocacionesTokens()
+    asyncio.run(revocaciones.revocar("local", reloj.ahora + 60))
+    monkeypatch.setattr(SessionManager, "redis_client", redis)
+
+    asyncio.run(revocaciones.sincronizar())
+    assert revocaciones.esta_revocado("remoto") and revocaciones.esta_revocado("local")
+    assert revocaciones.esta_revocado("remoto_caducado") is False
+    asyncio.run(revocaciones.sincronizar())
+    assert redis.lecturas == 1
+
+    redis.version = "2"
+    redis.revocados["otro"] = reloj.ahora + 10
+    asyncio.run(revocaciones.sincronizar())
+    assert redis.lecturas == 2
+    assert revocaciones.esta_revocado("otro") is True
+    reloj.ahora += 10
+    assert revocaciones.esta_revocado("otro") is False
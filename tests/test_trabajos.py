@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+import fakeredis.aioredis
+from common.utils.session_manager import SessionManager
+from services.ai_content_service import trabajos
+from services.ai_content_service.planificador import PrioridadSolicitud
+from services.ai_content_service.trabajos import COLA_EN_PROCESO, TRABAJO_PREFIJO, ColaTrabajos
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(SessionManager, "redis_client", redis)
+    monkeypatch.setattr(trabajos, "TRABAJOS_MAX_INTENTOS", 2)
+    return redis
+
+async def abandonar(redis, id_trabajo):
+    """Simula un worker caído: el trabajo queda en proceso sin latidos más allá de la visibilidad."""
+    await redis.hset(TRABAJO_PREFIJO + id_trabajo, "actualizado", 0)
+
+# Prueba: cada toma cuenta un intento y, agotados, el trabajo huérfano se da por fallido en vez de reencolarse
+def test_huerfano_agota_intentos(redis):
+    async def prueba():
+        cola = ColaTrabajos()
+        id_trabajo = await cola.encolar("create_heading", {}, PrioridadSolicitud(1, "Standard", 1.0))
+
+        assert (await cola.tomar())["intentos"] == "1"
+        await abandonar(redis, id_trabajo)
+        assert await cola.recuperar_huerfanos() == 1
+        assert (await cola.obtener(id_trabajo))["estado"] == "pendiente"
+
+        assert (await cola.tomar())["intentos"] == "2"
+        await abandonar(redis, id_trabajo)
+        assert await cola.recuperar_huerfanos() == 0
+        trabajo = await cola.obtener(id_trabajo)
+        assert trabajo["estado"] == "fallido" and "2 intentos" in trabajo["error"]
+        assert await redis.llen(COLA_EN_PROCESO) == 0
+        assert await cola.tomar(timeout=0.01) is None
+    asyncio.run(prueba())
+
+# Prueba: el latido renueva un trabajo en curso pero no recrea uno que ya expiró
+def test_latido_no_recrea_trabajos_expirados(redis):
+    async def prueba():
+        cola = ColaTrabajos()
+        id_trabajo = await cola.encolar("create_heading", {}, PrioridadSolicitud(1, "Standard", 1.0))
+        await abandonar(redis, id_trabajo)
+        await cola.latido(id_trabajo)
+        assert float((await cola.obtener(id_trabajo))["actualizado"]) > 0
+
+        await cola.latido("expirado")
+        assert await redis.exists(TRABAJO_PREFIJO + "expirado") == 0
+    asyncio.run(prueba())